@@ -18,27 +18,97 @@
 
 import logging
 
-from . evars import *
-from . ecit import *
-from . ecitmatch import *
-from . efetch import *
-from . egquery import *
-from . einfo import *
-from . elink import *
-from . epost import *
-from . esearch import *
-from . espell import *
-from . esummary import *
-from . eresults import *
+#
+# Public names are loaded lazily (PEP 562): importing the package does not import any
+# submodule, nor ``requests`` or ``bs4``, until one of the names below is first accessed.
+#
+
+_submodules = {
+    "evars"         : [ "EUTILS_APPNAME", "EUTILS_BASE" ],
+    "epipe"         : [ "state" ],
+    "elog"          : [ "truncated", "EJSONFormatter", "LOG_TRUNCATE", "debugging" ],
+    "elimit"        : [ "ERateLimiter", "ELocalBucket", "EFileBucket", "ERemoteBucket", "EUTILS_RATE",
+                        "EUTILS_RATE_APIKEY" ],
+    "emetrics"      : [ "EObserver", "EMetrics", "ERequestRecord", "EStageRecord", "add_observer",
+                        "remove_observer", "observing", "notify_request", "notify_stage", "current_stage",
+                        "timed_stage", "timed_parse", "EMETRICS_BUCKETS" ],
+    "etrace"        : [ "enable_tracing", "disable_tracing", "tracing", "span", "traced" ],
+    "etransport"    : [ "ETransport", "AsyncETransport", "get_transport", "set_transport", "EUTILS_POST_SIZE",
+                        "EUTILS_TIMEOUT" ],
+    "ebatch"        : [ "EBatchSizer", "EBATCH_LIMITS", "get_batch_sizer", "set_batch_sizer" ],
+    "edeadline"     : [ "ECancelToken", "ECancelled", "EDeadlineExceeded", "current_token", "check_cancelled", "bound" ],
+    "ecit"          : [ "ECit" ],
+    "ecitmatch"     : [ "ECitMatch", "ecitmatch_bulk" ],
+    "eexport"       : [ "ETableWriter", "EParquetWriter", "EArrowWriter", "ECSVWriter", "ENPYWriter", "table_writer",
+                        "have_pyarrow", "export_rows", "export_ids", "export_links", "export_docsums" ],
+    "efetch"        : [ "EFetch", "esearch_elink_efetch", "esearch_elink_efetch_xml", "esearch_elink_efetch_asn1" ],
+    "egquery"       : [ "EGQuery", "egquery_counts" ],
+    "eharvest"      : [ "ECheckpoint", "EHarvest", "efetch_harvest", "esummary_harvest" ],
+    "eindex"        : [ "EFastaIndexer", "ERecordIndexer", "EIndexedFile", "build_index" ],
+    "einfo"         : [ "EInfo", "EInfoCache", "get_einfo_cache", "set_einfo_cache" ],
+    "elink"         : [ "ELink", "elink", "elink_nh", "elink_ns", "elink_acheck", "elink_lcheck",
+                        "elink_ncheck", "elink_llinks" ],
+    "eparse"        : [ "EParsePool", "get_parse_pool", "set_parse_pool", "parse_fasta", "parse_tseq",
+                        "parse_docsums", "parse_links" ],
+    "epayload"      : [ "EPayload", "unquote_term" ],
+    "epost"         : [ "EPost" ],
+    "eregion"       : [ "ERegionFetch", "efetch_regions", "reverse_complement" ],
+    "escheduler"    : [ "EScheduler", "ESCHEDULER_CLASSES", "scheduled", "current_scheduling" ],
+    "esearch"       : [ "ESearch", "esearch", "esearch_pubmed" ],
+    "esession"      : [ "ESession", "EHistoryEntry", "ESESSION_TTL" ],
+    "espell"        : [ "ESpell", "ESpellCache", "get_espell_cache", "set_espell_cache", "espell_batch" ],
+    "esync"         : [ "ESync" ],
+    "esummary"      : [ "ESummary", "esearch_elink_esummary" ],
+    "eresults"      : [ "EResults" ],
+}
+
+_names = { name : module for module, names in _submodules.items() for name in names }
+
+__all__ = [ "log_setup" ] + list(_names)
+
+def __getattr__(name):
+
+    module = _names.get(name)
+
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    import importlib
+
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+
+    globals()[name] = value
+
+    #
+    # Importing a submodule binds it as a package attribute: keep the convenience
+    # functions named after their submodule (esearch, elink) bound instead
+    #
+
+    import sys
+
+    for function in ("esearch", "elink"):
+        if f"{__name__}.{function}" in sys.modules:
+            globals()[function] = getattr(sys.modules[f"{__name__}.{function}"], function)
+
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_names))
 
 
 def log_setup(linefmt='%(levelname)s: %(asctime)s : %(message)s', datefmt='%H:%M:%S',
-        loglevel=logging.DEBUG):
+        loglevel=logging.DEBUG, structured=False):
 
         """
         Setup system logger with a given line format, date format and loglevel,
         optionally using colored loglines if available.
 
+        If ``structured`` is True, log records are emitted as single-line JSON objects
+        (see elog.EJSONFormatter).
+
+        N.B.: Not called on import (root logger handlers are replaced): applications and
+              scripts wanting pyeutils' own log format have to call it explicitly.
+
         """
 
         formatter = handler = None
@@ -51,7 +121,11 @@ def log_setup(linefmt='%(levelname)s: %(asctime)s : %(message)s', datefmt='%H:%M
         )
 
         try:
-            if os.isatty(2):
+            if structured:
+                from . elog import EJSONFormatter
+                formatter = EJSONFormatter(datefmt=datefmt)
+
+            elif os.isatty(2):
                 import colorlog
                 logging.info("[LOG] Setting colored format")
                 cformat = '%(log_color)s' + linefmt
@@ -63,16 +137,12 @@ def log_setup(linefmt='%(levelname)s: %(asctime)s : %(message)s', datefmt='%H:%M
         except:
                 logging.info("[LOG] Setting default format")
                 formatter = logging.Formatter(fmt=linefmt, datefmt=datefmt)
+
+        if formatter is None:
+            formatter = logging.Formatter(fmt=linefmt, datefmt=datefmt)
         
         handler = logging.StreamHandler()        
         handler.setFormatter(formatter)
 
         logging.getLogger().handlers = [ handler ]
         logging.getLogger().propagate = False
-
-try:
-    log_setup(loglevel=logging.INFO)
-except Exception as e:
-    print(str(e))
-    os.exit(4)
-
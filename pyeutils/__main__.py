@@ -29,7 +29,7 @@ queries = [
     defaultquery3
 ]
 
-from efetch import esearch_elink_efetch as efetch1
+from pyeutils.efetch import esearch_elink_efetch as efetch1
 
 import sys
 
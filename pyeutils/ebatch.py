@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 Giulio Piemontese <gpiemont [at] protonmail.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from . import logging
+
+import re
+import threading
+
+#
+# Largest windows accepted by the E-utilities (retmax)
+#
+
+EBATCH_LIMITS = {
+    "efetch"    : 10000,
+    "esummary"  : 10000,
+    "esearch"   : 10000,
+    "elink"     : 10000,
+}
+
+class EBatchSizer(object):
+
+    """
+    EBatchSizer Class object:
+
+    Adaptive window (retmax) sizes, per endpoint and db. Windowed retrievals ask for the
+    size of their next window, and the transport reports how every windowed request went:
+
+    · a window answered within ``target`` seconds grows the size by ``growth``
+    · a slower window scales the size down in proportion to the latency excess
+    · a timeout, an HTTP 414 or 5xx, or a truncated response halves the size
+
+    Sizes stay within [``minimum``, the endpoint limit (EBATCH_LIMITS) or ``maximum``].
+
+        sizer = get_batch_sizer()
+        sizer.size("efetch", "protein")     << 500, then adapting to NCBI's behaviour
+
+    """
+
+    def __init__(self, initial=500, minimum=20, maximum=10000, target=3.0, growth=1.5, shrink=0.5):
+
+        """
+        initial         : Size of the first window of every (endpoint, db)
+        minimum         : Smallest size
+        maximum         : Largest size (further bound by EBATCH_LIMITS)
+        target          : Latency, in seconds, windows should not exceed
+        growth          : Growth factor of windows answered within ``target``
+        shrink          : Shrink factor on failures and truncated responses
+
+        """
+
+        self._initial   = initial
+        self._minimum   = minimum
+        self._maximum   = maximum
+        self._target    = target
+        self._growth    = growth
+        self._shrink    = shrink
+
+        self._sizes     = {}
+        self._lock      = threading.Lock()
+
+    def _limit(self, endpoint):
+        return min(self._maximum, EBATCH_LIMITS.get(endpoint, self._maximum))
+
+    def size(self, endpoint, db):
+
+        """
+        Return the size of the next window of ``endpoint`` on ``db``
+        """
+
+        with self._lock:
+            return self._sizes.get((endpoint, db), min(self._initial, self._limit(endpoint)))
+
+    def observe(self, endpoint, db, size, elapsed, status=200, truncated=False):
+
+        """
+        Adapt the window size of ``endpoint`` on ``db`` to a request for ``size`` records.
+
+        elapsed         : Seconds taken by the request
+        status          : HTTP status of the response (None on timeouts)
+        truncated       : True if the response was cut short
+
+        """
+
+        failed = status is None or status == 414 or status >= 500 or truncated
+
+        if not failed and status != 200:
+            return
+
+        key = (endpoint, db)
+
+        with self._lock:
+            current = self._sizes.get(key, min(self._initial, self._limit(endpoint)))
+
+            if failed:
+                #
+                # Shrink from the failed size, which may be smaller than the current one
+                # when concurrent windows already grew it
+                #
+
+                updated = int(min(current, size) * self._shrink)
+
+            elif elapsed > self._target:
+                updated = min(current, int(size * self._target / elapsed))
+
+            elif size >= current:
+                #
+                # Grow only on windows of the current size: smaller (e.g. last) windows
+                # say nothing about larger ones
+                #
+
+                updated = int(current * self._growth)
+
+            else:
+                return
+
+            updated = max(self._minimum, min(updated, self._limit(endpoint)))
+
+            self._sizes[key] = updated
+
+        if updated != current:
+            logging.debug("[BATCH] %s window size on '%s' : %d → %d (%s)", endpoint, db, current, updated,
+                          "timeout" if status is None else "truncated" if truncated else
+                          f"HTTP {status}" if status != 200 else f"{elapsed:.2f}s")
+
+    def sizes(self):
+
+        """
+        Return the current sizes, as { (endpoint, db) : size }
+        """
+
+        with self._lock:
+            return dict(self._sizes)
+
+    def reset(self):
+
+        with self._lock:
+            self._sizes.clear()
+
+_root = re.compile(rb"<(?![?!])([^\s>/]+)")
+
+def truncated_response(data, retmode="xml"):
+
+    """
+    Return True if ``data`` (bytes) is visibly cut short: XML whose root element is not
+    closed, or text not ending with a newline
+    """
+
+    if not data.strip():
+        return False
+
+    if retmode == "xml":
+        data = data.rstrip()
+        root = _root.search(data, 0, 4096)
+
+        return root is not None and not data.endswith(b"</" + root.group(1) + b">")
+
+    return retmode == "text" and not data.endswith(b"\n")
+
+#
+# Process-wide batch sizer, shared by every windowed retrieval
+#
+
+_sizer      = None
+_sizer_lock = threading.Lock()
+
+def get_batch_sizer():
+
+    """
+    Return the batch sizer shared by windowed retrievals (created on first use)
+    """
+
+    global _sizer
+
+    if _sizer is None:
+        with _sizer_lock:
+            if _sizer is None:
+                _sizer = EBatchSizer()
+
+    return _sizer
+
+def set_batch_sizer(sizer):
+
+    """
+    Replace the process-wide batch sizer, returning the previous one
+    """
+
+    global _sizer
+
+    previous, _sizer = _sizer, sizer
+
+    return previous
+
+all = [ EBatchSizer, EBATCH_LIMITS, get_batch_sizer, set_batch_sizer, truncated_response ]
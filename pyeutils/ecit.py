@@ -49,22 +49,42 @@ class ECit(object):
                 title_expr = title.replace(' ', '+')
                 author_expr = author.replace(' ', '+')
 
-                obj = "|".join([f"{title_expr}", f"{year}", f"{volume}", f"{first_page}", f"{author_expr}", f"{key}"])
+                obj = "|".join([f"{title_expr}", f"{year}", f"{volume}", f"{first_page}", f"{author_expr}", f"{key}", ""])
 
                 self._bdata.append(obj)
 
         def __add__(self, other):
                 
                 """
-                Add two ECit objects to form a citation set
+                Add two ECit objects to form a new citation set, so that sets can be built fluently:
+
+                        citations = ECit(...) + ECit(...) + ECit(...)
 
                 """
 
-                if other._bdata not in self._bdata:
-                    #
-                    # Citation data are stored sequentially
-                    #
-                    self._bdata.append(other._bdata)
+                import copy
+
+                result = copy.copy(self)
+                result._bdata = list(self._bdata)
+
+                for obj in other._bdata:
+                    if obj not in result._bdata:
+                        #
+                        # Citation data are stored sequentially
+                        #
+                        result._bdata.append(obj)
+
+                return result
+
+        def __iter__(self):
+                """
+                Iterate over the citation strings of the set
+                """
+
+                return iter(self._bdata)
+
+        def __len__(self):
+                return len(self._bdata)
 
         def __str__(self):
                 """
@@ -18,49 +18,72 @@
 # limitations under the License.
 
 from . import logging
+from . elog import truncated
+from . etransport import get_transport
+from . epayload import EPayload, unquote_term
+from . eparse import decode_text
+from . edeadline import bound
 from . ecit import ECit
 
-import requests
 
 class ECitMatch(object):
 
     """
     · Retrieves PubMed IDs (PMIDs) that correspond to a set of input citation strings.
+
+    Large citation sets are better matched via ecitmatch_bulk(), which splits them into
+    POST batches run concurrently within the rate budget.
     """
 
     # Search Endpoint
 
     _ep8 = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/ecitmatch.fcgi';
 
-    def __init__(self, bdata : str):
+    def __init__(self, bdata : str, post=False):
+
+        """
+        bdata           : Citation strings (or an ECit citation set), one per line
+
+        post            : Always send citations in a POST form body, instead of only when too
+                          large for a URL (default: False)
+
+        """
       
         self._db         = "pubmed"
         self._bdata      = str(bdata)
         self._rettype    = "xml"
+        self._post       = post
         
+        #
+        # Citation strings are plus-quoted: unquote them, as parameters are form-encoded
+        # by the transport, and separate them with carriage returns
+        #
+
         self._eg_payload = {
             "db"          : self._db,
             "rettype"     : self._rettype,
-            "bdata"       : bdata,
+            "bdata"       : "\r".join(unquote_term(line) for line in self._bdata.splitlines()),
         }
 
-        self._params    = "&".join([f"{k}={v}" for k, v in self._eg_payload.items()])
+        self._params    = EPayload(self._eg_payload)
         self._results   = ""
 
-        logging.info(f"[OBJECTS:ECITMATCH]   Looking citation string set '{self._bdata}' in {self._db}..")
+        logging.info("[OBJECTS:ECITMATCH]   Looking citation string set '%s' in %s..", truncated(self._bdata), self._db)
 
     def _get_results(self, *args, **kwargs):
 
-        response = requests.Response()
 
         try:
-            response = requests.get(self._ep8, self._params)
+            if self._post:
+                response = get_transport().post(self._ep8, self._params)
+            else:
+                response = get_transport().get(self._ep8, self._params)
 
             if response.status_code != 200:
-                logging.error(f"EGQuery did not complete successfully (HTTP {response.status_code})")
+                logging.error(f"ECitMatch did not complete successfully (HTTP {response.status_code})")
                 return ""
 
-            self._results   = response.text                            
+            self._results   = decode_text(response.content)                            
 
         except Exception as e:
             logging.error(f"{str(e)}")
@@ -75,5 +98,77 @@ class ECitMatch(object):
 
         return self._results
 
+    def parse(self):
+
+        """
+        Parse the pipe-delimited ECitMatch results into a { your_key : PMID } mapping.
+        Citations not found (or ambiguous) are mapped to None.
+
+        """
+
+        matches = {}
+
+        for line in self.results().splitlines():
+            fields = line.strip().split("|")
+
+            if len(fields) < 7:
+                continue
+
+            key, pmid = fields[5], fields[6].strip()
+
+            matches[key] = pmid if pmid.isdigit() else None
+
+        return matches
+
+def ecitmatch_bulk(citations, batch_size=100, max_workers=4):
+
+    """
+    Match a (possibly huge) iterable of ECit records or citation strings against PubMed.
+
+    Citations are deduplicated, split into POST batches of ``batch_size`` and matched concurrently
+    by ``max_workers`` threads, within the rate budget of the shared transport.
+
+    Return a { your_key : PMID } mapping (None for unmatched citations, and for the citations
+    of batches that could not be matched, which are logged).
+
+    """
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    lines = []
+    seen  = set()
+
+    for citation in citations:
+        for line in (citation if isinstance(citation, ECit) else [ str(citation) ]):
+            if line not in seen:
+                seen.add(line)
+                lines.append(line)
+
+    batches = [ "\n".join(lines[i:i + batch_size]) for i in range(0, len(lines), batch_size) ]
+
+    logging.info("[OBJECTS:ECITMATCH]   Matching %d citations in %d batches..", len(lines), len(batches))
+
+    def match(bdata):
+
+        keys  = [ line.split("|")[5] for line in bdata.splitlines() if line.count("|") >= 6 ]
+        batch = ECitMatch(bdata, post=True).parse()
+
+        #
+        # A failed request returns no line at all: keep the keys of its citations, unmatched
+        #
+
+        if keys and not batch:
+            logging.error("[OBJECTS:ECITMATCH]   Unable to match a batch of %d citations ('%s')", len(keys), truncated(bdata))
+
+        return { key : batch.get(key) for key in keys }
+
+    matches = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        for batch in pool.map(bound(match), batches):
+            matches.update(batch)
+
+    return matches
+
 
-all = [ ECitMatch ]
+all = [ ECitMatch, ecitmatch_bulk ]
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 Giulio Piemontese <gpiemont [at] protonmail.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from . import logging
+
+import contextvars
+import functools
+import threading
+import time
+import weakref
+
+class ECancelled(BaseException):
+
+    """
+    ECancelled Class object:
+
+    Raised by the transport when the cancel token of the running pipeline is cancelled.
+
+    As asyncio.CancelledError, it derives from BaseException: E-utility stages turn the
+    exceptions of their requests into empty results, while a cancellation has to stop the
+    whole pipeline.
+
+    """
+
+class EDeadlineExceeded(ECancelled):
+
+    """
+    EDeadlineExceeded Class object:
+
+    Raised by the transport when the deadline of the running pipeline has expired, or would
+    expire before the next request could be sent.
+
+    """
+
+class ECancelToken(object):
+
+    """
+    ECancelToken Class object:
+
+    Cooperative cancellation and deadline of a pipeline. While a token is current (``with
+    token:``), every request of the shared transport checks it before being sent, waits for
+    the rate limiter and retries no longer than its deadline, and bounds its own timeouts
+    by the time left: a cancelled or expired pipeline stops at its next request, or between
+    two chunks of a streamed one.
+
+        with ECancelToken(timeout=600) as token:
+            harvest.run()               << token.cancel() from another thread stops it
+
+    Tokens nest: a token created while another is current (or given a ``parent``) is
+    cancelled with it, and never outlives its deadline. Threads started by a pipeline
+    (windows, spans, fan-outs) run their work through bound() to inherit its token.
+
+    """
+
+    def __init__(self, timeout=None, deadline=None, parent=None):
+
+        """
+        timeout         : Seconds the pipeline may run for (default: no limit)
+        deadline        : time.monotonic() at which the pipeline expires (default: no limit)
+        parent          : Token this one is cancelled with (default: the current token, if any)
+
+        """
+
+        parent = parent or current_token()
+
+        if timeout is not None:
+            deadline = min(deadline, time.monotonic() + timeout) if deadline is not None else time.monotonic() + timeout
+
+        deadlines = [ d for d in (deadline, parent and parent._deadline) if d is not None ]
+
+        self._deadline  = min(deadlines) if deadlines else None
+        self._parent    = parent
+        self._reason    = None
+        self._event     = threading.Event()
+        self._children  = weakref.WeakSet()
+        self._lock      = threading.Lock()
+        self._entered   = {}
+
+        if parent is not None:
+            with parent._lock:
+                parent._children.add(self)
+
+            if parent._event.is_set():
+                self.cancel(parent._reason)
+
+    def cancel(self, reason="cancelled"):
+
+        """
+        Cancel the pipeline (and every token created from this one)
+        """
+
+        with self._lock:
+            if self._event.is_set():
+                return
+
+            self._reason = reason
+            self._event.set()
+
+            children = list(self._children)
+
+        logging.info("[DEADLINE] Pipeline cancelled : %s", reason)
+
+        for child in children:
+            child.cancel(reason)
+
+    def cancelled(self):
+
+        """
+        Return True if the token has been cancelled or its deadline has expired
+        """
+
+        return self._event.is_set() or self.expired()
+
+    def expired(self):
+        return self._deadline is not None and time.monotonic() >= self._deadline
+
+    def remaining(self):
+
+        """
+        Return the seconds left before the deadline (None if there is none)
+        """
+
+        return None if self._deadline is None else max(0.0, self._deadline - time.monotonic())
+
+    def deadline(self):
+        return self._deadline
+
+    def check(self):
+
+        """
+        Raise ECancelled (EDeadlineExceeded) if the token has been cancelled (has expired)
+        """
+
+        if self._event.is_set():
+            raise ECancelled(self._reason)
+
+        if self.expired():
+            raise EDeadlineExceeded("deadline exceeded")
+
+    def sleep(self, seconds):
+
+        """
+        Sleep ``seconds``, waking up as soon as the token is cancelled. Raise EDeadlineExceeded
+        right away if the deadline would expire in the meantime.
+        """
+
+        self.check()
+
+        remaining = self.remaining()
+
+        if remaining is not None and seconds > remaining:
+            raise EDeadlineExceeded(f"deadline exceeded (would wait {seconds:.2f}s, {remaining:.2f}s left)")
+
+        if seconds > 0 and self._event.wait(seconds):
+            self.check()
+
+    def timeout(self, timeout):
+
+        """
+        Return a request ``timeout`` (seconds or a (connect, read) tuple, as requests) bounded
+        by the time left
+        """
+
+        self.check()
+
+        remaining = self.remaining()
+
+        if remaining is None:
+            return timeout
+
+        if timeout is None:
+            return remaining
+
+        if isinstance(timeout, tuple):
+            return tuple(remaining if t is None else min(t, remaining) for t in timeout)
+
+        return min(timeout, remaining)
+
+    def __enter__(self):
+
+        with self._lock:
+            self._entered.setdefault(threading.get_ident(), []).append(_current.set(self))
+
+        return self
+
+    def __exit__(self, *exc):
+
+        with self._lock:
+            entered = self._entered[threading.get_ident()]
+            reset   = entered.pop()
+
+            if not entered:
+                del self._entered[threading.get_ident()]
+
+        _current.reset(reset)
+
+        return False
+
+    def __repr__(self):
+
+        state = f"cancelled: {self._reason}" if self._event.is_set() else \
+                "expired" if self.expired() else \
+                f"{self.remaining():.1f}s left" if self._deadline is not None else "no deadline"
+
+        return f"ECancelToken<{state}>"
+
+#
+# Token of the running pipeline: a context variable, so that every thread and every asyncio
+# task has its own
+#
+
+_current = contextvars.ContextVar("pyeutils_cancel_token", default=None)
+
+def current_token():
+
+    """
+    Return the cancel token of the running pipeline, or None
+    """
+
+    return _current.get()
+
+def check_cancelled():
+
+    """
+    Raise ECancelled if the running pipeline has been cancelled (or its deadline has expired)
+    """
+
+    token = _current.get()
+
+    if token is not None:
+        token.check()
+
+def sleep(seconds):
+
+    """
+    time.sleep(), interrupted by the cancellation of the running pipeline
+    """
+
+    token = _current.get()
+
+    if token is None:
+        time.sleep(seconds)
+    else:
+        token.sleep(seconds)
+
+def bound(function, token=None):
+
+    """
+    Return ``function`` running in (a copy of) the current context, with ``token`` (default:
+    the current one) as the current token, e.g. to hand the work of a pipeline to the threads
+    of an executor: its cancel token and scheduling class (see scheduled()) carry over
+    """
+
+    context = contextvars.copy_context()
+
+    if token is not None:
+        context.run(_current.set, token)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(function, *args, **kwargs)
+
+    return wrapper
+
+all = [ ECancelToken, ECancelled, EDeadlineExceeded, current_token, check_cancelled, sleep, bound ]
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 Giulio Piemontese <gpiemont [at] protonmail.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from . import logging
+from . eparse import parse_links
+
+import os
+
+#
+# Column types supported by the table writers
+#
+
+INT64   = "int64"
+STRING  = "string"
+
+class ETableWriter(object):
+
+    """
+    ETableWriter Class object:
+
+    Base class of the streaming table writers: rows are written in groups (one per write()
+    call) as soon as they are available, so that whole result sets are never held in memory.
+
+        with table_writer("ids.parquet", [ ("uid", INT64) ]) as writer:
+            writer.write([ (1,), (2,), (3,) ])
+
+    path            : Output file
+    columns         : Table schema, as a list of (name, type) pairs; type is INT64 or STRING
+
+    """
+
+    def __init__(self, path, columns):
+
+        self.path       = path
+        self.columns    = columns
+        self.rows       = 0
+
+    def write(self, rows):
+
+        """
+        Append ``rows`` (a list of tuples, in ``columns`` order) as a new row group
+        """
+
+        if rows:
+            self._write(rows)
+            self.rows += len(rows)
+
+    def _write(self, rows):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+class _EArrowWriter(ETableWriter):
+
+    def __init__(self, path, columns):
+
+        import pyarrow as pa
+
+        super().__init__(path, columns)
+
+        self._schema = pa.schema([ (name, pa.int64() if ctype == INT64 else pa.string()) for name, ctype in self.columns ])
+
+    def _table(self, rows):
+
+        import pyarrow as pa
+
+        return pa.Table.from_arrays([ pa.array(list(column), type=field.type)
+                                      for column, field in zip(zip(*rows), self._schema) ],
+                                    schema=self._schema)
+
+    def _write(self, rows):
+        self._writer.write_table(self._table(rows))
+
+    def close(self):
+        self._writer.close()
+
+class EParquetWriter(_EArrowWriter):
+
+    """
+    EParquetWriter Class object:
+
+    Write a Parquet file, one row group per write() call (requires pyarrow)
+    """
+
+    def __init__(self, path, columns, compression="zstd"):
+
+        import pyarrow.parquet as pq
+
+        super().__init__(path, columns)
+
+        self._writer = pq.ParquetWriter(path, self._schema, compression=compression)
+
+class EArrowWriter(_EArrowWriter):
+
+    """
+    EArrowWriter Class object:
+
+    Write an Arrow IPC (Feather v2) file, one record batch per write() call (requires pyarrow)
+    """
+
+    def __init__(self, path, columns):
+
+        import pyarrow as pa
+
+        super().__init__(path, columns)
+
+        self._sink   = pa.OSFile(path, "wb")
+        self._writer = pa.ipc.new_file(self._sink, self._schema)
+
+    def close(self):
+
+        self._writer.close()
+        self._sink.close()
+
+class ECSVWriter(ETableWriter):
+
+    """
+    ECSVWriter Class object:
+
+    Write a CSV file with a header line; missing values are written as empty fields
+    """
+
+    def __init__(self, path, columns):
+
+        import csv
+
+        super().__init__(path, columns)
+
+        self._fh     = open(path, "w", newline="")
+        self._writer = csv.writer(self._fh)
+
+        self._writer.writerow([ name for name, _ in columns ])
+
+    def _write(self, rows):
+        self._writer.writerows([ [ "" if value is None else value for value in row ] for row in rows ])
+
+    def close(self):
+        self._fh.close()
+
+class ENPYWriter(ETableWriter):
+
+    """
+    ENPYWriter Class object:
+
+    Write integer tables as a NumPy ``.npy`` file of int64 (shape: rows × columns, or rows
+    for a single column), without requiring numpy. Missing values are written as -1.
+
+    The header is rewritten with the final shape on close().
+
+    """
+
+    _header_size = 128
+
+    def __init__(self, path, columns):
+
+        import struct
+
+        if any(ctype != INT64 for _, ctype in columns):
+            raise Exception("NPY export supports integer columns only")
+
+        super().__init__(path, columns)
+
+        self._row = struct.Struct(f"<{len(columns)}q")
+        self._fh  = open(path, "wb")
+
+        self._header()
+
+    def _header(self):
+
+        shape  = f"({self.rows},)" if len(self.columns) == 1 else f"({self.rows}, {len(self.columns)})"
+        header = f"{{'descr': '<i8', 'fortran_order': False, 'shape': {shape}, }}"
+        header = header.ljust(self._header_size - 10 - 1) + "\n"
+
+        self._fh.seek(0)
+        self._fh.write(b"\x93NUMPY\x01\x00" + len(header).to_bytes(2, "little") + header.encode("latin1"))
+
+    def _write(self, rows):
+
+        pack = self._row.pack
+
+        self._fh.seek(0, os.SEEK_END)
+        self._fh.write(b"".join(pack(*[ -1 if value is None else value for value in row ]) for row in rows))
+
+    def close(self):
+
+        self._header()
+        self._fh.close()
+
+def have_pyarrow():
+
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        return False
+
+    return True
+
+_formats    = { "parquet" : EParquetWriter, "arrow" : EArrowWriter, "csv" : ECSVWriter, "npy" : ENPYWriter }
+_extensions = { ".parquet" : "parquet", ".arrow" : "arrow", ".feather" : "arrow", ".csv" : "csv", ".npy" : "npy" }
+
+def table_writer(path, columns, format=None):
+
+    """
+    Return a table writer for ``path``.
+
+    format          : 'parquet', 'arrow', 'csv' or 'npy' (default: from the ``path`` extension,
+                      Parquet for unknown ones). Parquet and Arrow fall back to CSV when pyarrow
+                      is not installed, replacing the ``path`` extension with '.csv'.
+
+    """
+
+    format = format or _extensions.get(os.path.splitext(path)[1].lower(), "parquet")
+
+    if format not in _formats:
+        raise Exception(f"format must be any in {', '.join(_formats)}")
+
+    if format in ("parquet", "arrow") and not have_pyarrow():
+        logging.warning(f"[EXPORT] pyarrow is not installed, writing CSV instead of {format}")
+
+        format = "csv"
+        path   = os.path.splitext(path)[0] + ".csv"
+
+    return _formats[format](path, columns)
+
+def _batches(rows, batch):
+
+    group = []
+
+    for row in rows:
+        group.append(row)
+
+        if len(group) >= batch:
+            yield group
+            group = []
+
+    if group:
+        yield group
+
+def export_rows(rows, path, columns, format=None, batch=10000):
+
+    """
+    Stream ``rows`` (any iterable of tuples) to ``path``, in row groups of ``batch`` rows.
+    Return the writer used (its ``path`` and ``rows`` attributes describe the output).
+    """
+
+    with table_writer(path, columns, format) as writer:
+        for group in _batches(rows, batch):
+            writer.write(group)
+
+    logging.info("[EXPORT] %d rows written to %s", writer.rows, writer.path)
+
+    return writer
+
+def export_ids(ids, path, format=None, batch=10000):
+
+    """
+    Export a list of UIDs (e.g. ESearch results) as a single 'uid' column
+    """
+
+    return export_rows(((int(uid),) for uid in ids), path, [ ("uid", INT64) ], format, batch)
+
+def export_links(responses, path, format=None, batch=10000):
+
+    """
+    Export the edges of ELink responses (any iterable of ELink XML results, e.g. one per window)
+    as (dbfrom, linkname, source, target) rows; NPY output keeps only (source, target).
+    """
+
+    columns = [ ("dbfrom", STRING), ("linkname", STRING), ("source", INT64), ("target", INT64) ]
+    npy     = (format or _extensions.get(os.path.splitext(path)[1].lower())) == "npy"
+
+    def rows():
+        for response in responses:
+            for edge in parse_links(response):
+                yield edge[2:] if npy else edge
+
+    return export_rows(rows(), path, columns[2:] if npy else columns, format, batch)
+
+def export_docsums(docsums, path, fields=None, format=None, batch=10000):
+
+    """
+    Export DocSums (any iterable of dicts, e.g. ``EHarvest(..., utility="esummary").records()``).
+
+    fields          : Exported fields (default: those of the first DocSum); 'uid' is always the
+                      first column
+
+    """
+
+    from itertools import chain
+
+    docsums = iter(docsums)
+    first   = next(docsums, None)
+
+    if first is None:
+        fields = fields or []
+    else:
+        fields = [ field for field in (fields or first) if field != "uid" ]
+
+    columns = [ ("uid", INT64) ] + [ (field, STRING) for field in fields ]
+
+    def rows():
+
+        if first is None:
+            return
+
+        for docsum in chain((first,), docsums):
+            yield (int(docsum["uid"]), *(docsum.get(field) for field in fields))
+
+    return export_rows(rows(), path, columns, format, batch)
+
+all = [ ETableWriter, EParquetWriter, EArrowWriter, ECSVWriter, ENPYWriter, table_writer, have_pyarrow,
+        export_rows, export_ids, export_links, export_docsums, INT64, STRING ]
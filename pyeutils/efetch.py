@@ -24,7 +24,14 @@ from . esearch import ESearch
 from . epost import EPost
 
 from . import logging
-import requests
+from . elog import truncated
+from . etransport import get_transport
+from . epayload import EPayload
+from . etrace import traced, span
+from . emetrics import timed_stage
+from . eparse import decode_text
+from . edeadline import ECancelToken
+from . escheduler import scheduled
 
 class EFetch(ELink, EPost, ESearch):
 
@@ -53,7 +60,7 @@ class EFetch(ELink, EPost, ESearch):
     def __init__(self, db, ids=[],          
                 querykey=None, webenv=None, rettype='fasta', retmode='text',
                 strand="", seq_start=0, seq_stop=0, complexity=-1,
-                source=None):
+                retstart=0, retmax=0, source=None):
 
         """
         Initialize an EFetch object.
@@ -79,6 +86,11 @@ class EFetch(ELink, EPost, ESearch):
         querykey        : Specify which sets of UIDs (from a previous ESearch,
                           EPost, ELink call) will be used as input to EFetch.
 
+        Optional Parameters – Retrieval window
+
+        retstart        : Sequential (0-based) index of the first record to be retrieved
+        retmax          : Total number of records to be retrieved (default: all, up to 10,000)
+
         See https://www.ncbi.nlm.nih.gov/books/NBK25499/#_chapter4_EFetch_ for a complete documetation.
 
 
@@ -104,14 +116,18 @@ class EFetch(ELink, EPost, ESearch):
 
         if source:
                 # Initialize Base Class from ``source``
-                import time
+                #
+                # No pause is needed between the requests of the pipeline: every request waits
+                # for the rate limiter of the shared transport (see pyeutils.elimit)
+                #
 
                 if type(source) == ELink:
 
                         super(self.__class__, self).__init__(source._db, source._dbfrom,
                                 source._cmd, source._linkname, source._ids, source._idtype,
                                 source._retmode, source._webenv, source._querykey,
-                                source._datetype, source._reldate, source._minmaxdate)
+                                datetype=source._datetype, reldate=source._reldate,
+                                mindate=source._mindate, maxdate=source._maxdate)
 
                         self._querykey  = source._querykey
                         self._webenv    = source._webenv
@@ -125,19 +141,12 @@ class EFetch(ELink, EPost, ESearch):
                         self._term = source._term
                         self._usehistory = source._usehistory
 
-                        logging.info(f"[OBJECTS:EFETCH] Initializing from ELink Object (WebEnv: {self._webenv}, QueryKey: {self._querykey})") 
-                        self._webenv, self._querykey, self._results = super(self.__class__, self)._get_elinks()
+                        logging.info("[OBJECTS:EFETCH] Initializing from ELink Object (WebEnv: %s, QueryKey: %s)", self._webenv, self._querykey)
+                        self._webenv, self._querykey, _ = super(self.__class__, self)._get_elinks()
                         
                         #super(source.__class__, self).__init__(source._term, source._db, source._usehistory,
                         #                    source._webenv, source._querykey)
 
-                        #
-                        # Sleep for 1 second between requests, as the Entrez systems does not support
-                        # more than 3 unauthenticated request per second.
-                        #
-
-                        time.sleep(1)
-
                 elif type(source) == ESearch:
                         super(self.__class__, self).__init__(source._term, source._db, source._usehistory,
                                     source._webenv, source._querykey)
@@ -146,10 +155,8 @@ class EFetch(ELink, EPost, ESearch):
                         self._webenv    = source._webenv
                         self._term      = source._term
 
-                        logging.info(f"[OBJECTS:EFETCH] Initializing from ELink Object (WebEnv: {self._webenv}, QueryKey: {self._querykey})") 
-                        self._webenv, self._querykey, self._results = super(self.__class__, self)._get_results()
-
-                        time.sleep(1)
+                        logging.info("[OBJECTS:EFETCH] Initializing from ELink Object (WebEnv: %s, QueryKey: %s)", self._webenv, self._querykey)
+                        self._webenv, self._querykey, _ = super(self.__class__, self)._get_results()
                 
                 elif type(source) == EPost:
                         super(self.__class__, self).__init__(source._db, source._ids, source._webenv,
@@ -158,10 +165,8 @@ class EFetch(ELink, EPost, ESearch):
                         self._querykey  = source._querykey
                         self._webenv    = source._webenv
                         
-                        logging.info(f"[OBJECTS:EPost] Initializing from EPost Object (WebEnv: {self._webenv}, QueryKey: {self._querykey})") 
-                        self._webenv, self._querykey, self._results = super(self.__class__, self)._get_results()
-                
-                        time.sleep(1)
+                        logging.info("[OBJECTS:EPost] Initializing from EPost Object (WebEnv: %s, QueryKey: %s)", self._webenv, self._querykey)
+                        self._webenv, self._querykey, _ = super(self.__class__, self)._get_results()
                 else:
                         raise Exception("Only instances of ELink, EPost or ESearch are supported as EFetch superclass")
 
@@ -202,9 +207,15 @@ class EFetch(ELink, EPost, ESearch):
         if complexity > -1:
                 self._efetch_payload["complexity"] = self._complexity = complexity
 
-        logging.debug(f"EFETCH payload : {self._efetch_payload}")
+        if retstart:
+                self._efetch_payload["retstart"] = retstart
+
+        if retmax:
+                self._efetch_payload["retmax"] = retmax
 
-        self._efetch_params    = "&".join([f"{k}={v}" for k, v in self._efetch_payload.items()])
+        logging.debug("EFETCH payload : %s", truncated(self._efetch_payload))
+
+        self._efetch_params   = EPayload(self._efetch_payload)
         self._fetchdata       = "" 
 
         
@@ -218,36 +229,41 @@ class EFetch(ELink, EPost, ESearch):
                                 "(`querykey` and `webenv` arguments)")
                         
 
+    @traced("EFetch",
+        before=lambda self: { "db" : self._db, "query_key" : self._efetch_payload.get("query_key"),
+                              "retstart" : self._efetch_payload.get("retstart"),
+                              "retmax" : self._efetch_payload.get("retmax") },
+        after=lambda self: { "bytes" : len(self._content or b"") })
+    @timed_stage("EFETCH")
     def get(self, *args, **kwargs):
 
         """
-        Perform an EFetch operation, with the supplied initialization parameters
+        Perform an EFetch operation, with the supplied initialization parameters, returning
+        the raw (bytes) response: results() decodes it
 
         """
 
-        response = requests.Response()
 
         try:
-            self._efetch_url = f"{self._ep3}?{self._efetch_params}"
-            logging.debug(f"Fetching results via efetch URL {self._efetch_url}")
+            logging.debug("Fetching results via efetch URL %s?%s", self._ep3, truncated(self._efetch_params.encoded()))
 
-            response = requests.get(self._ep3, self._efetch_params)
+            response = get_transport().get(self._ep3, self._efetch_params)
 
             if response.status_code != 200:
                 logging.error(f"[OBJECTS:EFETCH] EFetch did not complete successfully (HTTP {response.status_code} : {response.reason})")
-                errmsg = response.text.replace("\n", " ")
+                errmsg = decode_text(response.content).replace("\n", " ")
                 logging.error(f"[OBJECTS:EFETCH] Error Message : {errmsg}")
                 return ""
    
-            self._fetchdata = response.text
+            self._content   = response.content
             self._status    = state.EFETCH
 
         except Exception as e:
             import traceback as tb
             logging.error(f"{tb.format_exc()}")
-            self._fetchdata = response.text
+            self._content   = response.content or b""
 
-        return self._webenv, self._querykey, response.text
+        return self._webenv, self._querykey, self._content
 
     def results(self):
 
@@ -257,15 +273,51 @@ class EFetch(ELink, EPost, ESearch):
         """
 
         try:
-            _, _, self._fetchdata = self.get()
+            _, _, content = self.get()
+
+            self._fetchdata = decode_text(content)
         except ValueError:
-            logging.info(f"No results found for {str(self)}")
+            logging.info("No results found for %s", self)
         except Exception as e:
             import traceback as tb
             logging.error(f"{tb.format_exc()}")            
 
         return self._fetchdata
 
+    def stream(self, chunk=1 << 16):
+
+        """
+        Perform the EFetch operation, yielding the response body in chunks of (decompressed)
+        bytes as they arrive, e.g. to write large windows to a file without holding them in
+        memory. Raise an Exception if the request fails.
+
+        """
+
+        logging.debug("Streaming results via efetch URL %s?%s", self._ep3, truncated(self._efetch_params.encoded()))
+
+        yield from get_transport().stream(self._ep3, self._efetch_params, chunk=chunk)
+
+        self._status = state.EFETCH
+
+    def window(self, retstart, retmax):
+
+        """
+        Return a new, not yet performed EFetch for another window of the same records,
+        sharing the encoded payload of this one (only retstart/retmax are re-encoded)
+        """
+
+        import copy
+
+        fetch = copy.copy(self)
+
+        fetch._efetch_payload = dict(self._efetch_payload, retstart=retstart, retmax=retmax)
+        fetch._efetch_params  = self._efetch_params.replace(retstart=retstart, retmax=retmax)
+        fetch._fetchdata      = ""
+        fetch._content        = b""
+        fetch._tree           = None
+
+        return fetch
+
     def webenv(self):
         return self._webenv
 
@@ -309,7 +361,7 @@ class EFetch(ELink, EPost, ESearch):
 ##
 
 def esearch_elink_efetch(query, dbfrom="pubmed", dbto="protein", 
-        cmd="neighbor_history", rettype='fasta', retmode='text'):
+        cmd="neighbor_history", rettype='fasta', retmode='text', timeout=None):
 
     """
     Experimental.
@@ -321,38 +373,50 @@ def esearch_elink_efetch(query, dbfrom="pubmed", dbto="protein",
     
     dbfrom  : str (opt)
         Database with the input UIDs (Origin database of the link op)
+
+    timeout : float (opt)
+        Seconds the whole pipeline may last, raising EDeadlineExceeded once expired. The
+        pipeline can also be cancelled through the current ECancelToken:
+
+            with ECancelToken(timeout=60) as token:
+                esearch_elink_efetch(query)     << token.cancel() from another thread stops it
         
     """
 
-    esearch  = ESearch(query, db=dbfrom, rettype=rettype,
-                      retmode="xml")
+    with span("esearch_elink_efetch", dbfrom=dbfrom, dbto=dbto, cmd=cmd, rettype=rettype, retmode=retmode), \
+            ECancelToken(timeout=timeout), scheduled("pipeline"):
+
+        esearch  = ESearch(query, db=dbfrom, rettype=rettype,
+                          retmode="xml")
 
-    if not esearch:
-        return { "error" : "ESEARCH" }
+        if not esearch:
+            return { "error" : "ESEARCH" }
 
-    elink   = ELink(dbto, dbfrom=dbfrom, retmode="xml",
-                   cmd=cmd, source=esearch)
+        elink   = ELink(dbto, dbfrom=dbfrom, retmode="xml",
+                       cmd=cmd, source=esearch)
 
-    if not elink:
-        return { "error" : "ELINK" }
+        if not elink:
+            return { "error" : "ELINK" }
 
-    fetch   = EFetch(dbfrom, rettype=rettype, retmode=retmode,
-                    source=elink)
-               
-    if not fetch:
-        return { "error" : "EFETCH" }
+        fetch   = EFetch(dbfrom, rettype=rettype, retmode=retmode,
+                        source=elink)
+                   
+        if not fetch:
+            return { "error" : "EFETCH" }
 
-    return fetch.results()
+        return fetch.results()
 
 def esearch_elink_efetch_xml(query, dbfrom="pubmed", dbto="protein", cmd="neighbor_history",
-        rettype='fasta'):
+        rettype='fasta', timeout=None):
 
-    return esearch_elink_efetch(query, dbfrom=dbfrom, dbto=dbto, cmd=cmd, rettype=rettype, retmode='xml')
+    return esearch_elink_efetch(query, dbfrom=dbfrom, dbto=dbto, cmd=cmd, rettype=rettype, retmode='xml',
+                                timeout=timeout)
 
 def esearch_elink_efetch_asn1(query, dbfrom="pubmed", dbto="protein", cmd="neighbor_history",
-        rettype='fasta'):
+        rettype='fasta', timeout=None):
 
-    return esearch_elink_efetch(query, dbfrom=dbfrom, dbto=dbto, cmd=cmd, rettype=rettype, retmode='asn.1')
+    return esearch_elink_efetch(query, dbfrom=dbfrom, dbto=dbto, cmd=cmd, rettype=rettype, retmode='asn.1',
+                                timeout=timeout)
 
 all = [ EFetch, esearch_elink_efetch, esearch_elink_efetch_xml, esearch_elink_efetch_asn1 ]
 
@@ -19,45 +19,82 @@
 #
 
 from . import logging
+from . elog import truncated
+from . etransport import get_transport
+from . epayload import EPayload, unquote_term
+from . eparse import decode_text
+from . edeadline import bound
+from . esearch import ESearch
 
-import requests
+import threading
+
+#
+# Entrez dbs queried by EGQuery.counts() when no explicit set is given
+#
+
+EGQUERY_DBS = [
+    "pubmed", "pmc", "books", "mesh", "nlmcatalog", "omim",
+    "gene", "protein", "nuccore", "structure", "taxonomy",
+    "snp", "clinvar", "gds", "sra", "biosample", "bioproject",
+    "assembly", "cdd", "pccompound", "pcsubstance",
+]
+
+#
+# Process-wide cache of counts, as { (term, db) : (time, count) }
+#
+
+_counts_cache = {}
+_counts_lock  = threading.Lock()
 
 class EGQuery(object):
 
     """
     · Provides the number of records retrieved in all Entrez databases by a single text query.
+
+    Since the global query endpoint is deprecated, counts() provides the same answer by issuing
+    one ``rettype=count`` ESearch per db, concurrently under the transport rate limiter.
     """
 
     # Search Endpoint
 
     _ep6 = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/egquery.fcgi';
 
-    def __init__(self, term):
+    def __init__(self, term, dbs=None, ttl=600):
+
+        """
+        term            : Text query, plain or URL-encoded (see epayload.unquote_term())
+
+        dbs             : Entrez dbs queried by counts() (default: EGQUERY_DBS)
+
+        ttl             : Seconds a count is served from the process-wide cache (default: 10 minutes)
+
+        """
       
         self._term      = term
+        self._dbs       = list(dbs or EGQUERY_DBS)
+        self._ttl       = ttl
         
         self._eg_payload = {
-            "term"        : term,
+            "term"        : unquote_term(term),
         }
 
-        self._params    = "&".join([f"{k}={v}" for k, v in self._eg_payload.items()])
+        self._params    = EPayload(self._eg_payload)
 
         self._results   = ""
 
-        logging.info(f"[OBJECTS:EGQUERY]   Requesting for '{term}' in all Entrez dbs..")
+        logging.info("[OBJECTS:EGQUERY]   Requesting for '%s' in all Entrez dbs..", truncated(term))
 
     def _get_results(self, *args, **kwargs):
 
-        response = requests.Response()
 
         try:
-            response = requests.get(self._ep6, self._params)
+            response = get_transport().get(self._ep6, self._params)
 
             if response.status_code != 200:
                 logging.error(f"EGQuery did not complete successfully (HTTP {response.status_code})")
                 return ""
 
-            self._results   = response.text                            
+            self._results   = decode_text(response.content)                            
 
         except Exception as e:
             logging.error(f"{str(e)}")
@@ -73,6 +110,61 @@ class EGQuery(object):
 
         return self._results
 
+    def _count(self, db):
+
+        """
+        Return the number of records matching ``self._term`` in ``db``, or None on error
+        """
+
+        import time
+
+        key = (self._term, db)
+
+        with _counts_lock:
+            cached = _counts_cache.get(key)
+
+        if cached and time.time() - cached[0] < self._ttl:
+            return cached[1]
+
+        search = ESearch(self._term, db=db, usehistory=False, rettype="count")
+        search._get_results()
+
+        count = search._objs.get("Count")
+
+        if not isinstance(count, int):
+            logging.error(f"[OBJECTS:EGQUERY] Unable to count records for '{self._term}' in '{db}'")
+            return None
+
+        with _counts_lock:
+            _counts_cache[key] = (time.time(), count)
+
+        return count
+
+    def counts(self, max_workers=8):
+
+        """
+        Return the number of records matching the query in every requested db, as { db : count }.
+        Dbs whose count could not be retrieved are mapped to None.
+
+        """
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        logging.info("[OBJECTS:EGQUERY]   Counting '%s' in %d Entrez dbs..", truncated(self._term), len(self._dbs))
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(self._dbs)))) as pool:
+            counts = pool.map(bound(self._count), self._dbs)
+
+        return dict(zip(self._dbs, counts))
+
+def egquery_counts(term, dbs=None):
+
+    """
+    Return the number of records matching ``term`` in each of ``dbs``, as { db : count }
+    """
+
+    return EGQuery(term, dbs=dbs).counts()
+
 
-all = [ EGQuery ]
+all = [ EGQuery, egquery_counts ]
 
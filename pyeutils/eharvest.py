@@ -0,0 +1,740 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 Giulio Piemontese <gpiemont [at] protonmail.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from . esearch import ESearch
+from . efetch import EFetch
+from . esummary import ESummary
+
+from . epipe import state
+from . import logging
+from . elog import truncated
+from . etrace import span
+from . eparse import get_parse_pool, parse_fasta, parse_tseq, parse_docsums, decode_text
+from . eindex import indexer, index_kind, build_index
+from . etransport import get_transport
+from . edeadline import ECancelToken, ECancelled, bound
+from . escheduler import scheduled
+
+import threading
+
+class ECheckpoint(object):
+
+    """
+    ECheckpoint Class object:
+
+    Durable progress of a harvest job, stored as a JSON file next to the job output:
+
+        params          : Query parameters of the job (a checkpoint only resumes the same job)
+        webenv          : History server coordinates of the search results being harvested
+        querykey
+        count           : Number of records matching the search
+        windows         : Completed windows, as [retstart, retmax, output offset] triplets
+        offset          : Output size after the last completed window
+        done            : True once every window has been written
+
+    The file is rewritten atomically after every window, so that it always describes
+    output actually flushed to disk.
+
+    """
+
+    def __init__(self, path):
+
+        self._path      = path
+
+        self.reset()
+
+    def reset(self):
+
+        """
+        Forget any progress (the checkpoint file is left untouched, see remove())
+        """
+
+        self.params     = {}
+        self.webenv     = ""
+        self.querykey   = ""
+        self.count      = 0
+        self.windows    = []
+        self.offset     = 0
+        self.done       = False
+
+    def load(self):
+
+        """
+        Load the checkpoint file, if any. Return True if a previous checkpoint was found.
+        """
+
+        import json
+
+        try:
+            with open(self._path) as fh:
+                entry = json.load(fh)
+
+        except FileNotFoundError:
+            return False
+
+        self.params     = entry.get("params", {})
+        self.webenv     = entry.get("webenv", "")
+        self.querykey   = entry.get("querykey", "")
+        self.count      = entry.get("count", 0)
+        self.windows    = entry.get("windows", [])
+        self.offset     = entry.get("offset", 0)
+        self.done       = entry.get("done", False)
+
+        return True
+
+    def save(self):
+
+        import json, os
+
+        with open(f"{self._path}.tmp", "w") as fh:
+            json.dump({
+                "params"    : self.params,
+                "webenv"    : self.webenv,
+                "querykey"  : self.querykey,
+                "count"     : self.count,
+                "windows"   : self.windows,
+                "offset"    : self.offset,
+                "done"      : self.done,
+            }, fh)
+
+            fh.flush()
+            os.fsync(fh.fileno())
+
+        os.replace(f"{self._path}.tmp", self._path)
+
+    def complete(self, retstart, retmax, offset):
+
+        """
+        Record window ``retstart`` as written, ending at ``offset`` in the output
+        """
+
+        self.windows.append([ retstart, retmax, offset ])
+        self.offset = offset
+
+        self.save()
+
+    def completed(self):
+        return { retstart for retstart, _, _ in self.windows }
+
+    def remove(self):
+
+        """
+        Delete the checkpoint file and forget any progress
+        """
+
+        import os
+
+        self.reset()
+
+        try:
+            os.remove(self._path)
+        except FileNotFoundError:
+            pass
+
+class EHarvest(object):
+
+    """
+    EHarvest Class object:
+
+    Download every record matching ``term`` in windows of ``window`` records, via EFetch or
+    ESummary on the History server, appending them to ``output``. By default, window sizes
+    adapt to the latency and failures of the endpoint on ``db`` (see EBatchSizer).
+
+    Progress is tracked in a checkpoint file (default: ``<output>.checkpoint``): if a harvest
+    fails midway, running the same harvest again resumes from the last completed window,
+    re-running the ESearch if its WebEnv has expired in the meantime.
+
+        harvest = EHarvest("asthma[mesh]", "asthma.fasta", db="protein")
+        harvest.run()
+
+    Windows can also be streamed as parsed records, fetched by a pool of threads and parsed
+    by a pool of processes (see EParsePool), without writing any output:
+
+        for header, sequence in EHarvest("asthma[mesh]", None, db="protein").records():
+            [...]
+
+    """
+
+    _utilities = ("efetch", "esummary")
+
+    def __init__(self, term, output, db="pubmed", utility="efetch", window=None,
+                rettype="fasta", retmode="text", checkpoint=None, **search):
+
+        """
+        Initialize a harvest job.
+
+        term            : ESearch query
+        output          : Write records to this file
+        db              : Entrez db searched and harvested
+        utility         : 'efetch' (records) or 'esummary' (DocSums)
+        window          : Records requested per EFetch/ESummary call (default: None, adaptive)
+        rettype         : EFetch retrieval type (ignored by ESummary)
+        retmode         : EFetch/ESummary retrieval mode
+        checkpoint      : Checkpoint file (default: ``<output>.checkpoint``)
+        search          : Further ESearch parameters (field, datetype, reldate, sort, ...)
+
+        """
+
+        if utility not in self._utilities:
+            raise Exception(f"utility must be any in {', '.join(self._utilities)}")
+
+        if utility == "esummary" and retmode == "text":
+            retmode = "xml"
+
+        self._term      = term
+        self._output    = output
+        self._db        = db
+        self._utility   = utility
+        self._window    = window
+        self._rettype   = rettype
+        self._retmode   = retmode
+        self._search    = search
+
+        self._params = {
+            "term"      : term,
+            "db"        : db,
+            "utility"   : utility,
+            "window"    : window,
+            "rettype"   : rettype,
+            "retmode"   : retmode,
+            "search"    : search,
+        }
+
+        self._checkpoint = ECheckpoint(checkpoint or f"{output}.checkpoint")
+        self._lock       = threading.Lock()
+        self._template   = None
+
+    def _esearch(self, save=True):
+
+        """
+        Run the ESearch of the job, storing its History server coordinates in the checkpoint
+        """
+
+        search = ESearch(self._term, db=self._db, usehistory=True, **self._search)
+
+        result = search._get_results()
+
+        #
+        # A failed request returns an empty string instead of the History server coordinates
+        #
+
+        webenv, querykey = result[:2] if result else ("", "")
+
+        if not webenv or not querykey:
+            raise Exception(f"[OBJECTS:HARVEST] ESearch did not return a History server environment for '{self._term}'")
+
+        checkpoint = self._checkpoint
+
+        if checkpoint.count and search._count != checkpoint.count:
+            logging.warning("[OBJECTS:HARVEST] Search results changed since the harvest started (%d → %d records)",
+                            checkpoint.count, search._count)
+
+        checkpoint.webenv   = webenv
+        checkpoint.querykey = querykey
+        checkpoint.count    = search._count
+
+        if save:
+            checkpoint.save()
+
+    def _size(self):
+
+        """
+        Return the size of the next window
+        """
+
+        return self._window or get_transport().sizer().size(self._utility, self._db)
+
+    def _windows(self, retstart=0):
+
+        """
+        Yield (retstart, retmax) windows up to the end of the search results, sizing each
+        one as it is requested
+        """
+
+        while retstart < self._checkpoint.count:
+            retmax = self._size()
+
+            yield retstart, retmax
+
+            retstart += retmax
+
+    def _request(self):
+
+        """
+        Return the EFetch (or ESummary) request windows are derived from, built once per
+        History server environment so that windows only re-encode retstart/retmax
+        """
+
+        checkpoint = self._checkpoint
+        history    = (checkpoint.webenv, checkpoint.querykey)
+        template   = self._template
+
+        if template is None or template[0] != history:
+            if self._utility == "efetch":
+                request = EFetch(self._db, querykey=checkpoint.querykey, webenv=checkpoint.webenv,
+                            rettype=self._rettype, retmode=self._retmode, retstart=0, retmax=self._size())
+            else:
+                request = ESummary(self._db, querykey=checkpoint.querykey, webenv=checkpoint.webenv,
+                            retstart=1, retmax=self._size(), retmode=self._retmode)
+
+            template = self._template = (history, request)
+
+        return template[1]
+
+    def _fetch(self, retstart, retmax):
+
+        """
+        Retrieve the window of ``retmax`` records starting at ``retstart``, as raw bytes; return
+        None if it could not be retrieved (e.g. because the WebEnv expired)
+        """
+
+        request = self._request()
+
+        if self._utility == "efetch":
+            fetch = request.window(retstart, retmax)
+
+            fetch.get()
+
+            data, ok = fetch._content, fetch._status == state.EFETCH
+
+        else:
+            #
+            # ESummary's retstart is 1-based
+            #
+
+            summary = request.window(retstart + 1, retmax)
+
+            summary._get_summary()
+
+            data, ok = summary._content, summary._status == state.ESUMMARY
+
+        if not ok or not data or b"<ERROR>" in data[:1024]:
+            logging.warning("[OBJECTS:HARVEST] Unable to retrieve window %d : %s", retstart, truncated(data))
+            return None
+
+        return data
+
+    def _fetch_window(self, retstart, retmax):
+
+        """
+        Retrieve a window as a list of responses: if it fails and the batch sizer shrank in
+        the meantime, the window is retrieved again as smaller ones. Return None on failure.
+        """
+
+        data = self._fetch(retstart, retmax)
+
+        if data is not None:
+            return [ data ]
+
+        size = self._size()
+
+        if size >= retmax:
+            return None
+
+        logging.info("[OBJECTS:HARVEST] Splitting window %d into windows of %d records", retstart, size)
+
+        chunks = []
+
+        for start in range(retstart, retstart + retmax, size):
+            chunk = self._fetch_window(start, min(size, retstart + retmax - start))
+
+            if chunk is None:
+                return None
+
+            chunks += chunk
+
+        return chunks
+
+    def _stream(self, fh, retstart, retmax):
+
+        """
+        Stream the window of ``retmax`` records starting at ``retstart`` to ``fh``, as it
+        arrives. Return False (``fh`` left as it was) if it could not be retrieved.
+        """
+
+        start   = fh.tell()
+        request = self._request()
+
+        #
+        # ESummary's retstart is 1-based
+        #
+
+        first = retstart + 1 if self._utility == "esummary" else retstart
+
+        try:
+            for data in request.window(first, retmax).stream():
+                if fh.tell() - start < 1024 and b"<ERROR>" in data[:1024]:
+                    raise Exception(data[:1024].decode("utf-8", "replace"))
+
+                fh.write(data)
+
+            if fh.tell() == start:
+                raise Exception("Empty response")
+
+        except ECancelled:
+            fh.seek(start)
+            fh.truncate()
+
+            raise
+
+        except Exception as e:
+            logging.warning("[OBJECTS:HARVEST] Unable to retrieve window %d : %s", retstart, truncated(str(e)))
+
+            fh.seek(start)
+            fh.truncate()
+
+            return False
+
+        return True
+
+    def _stream_window(self, fh, retstart, retmax):
+
+        """
+        Stream a window to ``fh``: if it fails and the batch sizer shrank in the meantime, the
+        window is streamed again as smaller ones. Return False (``fh`` left as it was) on failure.
+        """
+
+        if self._stream(fh, retstart, retmax):
+            return True
+
+        size = self._size()
+
+        if size >= retmax:
+            return False
+
+        logging.info("[OBJECTS:HARVEST] Splitting window %d into windows of %d records", retstart, size)
+
+        start = fh.tell()
+
+        for first in range(retstart, retstart + retmax, size):
+            if not self._stream_window(fh, first, min(size, retstart + retmax - first)):
+                fh.seek(start)
+                fh.truncate()
+
+                return False
+
+        return True
+
+    def _index_kind(self, index):
+
+        kind = index if isinstance(index, str) else \
+                "docsum" if self._utility == "esummary" else index_kind(self._db, self._rettype, self._retmode)
+
+        if kind is None:
+            raise Exception(f"Records of rettype='{self._rettype}', retmode='{self._retmode}' cannot be indexed")
+
+        return kind
+
+    def run(self, restart=False, index=False, timeout=None):
+
+        """
+        Run (or resume) the harvest, and return the number of records matching the search.
+
+        restart         : Discard any previous checkpoint and output, and start from scratch
+        index           : Index the output while writing it, for random access by EIndexedFile
+                          (True: index kind from the retrieved format, or any kind of eindex.indexer())
+        timeout         : Seconds the run may last (default: no limit, besides the deadline of the
+                          current ECancelToken, if any)
+
+        A cancelled or expired run raises ECancelled, leaving output and checkpoint at the
+        last completed window: run again to resume.
+
+        """
+
+        import os
+
+        checkpoint = self._checkpoint
+        builder    = indexer(self._index_kind(index)) if index else None
+
+        if restart:
+            checkpoint.remove()
+
+        if checkpoint.load():
+            if checkpoint.params != self._params:
+                raise Exception(f"Checkpoint '{checkpoint._path}' belongs to a different harvest "
+                                 "(run with restart=True to discard it)")
+
+            if checkpoint.done:
+                logging.info("[OBJECTS:HARVEST] Harvest already completed (%d records)", checkpoint.count)
+
+                if builder and not os.path.exists(self._output + builder.extension):
+                    build_index(self._output, self._index_kind(index))
+
+                return checkpoint.count
+
+            logging.info("[OBJECTS:HARVEST] Resuming harvest from offset %d (%d windows completed)",
+                        checkpoint.offset, len(checkpoint.windows))
+        else:
+            checkpoint.params = self._params
+            checkpoint.offset = 0
+
+        with span("harvest", db=self._db, utility=self._utility, window=self._window), ECancelToken(timeout=timeout), \
+                scheduled("bulk"):
+
+            if not checkpoint.webenv:
+                self._esearch()
+
+            with open(self._output, "r+b" if os.path.exists(self._output) else "w+b") as fh:
+
+                #
+                # Drop anything written after the last completed window
+                #
+
+                fh.truncate(checkpoint.offset)
+
+                if builder and checkpoint.offset:
+                    #
+                    # Index the windows written by previous runs
+                    #
+
+                    fh.seek(0)
+
+                    for data in iter(lambda: fh.read(1 << 20), b""):
+                        builder.feed(data)
+
+                fh.seek(checkpoint.offset)
+
+                #
+                # Windows are written in order: resume after the last completed one
+                #
+
+                resume = checkpoint.windows[-1][0] + checkpoint.windows[-1][1] if checkpoint.windows else 0
+
+                for retstart, retmax in self._windows(resume):
+                    start = fh.tell()
+
+                    if not self._stream_window(fh, retstart, retmax):
+                        logging.info("[OBJECTS:HARVEST] Re-running ESearch, WebEnv %s may have expired", checkpoint.webenv)
+
+                        self._esearch()
+
+                        if not self._stream_window(fh, retstart, retmax):
+                            raise Exception(f"[OBJECTS:HARVEST] Unable to retrieve window {retstart} of '{self._term}' "
+                                             "(run again to resume)")
+
+                    fh.flush()
+                    os.fsync(fh.fileno())
+
+                    checkpoint.complete(retstart, retmax, fh.tell())
+
+                    if builder:
+                        #
+                        # Index the window back from the (page cached) output
+                        #
+
+                        fh.seek(start)
+
+                        for data in iter(lambda: fh.read(min(1 << 20, checkpoint.offset - fh.tell())), b""):
+                            builder.feed(data)
+
+                    logging.info("[OBJECTS:HARVEST] Window %d-%d of %d completed", retstart,
+                                min(retstart + retmax, checkpoint.count), checkpoint.count)
+
+            if builder:
+                builder.close()
+                builder.write(self._output + builder.extension)
+
+            checkpoint.done = True
+            checkpoint.save()
+
+        return checkpoint.count
+
+    def uids(self, window=10000):
+
+        """
+        Return the UIDs of the History server set harvested by the last run(), as listed by
+        EFetch (rettype='uilist') in windows of ``window`` UIDs. The ESearch is run again if its
+        WebEnv has expired, as run() does.
+        """
+
+        checkpoint = self._checkpoint
+
+        if not checkpoint.count:
+            return []
+
+        with span("harvest.uids", db=self._db, count=checkpoint.count), scheduled("bulk"):
+            for attempt in (1, 2):
+                if checkpoint.webenv:
+                    request = EFetch(self._db, querykey=checkpoint.querykey, webenv=checkpoint.webenv,
+                                rettype="uilist", retmode="text", retstart=0, retmax=window)
+                    uids    = []
+
+                    for retstart in range(0, checkpoint.count, window):
+                        fetch = request.window(retstart, window)
+
+                        fetch.get()
+
+                        if fetch._status != state.EFETCH or b"<ERROR>" in fetch._content[:1024]:
+                            break
+
+                        uids.extend(line.strip() for line in decode_text(fetch._content).splitlines() if line.strip())
+                    else:
+                        if len(uids) == checkpoint.count:
+                            return uids
+
+                if attempt == 1:
+                    logging.info("[OBJECTS:HARVEST] Re-running ESearch, WebEnv %s may have expired", checkpoint.webenv)
+
+                    self._esearch()
+
+        raise Exception(f"[OBJECTS:HARVEST] Unable to list the UIDs harvested for '{self._term}'")
+
+    def _parser(self):
+
+        """
+        Return the default parser of the harvested records
+        """
+
+        if self._utility == "esummary":
+            return parse_docsums
+
+        if self._rettype == "fasta":
+            return parse_fasta if self._retmode == "text" else parse_tseq
+
+        raise Exception(f"No default parser for rettype='{self._rettype}', retmode='{self._retmode}': supply one")
+
+    def records(self, parser=None, fetchers=4, pool=None, timeout=None):
+
+        """
+        Yield the parsed records of every window, in order.
+
+        parser          : Picklable function parsing a window (raw bytes, as received) into a list of records
+                          (default: FASTA, TinySeq or DocSum parser, according to the harvest)
+        fetchers        : Number of threads fetching windows concurrently
+        pool            : EParsePool parsing the windows (default: the process-wide one)
+        timeout         : Seconds the retrieval may last (default: no limit, besides the deadline
+                          of the current ECancelToken, if any)
+
+        Fetching threads hand every window to the parser pool and move on to the next one,
+        so that network I/O never waits for parsing. At most 2 × ``fetchers`` windows are
+        in flight at any time. The checkpoint is neither read nor written. On cancellation
+        (or once ``timeout`` expires) outstanding windows are dropped and ECancelled is raised.
+
+        """
+
+        from concurrent.futures import ThreadPoolExecutor
+        from collections import deque
+        from itertools import islice
+
+        parser      = parser or self._parser()
+        pool        = pool or get_parse_pool()
+        job         = self._detached()
+        checkpoint  = job._checkpoint
+        token       = ECancelToken(timeout=timeout)
+
+        with span("harvest.records", db=self._db, utility=self._utility, window=self._window, fetchers=fetchers):
+
+            def fetch(retstart, retmax):
+
+                webenv  = checkpoint.webenv
+                chunks  = job._fetch_window(retstart, retmax)
+
+                if chunks is None:
+                    with job._lock:
+                        if webenv == checkpoint.webenv:
+                            job._esearch(save=False)
+
+                    chunks = job._fetch_window(retstart, retmax)
+
+                    if chunks is None:
+                        raise Exception(f"[OBJECTS:HARVEST] Unable to retrieve window {retstart} of '{self._term}'")
+
+                return [ pool.submit(parser, data) for data in chunks ]
+
+            with scheduled("bulk"):
+                #
+                # Bind the workers here: the context of a generator is its consumer's
+                #
+
+                esearch = bound(job._esearch, token)
+                fetch   = bound(fetch, token)
+
+            esearch(save=False)
+
+            windows = job._windows()
+
+            with ThreadPoolExecutor(max_workers=fetchers) as executor:
+                pending = deque(executor.submit(fetch, *window) for window in islice(windows, 2 * fetchers))
+
+                try:
+                    while pending:
+                        parsed = pending.popleft().result()
+
+                        window = next(windows, None)
+
+                        if window is not None:
+                            pending.append(executor.submit(fetch, *window))
+
+                        for records in parsed:
+                            yield from records.result()
+
+                finally:
+                    for future in pending:
+                        future.cancel()
+
+                    if pending:
+                        #
+                        # Stop the windows being retrieved at their next request
+                        #
+
+                        token.cancel("records() interrupted")
+
+    def _detached(self):
+
+        """
+        Return a copy of the job with a search state of its own, never saved: records() must
+        not leave anything behind for run() to resume from
+        """
+
+        import copy
+
+        job = copy.copy(self)
+
+        job._checkpoint = ECheckpoint(None)
+        job._template   = None
+        job._lock       = threading.Lock()
+
+        return job
+
+    def checkpoint(self):
+        return self._checkpoint
+
+##
+## Convenience Functions
+##
+
+def efetch_harvest(term, output, db="pubmed", window=None, rettype="fasta", retmode="text", **search):
+
+    """
+    Download every record matching ``term`` to ``output``, resuming any previous interrupted run
+    """
+
+    return EHarvest(term, output, db=db, utility="efetch", window=window,
+                rettype=rettype, retmode=retmode, **search).run()
+
+def esummary_harvest(term, output, db="pubmed", window=None, **search):
+
+    """
+    Download the DocSums of every record matching ``term`` to ``output``, resuming any previous interrupted run
+    """
+
+    return EHarvest(term, output, db=db, utility="esummary", window=window, retmode="xml", **search).run()
+
+all = [ ECheckpoint, EHarvest, efetch_harvest, esummary_harvest ]
@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 Giulio Piemontese <gpiemont [at] protonmail.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from . import logging
+
+import os
+import re
+
+class EFastaIndexer(object):
+
+    """
+    EFastaIndexer Class object:
+
+    Build a faidx (samtools) index of a FASTA stream, fed chunk by chunk as it is written:
+
+        NAME    LENGTH    OFFSET    LINEBASES    LINEWIDTH
+
+    OFFSET is the byte offset of the first base of the sequence, LINEBASES and LINEWIDTH the
+    number of bases and bytes (newline included) of its lines. As with samtools, every line of
+    a sequence but the last must have the same length: records which do not are not indexed.
+
+    """
+
+    extension = ".fai"
+
+    def __init__(self):
+
+        self._entries   = {}
+        self._current   = None
+        self._name      = None
+        self._short     = False
+        self._carry     = b""
+        self._position  = 0
+
+    def feed(self, data):
+
+        """
+        Index ``data``, the next chunk of the stream
+        """
+
+        buffer = self._carry + data
+        base   = self._position - len(self._carry)
+        start  = 0
+
+        while True:
+            end = buffer.find(b"\n", start)
+
+            if end < 0:
+                break
+
+            self._line(base + start, buffer[start:end + 1])
+            start = end + 1
+
+        self._carry     = buffer[start:]
+        self._position  = base + len(buffer)
+
+    def _line(self, offset, line):
+
+        if line.startswith(b">"):
+            name = line[1:].split(None, 1)[0].decode() if line[1:].strip() else ""
+
+            if name in self._entries:
+                logging.warning(f"[INDEX] Duplicate FASTA record '{name}', indexing the last one")
+
+            self._current = self._entries[name] = [ 0, 0, 0, 0 ]
+            self._name    = name
+            self._short   = False
+            return
+
+        bases = len(line.rstrip(b"\r\n"))
+
+        if self._current is None or not bases:
+            return
+
+        entry = self._current
+
+        if not entry[2]:
+            entry[1], entry[2], entry[3] = offset, bases, len(line)
+
+        elif self._short or bases > entry[2] or len(line) - bases != entry[3] - entry[2]:
+            #
+            # Only the last line of a sequence can be shorter
+            #
+
+            logging.warning(f"[INDEX] FASTA record '{self._name}' has lines of different lengths, not indexed")
+
+            del self._entries[self._name]
+            self._current = None
+            return
+
+        self._short = bases < entry[2]
+
+        entry[0] += bases
+
+    def close(self):
+
+        """
+        Index the last, newline-less line of the stream (if any)
+        """
+
+        if self._carry:
+            self._line(self._position - len(self._carry), self._carry)
+            self._carry = b""
+
+    def entries(self):
+        return self._entries
+
+    def write(self, path):
+
+        with open(f"{path}.tmp", "w") as fh:
+            for name, (length, offset, linebases, linewidth) in self._entries.items():
+                fh.write(f"{name}\t{length}\t{offset}\t{linebases}\t{linewidth}\n")
+
+        os.replace(f"{path}.tmp", path)
+
+class ERecordIndexer(object):
+
+    """
+    ERecordIndexer Class object:
+
+    Index the records of a stream (GenBank flat files, TinySeq/GBSeq/PubMed XML, ...) by
+    name, recording their byte offset and length:
+
+        NAME    OFFSET    LENGTH
+
+    start           : Bytes starting a record (e.g. b'LOCUS ')
+    end             : Bytes ending a record (e.g. b'\\n//')
+    name            : Regular expression (bytes) whose first group is the record name
+
+    """
+
+    extension = ".idx"
+
+    def __init__(self, start, end, name):
+
+        self._start     = start
+        self._end       = end
+        self._name      = re.compile(name, re.MULTILINE)
+
+        self._entries   = {}
+        self._carry     = b""
+        self._position  = 0
+
+    def feed(self, data):
+
+        buffer = self._carry + data
+        base   = self._position - len(self._carry)
+        start  = 0
+
+        while True:
+            begin = buffer.find(self._start, start)
+
+            if begin < 0:
+                #
+                # Keep enough bytes to match a start marker split across chunks
+                #
+
+                start = max(start, len(buffer) - len(self._start) + 1)
+                break
+
+            end = buffer.find(self._end, begin + len(self._start))
+
+            if end < 0:
+                start = begin
+                break
+
+            end   += len(self._end)
+            match  = self._name.search(buffer, begin, end)
+
+            if match:
+                self._entries[match.group(1).decode()] = (base + begin, end - begin)
+            else:
+                logging.warning(f"[INDEX] Unnamed record at offset {base + begin}, not indexed")
+
+            start = end
+
+        self._carry     = buffer[start:]
+        self._position  = base + len(buffer)
+
+    def close(self):
+        self._carry = b""
+
+    def entries(self):
+        return self._entries
+
+    def write(self, path):
+
+        with open(f"{path}.tmp", "w") as fh:
+            for name, (offset, length) in self._entries.items():
+                fh.write(f"{name}\t{offset}\t{length}\n")
+
+        os.replace(f"{path}.tmp", path)
+
+#
+# Record formats: (start, end, name pattern)
+#
+
+_records = {
+    "genbank"   : (b"LOCUS ", b"\n//", rb"^VERSION\s+(\S+)"),
+    "tseq"      : (b"<TSeq>", b"</TSeq>", rb"<TSeq_accver>([^<]+)<"),
+    "gbseq"     : (b"<GBSeq>", b"</GBSeq>", rb"<GBSeq_accession-version>([^<]+)<"),
+    "pubmed"    : (b"<PubmedArticle>", b"</PubmedArticle>", rb"<PMID[^>]*>(\d+)<"),
+    "docsum"    : (b"<DocumentSummary ", b"</DocumentSummary>", rb'<DocumentSummary uid="(\d+)"'),
+}
+
+def indexer(kind):
+
+    """
+    Return a streaming indexer for ``kind`` ('fasta', 'genbank', 'tseq', 'gbseq', 'pubmed' or 'docsum')
+    """
+
+    if kind == "fasta":
+        return EFastaIndexer()
+
+    if kind not in _records:
+        raise Exception(f"kind must be any in fasta, {', '.join(_records)}")
+
+    return ERecordIndexer(*_records[kind])
+
+def index_kind(db, rettype, retmode):
+
+    """
+    Return the index kind of EFetch results, or None if they cannot be indexed
+    """
+
+    if retmode == "text":
+        return { "fasta" : "fasta", "gb" : "genbank", "gp" : "genbank", "gbwithparts" : "genbank" }.get(rettype)
+
+    if retmode == "xml":
+        if db == "pubmed":
+            return "pubmed"
+
+        return { "fasta" : "tseq", "gb" : "gbseq", "gp" : "gbseq" }.get(rettype)
+
+    return None
+
+def build_index(path, kind, chunk=1 << 20):
+
+    """
+    Index the existing file ``path``, writing ``<path>.fai`` or ``<path>.idx``. Return the index path.
+    """
+
+    builder = indexer(kind)
+
+    with open(path, "rb") as fh:
+        for data in iter(lambda: fh.read(chunk), b""):
+            builder.feed(data)
+
+    builder.close()
+    builder.write(path + builder.extension)
+
+    return path + builder.extension
+
+class EIndexedFile(object):
+
+    """
+    EIndexedFile Class object:
+
+    Random access, by name, to the records of an indexed file (see build_index() and
+    EHarvest.run(index=True)). The file is memory-mapped: records are returned as
+    memoryview slices of the map, without copies.
+
+        with EIndexedFile("proteins.fasta") as fasta:
+            fasta.sequence("NP_000886.1", 10, 20)
+
+    Sequences are only available from FASTA (faidx) indexes.
+
+    Records may outlive the file: a map still referenced by memoryviews when the file is
+    closed is unmapped once the last of them is released (or garbage collected).
+
+    """
+
+    def __init__(self, path):
+
+        import mmap
+
+        self._path = path
+
+        if os.path.exists(path + EFastaIndexer.extension):
+            self._fasta = True
+            self._index = self._load(path + EFastaIndexer.extension, 4)
+        elif os.path.exists(path + ERecordIndexer.extension):
+            self._fasta = False
+            self._index = self._load(path + ERecordIndexer.extension, 2)
+        else:
+            raise Exception(f"No index found for '{path}' (build one with build_index())")
+
+        self._fh    = open(path, "rb")
+        self._map   = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else b""
+        self._view  = memoryview(self._map)
+
+    def _load(self, path, fields):
+
+        index = {}
+
+        with open(path) as fh:
+            for line in fh:
+                name, *values = line.rstrip("\n").split("\t")
+                index[name] = tuple(int(value) for value in values[:fields])
+
+        return index
+
+    def names(self):
+        return list(self._index)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def _entry(self, name):
+
+        if self._view is None:
+            raise ValueError(f"I/O operation on closed indexed file '{self._path}'")
+
+        entry = self._index.get(name)
+
+        if entry is None:
+            raise KeyError(name)
+
+        return entry
+
+    def record(self, name):
+
+        """
+        Return the record ``name`` as a memoryview; for FASTA files, the sequence lines
+        """
+
+        if not self._fasta:
+            offset, length = self._entry(name)
+            return self._view[offset:offset + length]
+
+        length, offset, linebases, linewidth = self._entry(name)
+
+        if not length:
+            return self._view[offset:offset]
+
+        lines = (length - 1) // linebases
+
+        return self._view[offset:offset + lines * linewidth + length - lines * linebases]
+
+    def length(self, name):
+
+        if not self._fasta:
+            raise Exception("Sequence lengths are available from FASTA indexes only")
+
+        return self._entry(name)[0]
+
+    def sequence(self, name, start=1, stop=None):
+
+        """
+        Return bases ``start`` to ``stop`` (1-based, inclusive, as EFetch's seq_start/seq_stop)
+        of sequence ``name``: a memoryview if they lie on a single line, bytes otherwise
+        """
+
+        if not self._fasta:
+            raise Exception("Sequences are available from FASTA indexes only")
+
+        length, offset, linebases, linewidth = self._entry(name)
+
+        stop  = length if stop is None else min(stop, length)
+        start = max(start, 1)
+
+        if start > stop:
+            return self._view[offset:offset]
+
+        first = offset + (start - 1) // linebases * linewidth + (start - 1) % linebases
+        last  = offset + (stop - 1) // linebases * linewidth + (stop - 1) % linebases + 1
+
+        if (start - 1) // linebases == (stop - 1) // linebases:
+            return self._view[first:last]
+
+        return self._map[first:last].replace(b"\r", b"").replace(b"\n", b"")
+
+    def close(self):
+
+        if self._view is None:
+            return
+
+        self._view.release()
+
+        try:
+            if self._map:
+                self._map.close()
+
+        except BufferError:
+            #
+            # Records returned by record() and sequence() are still alive: leave the map to
+            # them, it is unmapped when the last one goes away
+            #
+
+            logging.debug("[INDEX] Records of '%s' still referenced, deferring unmap", self._path)
+
+        self._view, self._map = None, None
+
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+all = [ EFastaIndexer, ERecordIndexer, EIndexedFile, indexer, index_kind, build_index ]
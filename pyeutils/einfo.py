@@ -20,8 +20,10 @@
 
 from . epipe import state
 from . import logging
+from . etransport import get_transport
+from . epayload import EPayload
+from . eparse import decode_text
 
-import requests
 
 class EInfo(object):
 
@@ -42,9 +44,21 @@ class EInfo(object):
 
     _ep5 = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/einfo.fcgi';
 
-    def __init__(self, db="", retmode="xml", version="2.0"):
+    def __init__(self, db="", retmode="xml", version="2.0", cache=True):
+
+        """
+        Initialize an EInfo object.
+
+        db              : Gather statistics from this Entrez db. If empty, the list of all
+                          valid Entrez databases is returned.
+
+        cache           : Serve XML results from the process-wide EInfo cache (see EInfoCache),
+                          instead of issuing a new request for every instance (default: True)
+
+        """
       
         self._db      = db
+        self._cache   = cache and retmode == "xml" and version == "2.0"
         
         self._einfo_payload = {
             "db"        : db,
@@ -52,28 +66,27 @@ class EInfo(object):
             "version"   : version
         }
 
-        self._params    = "&".join([f"{k}={v}" for k, v in self._einfo_payload.items()])
+        self._params    = EPayload(self._einfo_payload)
 
         self._results   = ""
         self._retmode   = retmode
 
-        logging.info(f"[OBJECTS:EINFO]   Requesting to db : '{db}' ")
-        logging.info(f"[OBJECTS:EINFO]            retmode : {self._einfo_payload['retmode']}")
-        logging.info(f"[OBJECTS:EINFO]            version : {self._einfo_payload['version']}")
+        logging.info("[OBJECTS:EINFO]   Requesting to db : '%s' ", db)
+        logging.info("[OBJECTS:EINFO]            retmode : %s", retmode)
+        logging.info("[OBJECTS:EINFO]            version : %s", version)
 
 
     def _get_results(self, *args, **kwargs):
 
-        response = requests.Response()
 
         try:
-            response = requests.get(self._ep5, self._params)
+            response = get_transport().get(self._ep5, self._params)
 
             if response.status_code != 200:
                 logging.error(f"EInfo request did not complete successfully (HTTP {response.status_code})")
                 return ""
 
-            self._results   = response.text
+            self._results   = decode_text(response.content)
                             
         except Exception as e:
             logging.error(f"{str(e)}")
@@ -85,9 +98,278 @@ class EInfo(object):
     def results(self):
 
         if not self._results:
+            if self._cache:
+                try:
+                    self._results = get_einfo_cache().results(self._db, einfo=self)
+                except Exception as e:
+                    #
+                    # Failed requests are not cached: return what the request returned
+                    # (the error message, or an empty string), as uncached EInfo objects do
+                    #
+
+                    logging.error(f"{str(e)}")
+
+                return self._results
+
             self._results = self._get_results()
 
         return self._results
 
 
-all = [ EInfo ]
+def _parse_einfo(results):
+
+    """
+    Parse an EInfo (version 2.0) XML result into O(1) lookup indexes:
+
+    databases   : set of valid Entrez db names (from the db list, or the db itself)
+    fields      : { lowercase field Name/FullName : field Name }
+    links       : { link Name : DbTo }
+
+    Return None if ``results`` is not a valid EInfo result.
+
+    N.B.: Parsed via ElementTree, as HTML-oriented soup parsers treat <Link> as an empty tag.
+
+    """
+
+    import xml.etree.ElementTree as ET
+
+    try:
+        root = ET.fromstring(results)
+    except ET.ParseError as e:
+        return None
+
+    index = { "databases" : set(), "fields" : {}, "links" : {} }
+
+    dblist = root.find("DbList")
+    dbinfo = root.find("DbInfo")
+
+    if dblist is not None:
+        index["databases"] = set(db.text.strip() for db in dblist.findall("DbName") if db.text)
+
+    elif dbinfo is not None:
+        dbname = dbinfo.findtext("DbName")
+
+        if dbname:
+            index["databases"].add(dbname.strip())
+
+        for field in dbinfo.iterfind("FieldList/Field"):
+            name     = (field.findtext("Name") or "").strip()
+            fullname = (field.findtext("FullName") or "").strip()
+
+            if not name:
+                continue
+
+            index["fields"][name.lower()] = name
+
+            if fullname:
+                index["fields"][fullname.lower()] = name
+
+        for link in dbinfo.iterfind("LinkList/Link"):
+            name = (link.findtext("Name") or "").strip()
+
+            if name:
+                index["links"][name] = (link.findtext("DbTo") or "").strip()
+    else:
+        return None
+
+    return index
+
+
+class EInfoCache(object):
+
+    """
+    EInfoCache Class object:
+
+    Process-wide cache of EInfo results, optionally persisted on disk, exposing parsed indexes
+    of databases, search fields and link names so that ``db``, ``field`` and ``linkname`` values
+    can be validated locally before building ESearch/ELink payloads.
+
+    Entries expire after ``ttl`` seconds and are transparently re-requested.
+
+    """
+
+    def __init__(self, ttl=86400, path=None):
+
+        """
+        ttl             : Seconds after which a cached EInfo result is requested again
+                          (default: 1 day)
+
+        path            : Directory where EInfo results are persisted as JSON files, shared
+                          among processes and runs (default: memory only)
+
+        """
+
+        import threading
+
+        self._ttl       = ttl
+        self._path      = path
+        self._entries   = {}
+        self._lock      = threading.Lock()
+
+        if path:
+            import os
+            os.makedirs(path, exist_ok=True)
+
+    def _filename(self, db):
+
+        import os
+
+        return os.path.join(self._path, f"einfo-{db or '_all'}.json")
+
+    def _load(self, db):
+
+        import json, time
+
+        try:
+            with open(self._filename(db)) as fh:
+                entry = json.load(fh)
+
+            if time.time() - entry["time"] < self._ttl:
+                index = _parse_einfo(entry["results"])
+
+                if index:
+                    return (entry["time"], entry["results"], index)
+
+        except (OSError, ValueError, KeyError) as e:
+            pass
+
+        return None
+
+    def _store(self, db, entry):
+
+        import json, os
+
+        filename = self._filename(db)
+
+        try:
+            with open(f"{filename}.tmp", "w") as fh:
+                json.dump({ "time" : entry[0], "results" : entry[1] }, fh)
+
+            os.replace(f"{filename}.tmp", filename)
+
+        except OSError as e:
+            logging.warning(f"[OBJECTS:EINFO] Unable to store EInfo cache entry '{filename}' : {str(e)}")
+
+    def _entry(self, db, einfo=None):
+
+        import time
+
+        with self._lock:
+            entry = self._entries.get(db)
+
+            if entry and time.time() - entry[0] < self._ttl:
+                return entry
+
+        if self._path:
+            entry = self._load(db)
+
+            if entry:
+                with self._lock:
+                    self._entries[db] = entry
+
+                return entry
+
+        results = (einfo or EInfo(db, cache=False))._get_results()
+        index   = _parse_einfo(results) if results else None
+
+        if not index:
+            raise Exception(f"EInfo request for db '{db}' did not return a valid result")
+
+        entry = (time.time(), results, index)
+
+        with self._lock:
+            self._entries[db] = entry
+
+        if self._path:
+            self._store(db, entry)
+
+        return entry
+
+    def results(self, db="", einfo=None):
+
+        """
+        Return the raw EInfo XML result for ``db``, requested through ``einfo`` (an EInfo
+        object) if not cached. Raise an Exception if the request fails.
+        """
+
+        return self._entry(db, einfo)[1]
+
+    def databases(self):
+
+        """
+        Return the set of valid Entrez db names
+        """
+
+        return self._entry("")[2]["databases"]
+
+    def fields(self, db):
+
+        """
+        Return the search fields index of ``db``, as { lowercase Name/FullName : Name }
+        """
+
+        return self._entry(db)[2]["fields"]
+
+    def links(self, db):
+
+        """
+        Return the link names index of ``db``, as { link name : target db }
+        """
+
+        return self._entry(db)[2]["links"]
+
+    def has_database(self, db):
+        return db in self.databases()
+
+    def has_field(self, db, field):
+        return field.lower() in self.fields(db)
+
+    def has_link(self, dbfrom, linkname, db=None):
+
+        """
+        Return True if ``linkname`` is a valid link out of ``dbfrom`` (towards ``db``, if given)
+        """
+
+        links = self.links(dbfrom)
+
+        return linkname in links and (db is None or links[linkname] == db)
+
+    def invalidate(self, db=None):
+
+        """
+        Drop a single cached db (or every db, if None) from memory
+        """
+
+        with self._lock:
+            if db is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(db, None)
+
+##
+## Process-wide EInfo cache
+##
+
+_einfo_cache = EInfoCache()
+
+def get_einfo_cache():
+
+    """
+    Return the EInfo cache shared by the process
+    """
+
+    return _einfo_cache
+
+def set_einfo_cache(cache):
+
+    """
+    Replace the process-wide EInfo cache (e.g. with an on-disk one), returning the previous one
+    """
+
+    global _einfo_cache
+
+    previous, _einfo_cache = _einfo_cache, cache
+
+    return previous
+
+all = [ EInfo, EInfoCache, get_einfo_cache, set_einfo_cache ]
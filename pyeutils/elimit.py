@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 Giulio Piemontese <gpiemont [at] protonmail.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from . import logging
+from . import edeadline
+
+import struct
+import threading
+import time
+
+#
+# Entrez systems do not support more than 3 unauthenticated requests per second
+# (10 per second with an API key; pyeutils does not send API keys yet, only use
+# EUTILS_RATE_APIKEY when adding one to the requests yourself)
+#
+
+EUTILS_RATE         = 3
+EUTILS_RATE_APIKEY  = 10
+
+def _take(tokens, last, now, rate, burst):
+
+    """
+    Take a token from a bucket holding ``tokens`` at time ``last``; return the new number of
+    tokens and how many seconds the caller has to wait before using the token taken
+    """
+
+    tokens = min(burst, tokens + max(now - last, 0.0) * rate) - 1
+
+    return tokens, (0.0 if tokens >= 0 else -tokens / rate)
+
+class ELocalBucket(object):
+
+    """
+    ELocalBucket Class object:
+
+    Token bucket state held in memory: coordinates the threads of a single process.
+
+    Every bucket backend exposes ``reserve(rate, burst)``, taking a token and returning how
+    many seconds the caller has to wait before using it.
+
+    """
+
+    def __init__(self):
+
+        self._tokens    = None
+        self._last      = time.monotonic()
+        self._lock      = threading.Lock()
+
+    def reserve(self, rate, burst):
+
+        with self._lock:
+            now = time.monotonic()
+
+            if self._tokens is None:
+                self._tokens = burst
+
+            self._tokens, wait = _take(self._tokens, self._last, now, rate, burst)
+            self._last = now
+
+            return wait
+
+class EFileBucket(object):
+
+    """
+    EFileBucket Class object:
+
+    Token bucket state held in a file guarded by an exclusive lock (``fcntl.flock``):
+    coordinates every process of a host sharing the same file, e.g. all the workers
+    of a pipeline.
+
+        limiter = ERateLimiter(rate=EUTILS_RATE, backend=EFileBucket(key="pipeline"))
+
+    path            : Bucket file (default: 'pyeutils/<key>.bucket' in $XDG_RUNTIME_DIR, or in
+                      ~/.cache if unset)
+    key             : Name of the shared bucket, used to name the default file
+
+    The file is only readable and writable by its owner: processes of other users of the
+    host cannot share (or tamper with) the bucket.
+
+    """
+
+    _state = struct.Struct("=dd")
+
+    def __init__(self, path=None, key="default"):
+
+        self._path  = path or self._default_path(key)
+        self._fd    = None
+        self._pid   = None
+        self._lock  = threading.Lock()
+
+    @staticmethod
+    def _default_path(key):
+
+        import os
+
+        directory = os.path.join(os.environ.get("XDG_RUNTIME_DIR") or os.path.join(os.path.expanduser("~"), ".cache"), "pyeutils")
+
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+        return os.path.join(directory, f"{key}.bucket")
+
+    def _open(self):
+
+        import os
+
+        #
+        # flock() locks are held by the open file description, which a forked child shares
+        # with its parent: every process has to open the file on its own
+        #
+
+        if self._pid != os.getpid():
+            self._fd  = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o600)
+            self._pid = os.getpid()
+
+        return self._fd
+
+    def reserve(self, rate, burst):
+
+        import fcntl, os
+
+        with self._lock:
+            fd = self._open()
+
+            fcntl.flock(fd, fcntl.LOCK_EX)
+
+            try:
+                data = os.pread(fd, self._state.size, 0)
+                now  = time.time()
+
+                tokens, last = self._state.unpack(data) if len(data) == self._state.size else (burst, now)
+                tokens, wait = _take(tokens, last, now, rate, burst)
+
+                os.pwrite(fd, self._state.pack(tokens, now), 0)
+
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+            return wait
+
+class ERemoteBucket(object):
+
+    """
+    ERemoteBucket Class object:
+
+    Token bucket state held by a remote service, coordinating several hosts. The service
+    is POSTed ``key``, ``rate`` and ``burst`` and replies with the seconds to wait, as
+    plain text (see ``pyeutils_tests/mockserver.py`` for a stand-in).
+
+    If the service cannot be reached, requests are throttled by an in-process bucket
+    instead, at the rate divided by the number of ``hosts`` sharing the bucket, so that a
+    failing coordinator neither stops the pipeline nor lets every host send at the full
+    rate. With ``fail_closed``, requests fail instead.
+
+    url             : Reservation endpoint
+    key             : Name of the shared bucket (e.g. one per NCBI rate budget)
+    timeout         : Seconds to wait for the service
+    hosts           : Number of hosts (processes) sharing the bucket
+    fail_closed     : Raise an Exception instead of throttling locally when the service
+                      cannot be reached
+
+    """
+
+    def __init__(self, url, key="default", timeout=5.0, hosts=1, fail_closed=False):
+
+        self._url       = url
+        self._key       = key
+        self._timeout   = timeout
+        self._hosts     = max(1, hosts)
+        self._closed    = fail_closed
+        self._fallback  = ELocalBucket()
+        self._failing   = False
+        self._session   = None
+
+    def reserve(self, rate, burst):
+
+        import requests
+
+        try:
+            if self._session is None:
+                self._session = requests.Session()
+
+            response = self._session.post(self._url, data={ "key" : self._key, "rate" : rate, "burst" : burst },
+                                timeout=self._timeout)
+            response.raise_for_status()
+
+            wait = float(response.text)
+
+        except Exception as e:
+            if not self._failing:
+                logging.error(f"[LIMIT] Rate limit service {self._url} unavailable, "
+                              + ("failing requests" if self._closed else f"throttling locally at {rate / self._hosts:.2f} req/s")
+                              + f" : {str(e)}")
+
+            self._failing = True
+
+            if self._closed:
+                raise Exception(f"[LIMIT] Rate limit service {self._url} unavailable : {str(e)}")
+
+            return self._fallback.reserve(rate / self._hosts, 1.0)
+
+        if self._failing:
+            logging.info(f"[LIMIT] Rate limit service {self._url} available again")
+
+        self._failing = False
+
+        return wait
+
+class ERateLimiter(object):
+
+    """
+    ERateLimiter Class object:
+
+    Thread-safe token bucket limiting the number of requests per second sent to NCBI.
+    Every upstream call of the shared transport acquires a token first, so that
+    concurrent requests (threads, fan-outs, batches) never exceed the Entrez rate.
+
+    The bucket state lives in a pluggable backend: in memory (ELocalBucket, default), in a
+    file shared by the processes of a host (EFileBucket), or in a remote service shared by
+    several hosts (ERemoteBucket).
+
+    """
+
+    def __init__(self, rate=EUTILS_RATE, burst=None, backend=None):
+
+        """
+        rate            : Requests per second (default: 3, the unauthenticated Entrez limit)
+
+        burst           : Maximum number of requests issued back-to-back (default: 1). A larger
+                          burst lets idle time be caught up, at the cost of exceeding ``rate``
+                          over short periods: up to ``rate + burst`` requests in the first second
+
+        backend         : Bucket backend (default: an in-process ELocalBucket)
+
+        """
+
+        self._rate      = float(rate)
+        self._burst     = float(burst or 1)
+        self._backend   = backend or ELocalBucket()
+
+    def _reserve(self):
+
+        """
+        Reserve a token, returning how many seconds the caller has to wait before using it
+        """
+
+        return self._backend.reserve(self._rate, self._burst)
+
+    def acquire(self):
+
+        """
+        Block until a request can be sent. Return the time spent waiting, in seconds.
+
+        The wait is interrupted by the cancellation of the running pipeline, and refused
+        (EDeadlineExceeded) if it would outlast the pipeline deadline.
+        """
+
+        wait = self._reserve()
+
+        if wait > 0:
+            edeadline.sleep(wait)
+
+        return wait
+
+    def rate(self):
+        return self._rate
+
+    def backend(self):
+        return self._backend
+
+all = [ ERateLimiter, ELocalBucket, EFileBucket, ERemoteBucket, EUTILS_RATE, EUTILS_RATE_APIKEY ]
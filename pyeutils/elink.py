@@ -20,10 +20,16 @@
 
 from . evars import EUTILS_APPNAME
 from . epipe import state
-from . esearch import ESearch
+from . esearch import ESearch, date_range
 from . import logging
+from . elog import truncated, debugging
+from . etransport import get_transport
+from . epayload import EPayload
+from . etrace import traced
+from . emetrics import timed_stage
+from . einfo import get_einfo_cache
+from . eparse import decode_text
 
-import requests
 
 class ELink(ESearch):
 
@@ -56,8 +62,8 @@ class ELink(ESearch):
                 linkname=None, ids=[], idtype='',
                 retmode='xml', webenv=None, querykey=None,
                 holding='',
-                datetype='', reldate=None, minmaxdate='',
-                source=None):
+                datetype='', reldate=None, mindate='', maxdate='', minmaxdate='',
+                source=None, validate=False):
 
         """
         Initialize an ELink object.
@@ -89,8 +95,24 @@ class ELink(ESearch):
                                 results = link.results() << Sequentially executes ``search`` and ``link``.
  
                             N.B.: Current Pipeline status can be retrieved via ``self._status``. 
+
+        validate         : Check ``dbfrom``, ``db`` and ``linkname`` (the default '<dbfrom>_<db>' one included)
+                           against the process-wide EInfo cache before any request is made, raising an
+                           Exception if invalid.
         """
 
+        if validate:
+            cache = get_einfo_cache()
+
+            for name in (dbfrom, db):
+                if not cache.has_database(name):
+                    raise Exception(f"'{name}' is not a valid Entrez database")
+
+            name = linkname or f"{dbfrom}_{db}"
+
+            if cmd.startswith("neighbor") and not cache.has_link(dbfrom, name, db):
+                raise Exception(f"'{name}' is not a valid link name from '{dbfrom}' to '{db}'")
+
         self._querykey = querykey
         self._webenv   = webenv
      
@@ -113,15 +135,17 @@ class ELink(ESearch):
         self._idtype     = idtype
         self._datetype   = datetype
         self._reldate    = reldate
-        self._minmaxdate = minmaxdate
+
+        dates            = date_range(mindate, maxdate, minmaxdate, "minmaxdate")
+
+        self._mindate    = dates.get("mindate", "")
+        self._maxdate    = dates.get("maxdate", "")
 
         if source:
             if not querykey or not webenv:
-                    import time
                     try:
                         # Gather results from base class (the ESearch object, ndr)
-                        self._webenv, self._querykey, self._results = super(self.__class__, self)._get_results()
-                        time.sleep(1)
+                        self._webenv, self._querykey, _ = super(self.__class__, self)._get_results()
                     except Exception as e:
                         raise Exception(f"Error in ELink initialization : {str(e)}")
 
@@ -157,10 +181,7 @@ class ELink(ESearch):
         if reldate:
             self._elink_payload["reldate"] = reldate
 
-        if minmaxdate:
-            self._elink_payload["minmaxdate"] = minmaxdate
-
-        import json
+        self._elink_payload.update(dates)
 
         if "history" in self._cmd and not self._webenv and not self._querykey:
             logging.warning(f"[OBJECTS:ELINK] Requested ELink cmd={self._cmd} requires data from History Server, "
@@ -170,24 +191,32 @@ class ELink(ESearch):
             logging.warning(f"[OBJECTS:ELINK] WebEnv and query_key have been set, but requested ELink (cmd={self._cmd}) "
                                 "does not require them. Further responses can be empty.")
 
-        logging.debug(f"ELINK Payload : {json.dumps(self._elink_payload, indent=4)}")
+        if debugging():
+            import json
 
-        self._params    = "&".join([f"{k}={v}" for k, v in self._elink_payload.items()])
+            logging.debug("ELINK Payload : %s", truncated(json.dumps(self._elink_payload, indent=4), limit=4096))
+
+        self._params    = EPayload(self._elink_payload)
         self._objs      = {}
     
+    @traced("ELink",
+        before=lambda self: { "dbfrom" : self._dbfrom, "db" : self._db, "cmd" : self._cmd,
+                              "query_key" : self._elink_payload.get("query_key") },
+        after=lambda self: { "result_query_key" : self._querykey })
+    @timed_stage("ELINK")
     def _get_elinks(self, *args, **kwargs):
 
         try:
-            logging.debug(f"Requesting ELINKS URL {self._ep1}?{self._params}")
+            logging.debug("Requesting ELINKS URL %s?%s", self._ep1, truncated(self._params.encoded()))
 
-            response = requests.get(self._ep1, self._params)
+            response = get_transport().get(self._ep1, self._params)
 
             if response.status_code != 200:
                 logging.error(f"ELink request did not complete successfully (HTTP {response.status_code} : {response.reason})")
-                logging.error(f"ELink error message : {response.text}")
+                logging.error(f"ELink error message : {decode_text(response.content)}")
                 return ""
     
-            self._results   = response.text
+            self._content   = response.content
             self._status    = state.ELINK
             
             webenv   = self.parse("WebEnv")
@@ -208,14 +237,16 @@ class ELink(ESearch):
             import traceback as tb
             logging.error(f"{tb.format_exc()}")
             logging.error(f"{str(e)}")
-            self._results = f"{str(e)}"
+            self._content = str(e).encode()
 
-        return self._webenv, self._querykey, self._results
+        return self._webenv, self._querykey, self._content
 
     def results(self):
 
         try:
-            _, _, self._results = self._get_elinks()
+            _, _, content = self._get_elinks()
+
+            self._results = decode_text(content)
 
         except Exception as e:
             import traceback as tb
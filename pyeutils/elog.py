@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 Giulio Piemontese <gpiemont [at] protonmail.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import logging
+
+#
+# Maximum length of a value rendered in a log line
+#
+
+LOG_TRUNCATE = 200
+
+class truncated(object):
+
+    """
+    Lazily rendered log argument: the wrapped value is converted to text only if the
+    log record is actually emitted, and cut to ``limit`` characters.
+
+        logging.info("[OBJECTS:EPOST]   Requesting IDs   : %s", truncated(ids))
+
+    Lists, tuples and sets are rendered as their first items plus the total count, so that
+    huge UID lists are never joined.
+
+    """
+
+    __slots__ = ("_value", "_limit")
+
+    def __init__(self, value, limit=None):
+
+        self._value = value
+        self._limit = limit or LOG_TRUNCATE
+
+    def __str__(self):
+
+        value = self._value
+
+        if isinstance(value, (list, tuple, set)):
+            items = []
+            size  = 0
+
+            for item in value:
+                item  = str(item)
+                size += len(item) + 1
+
+                if size > self._limit:
+                    break
+
+                items.append(item)
+
+            text = ",".join(items)
+
+            if len(items) < len(value):
+                text += f",… ({len(value)} items)"
+
+            return text
+
+        text = str(value)
+
+        if len(text) > self._limit:
+            return f"{text[:self._limit]}… ({len(text)} chars)"
+
+        return text
+
+    __repr__ = __str__
+
+class EJSONFormatter(logging.Formatter):
+
+    """
+    Format log records as single-line JSON objects (structured logging), carrying
+    time, level, logger, message, thread and any ``extra`` attribute of the record.
+
+    """
+
+    _reserved = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | { "message", "asctime" }
+
+    def format(self, record):
+
+        import json
+
+        entry = {
+            "time"      : self.formatTime(record, self.datefmt),
+            "level"     : record.levelname,
+            "logger"    : record.name,
+            "message"   : record.getMessage(),
+            "thread"    : record.threadName,
+        }
+
+        for key, value in vars(record).items():
+            if key not in self._reserved and not key.startswith("_"):
+                entry[key] = value if isinstance(value, (str, int, float, bool, type(None))) else str(value)
+
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, ensure_ascii=False)
+
+def debugging():
+
+    """
+    Return True if DEBUG records would be emitted, to guard expensive debug-only computations
+    """
+
+    return logging.getLogger().isEnabledFor(logging.DEBUG)
+
+all = [ truncated, EJSONFormatter, LOG_TRUNCATE, debugging ]
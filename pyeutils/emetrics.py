@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 Giulio Piemontese <gpiemont [at] protonmail.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import functools
+import threading
+import time
+
+#
+# Registered observers, and per-thread measurement context (current stage,
+# parse time accumulated by the stage, timings of the current HTTP request)
+#
+
+_observers  = []
+_lock       = threading.Lock()
+_context    = threading.local()
+
+#
+# Upper bounds (seconds) of the latency histogram buckets, shared by every exported histogram
+#
+
+EMETRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class ERequestRecord(object):
+
+    """
+    Measurements of a single HTTP request issued by the shared transport.
+    Durations are in seconds; connection phases are 0.0 when a pooled connection was reused.
+
+    endpoint        : E-utility name (e.g. 'esearch')
+    method          : HTTP method
+    stage           : Pipeline stage which issued the request (e.g. 'ESEARCH'), if any
+    status          : HTTP status code (None if the request failed)
+    wait            : Time spent waiting for the rate limiter
+    dns             : Name resolution
+    connect         : TCP connection
+    tls             : TLS handshake
+    ttfb            : Time to first byte, after the connection was established
+    download        : Response body download
+    bytes           : Response body size (decompressed)
+    wire_bytes      : Response body size as transferred (compressed, when the response was)
+    retries         : Number of retries before the final attempt
+    error           : Exception raised by the final attempt, if any
+
+    """
+
+    def __init__(self, endpoint, method, stage=None):
+
+        self.endpoint   = endpoint
+        self.method     = method
+        self.stage      = stage
+        self.status     = None
+
+        self.wait       = 0.0
+        self.dns        = 0.0
+        self.connect    = 0.0
+        self.tls        = 0.0
+        self.ttfb       = 0.0
+        self.download   = 0.0
+
+        self.bytes      = 0
+        self.wire_bytes = 0
+        self.retries    = 0
+        self.error      = None
+
+    def duration(self):
+        return self.dns + self.connect + self.tls + self.ttfb + self.download
+
+class EStageRecord(object):
+
+    """
+    Measurements of a single pipeline stage (ESearch._get_results, ELink._get_elinks, ...)
+
+    stage           : Stage name (e.g. 'ESEARCH')
+    duration        : Wall time of the stage, in seconds
+    parse           : CPU time spent parsing results within the stage, in seconds
+    error           : Exception raised by the stage, if any
+
+    """
+
+    def __init__(self, stage, duration, parse, error=None):
+
+        self.stage      = stage
+        self.duration   = duration
+        self.parse      = parse
+        self.error      = error
+
+class EObserver(object):
+
+    """
+    EObserver Class object:
+
+    Base class for metrics observers. Register an instance with add_observer() and override
+    request() and/or stage(); both are called synchronously, in the thread that made the measurement.
+
+    """
+
+    def request(self, record):
+        pass
+
+    def stage(self, record):
+        pass
+
+def add_observer(observer):
+
+    """
+    Register ``observer`` to receive request and stage measurements
+    """
+
+    with _lock:
+        if observer not in _observers:
+            _observers.append(observer)
+
+    return observer
+
+def remove_observer(observer):
+
+    with _lock:
+        if observer in _observers:
+            _observers.remove(observer)
+
+def observing():
+
+    """
+    Return True if any observer is registered (measurements are skipped otherwise)
+    """
+
+    return bool(_observers)
+
+def notify_request(record):
+
+    for observer in list(_observers):
+        observer.request(record)
+
+def notify_stage(record):
+
+    for observer in list(_observers):
+        observer.stage(record)
+
+def current_stage():
+    return getattr(_context, "stage", None)
+
+def timed_stage(name):
+
+    """
+    Decorate a stage method (e.g. ESearch._get_results) to report its duration and parse time
+    """
+
+    def decorator(method):
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+
+            if not _observers:
+                return method(*args, **kwargs)
+
+            previous = (getattr(_context, "stage", None), getattr(_context, "parse", 0.0))
+
+            _context.stage = name
+            _context.parse = 0.0
+
+            error = None
+            start = time.perf_counter()
+
+            try:
+                return method(*args, **kwargs)
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                record = EStageRecord(name, time.perf_counter() - start, _context.parse, error)
+
+                _context.stage, _context.parse = previous
+
+                notify_stage(record)
+
+        return wrapper
+
+    return decorator
+
+def timed_parse(method):
+
+    """
+    Decorate a parse method, accounting its CPU time to the enclosing stage
+    """
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+
+        if not _observers or getattr(_context, "stage", None) is None:
+            return method(*args, **kwargs)
+
+        start = time.thread_time()
+
+        try:
+            return method(*args, **kwargs)
+        finally:
+            _context.parse += time.thread_time() - start
+
+    return wrapper
+
+class EMetrics(EObserver):
+
+    """
+    EMetrics Class object:
+
+    Built-in observer aggregating request and stage measurements, exportable in Prometheus
+    text format (prometheus()) or as a human readable table (summary()).
+
+        metrics = add_observer(EMetrics())
+        [...]
+        print(metrics.summary())
+
+    """
+
+    _phases  = ("wait", "dns", "connect", "tls", "ttfb", "download")
+    _buckets = EMETRICS_BUCKETS
+
+    def __init__(self, prefix="pyeutils"):
+
+        self._prefix    = prefix
+        self._lock      = threading.Lock()
+
+        self.reset()
+
+    def reset(self):
+
+        with self._lock:
+            self._requests  = {}
+            self._stages    = {}
+
+    def _histogram(self):
+        return [ 0 ] * (len(self._buckets) + 1)
+
+    def _observe(self, histogram, value):
+
+        for i, bound in enumerate(self._buckets):
+            if value <= bound:
+                histogram[i] += 1
+                return
+
+        histogram[-1] += 1
+
+    def request(self, record):
+
+        key = (record.endpoint, record.method)
+
+        with self._lock:
+            entry = self._requests.get(key)
+
+            if not entry:
+                entry = self._requests[key] = {
+                    "count" : 0, "errors" : 0, "bytes" : 0, "wire_bytes" : 0, "retries" : 0, "status" : {},
+                    "sums" : dict.fromkeys(self._phases, 0.0), "duration" : 0.0,
+                    "histogram" : self._histogram(),
+                }
+
+            entry["count"]      += 1
+            entry["bytes"]      += record.bytes
+            entry["wire_bytes"] += record.wire_bytes
+            entry["retries"]    += record.retries
+
+            if record.error or not record.status or record.status >= 400:
+                entry["errors"] += 1
+
+            status = str(record.status or "error")
+            entry["status"][status] = entry["status"].get(status, 0) + 1
+
+            for phase in self._phases:
+                entry["sums"][phase] += getattr(record, phase)
+
+            entry["duration"] += record.duration()
+            self._observe(entry["histogram"], record.duration())
+
+    def stage(self, record):
+
+        with self._lock:
+            entry = self._stages.get(record.stage)
+
+            if not entry:
+                entry = self._stages[record.stage] = {
+                    "count" : 0, "errors" : 0, "duration" : 0.0, "parse" : 0.0,
+                    "histogram" : self._histogram(),
+                }
+
+            entry["count"]    += 1
+            entry["errors"]   += 1 if record.error else 0
+            entry["duration"] += record.duration
+            entry["parse"]    += record.parse
+
+            self._observe(entry["histogram"], record.duration)
+
+    def _export_histogram(self, lines, name, labels, histogram, total, count):
+
+        cumulative = 0
+
+        for bound, n in zip(self._buckets, histogram):
+            cumulative += n
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+        lines.append(f'{name}_sum{{{labels}}} {total}')
+        lines.append(f'{name}_count{{{labels}}} {count}')
+
+    def prometheus(self):
+
+        """
+        Return the aggregated metrics in Prometheus text exposition format
+        """
+
+        p     = self._prefix
+        lines = []
+
+        with self._lock:
+            requests = dict(self._requests)
+            stages   = dict(self._stages)
+
+        lines.append(f"# HELP {p}_requests_total HTTP requests sent to the E-utilities.")
+        lines.append(f"# TYPE {p}_requests_total counter")
+
+        for (endpoint, method), entry in sorted(requests.items()):
+            for status, n in sorted(entry["status"].items()):
+                lines.append(f'{p}_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {n}')
+
+        for name, field, help in (("retries", "retries", "Retried HTTP requests."),
+                                  ("response_bytes", "bytes", "Response body bytes received (decompressed)."),
+                                  ("response_wire_bytes", "wire_bytes", "Response body bytes transferred (compressed).")):
+            lines.append(f"# HELP {p}_{name}_total {help}")
+            lines.append(f"# TYPE {p}_{name}_total counter")
+
+            for (endpoint, method), entry in sorted(requests.items()):
+                lines.append(f'{p}_{name}_total{{endpoint="{endpoint}",method="{method}"}} {entry[field]}')
+
+        lines.append(f"# HELP {p}_request_phase_seconds Time spent in each phase of HTTP requests.")
+        lines.append(f"# TYPE {p}_request_phase_seconds summary")
+
+        for (endpoint, method), entry in sorted(requests.items()):
+            for phase in self._phases:
+                labels = f'endpoint="{endpoint}",method="{method}",phase="{phase}"'
+                lines.append(f'{p}_request_phase_seconds_sum{{{labels}}} {entry["sums"][phase]}')
+                lines.append(f'{p}_request_phase_seconds_count{{{labels}}} {entry["count"]}')
+
+        lines.append(f"# HELP {p}_request_duration_seconds HTTP request duration (rate limiter wait excluded).")
+        lines.append(f"# TYPE {p}_request_duration_seconds histogram")
+
+        for (endpoint, method), entry in sorted(requests.items()):
+            self._export_histogram(lines, f"{p}_request_duration_seconds", f'endpoint="{endpoint}",method="{method}"',
+                                    entry["histogram"], entry["duration"], entry["count"])
+
+        lines.append(f"# HELP {p}_stage_duration_seconds Pipeline stage duration.")
+        lines.append(f"# TYPE {p}_stage_duration_seconds histogram")
+
+        for stage, entry in sorted(stages.items()):
+            self._export_histogram(lines, f"{p}_stage_duration_seconds", f'stage="{stage}"',
+                                    entry["histogram"], entry["duration"], entry["count"])
+
+        lines.append(f"# HELP {p}_stage_parse_seconds CPU time spent parsing results, per stage.")
+        lines.append(f"# TYPE {p}_stage_parse_seconds counter")
+
+        for stage, entry in sorted(stages.items()):
+            lines.append(f'{p}_stage_parse_seconds{{stage="{stage}"}} {entry["parse"]}')
+
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+
+        """
+        Return the aggregated metrics as a table of mean values (milliseconds)
+        """
+
+        with self._lock:
+            requests = dict(self._requests)
+            stages   = dict(self._stages)
+
+        lines = [ f"{'endpoint':<16}{'count':>7}{'errors':>7}{'retries':>8}"
+                  + "".join(f"{phase:>10}" for phase in self._phases) + f"{'kib':>10}{'wire kib':>10}" ]
+
+        for (endpoint, method), entry in sorted(requests.items()):
+            n = entry["count"]
+            lines.append(f"{endpoint + ' ' + method:<16}{n:>7}{entry['errors']:>7}{entry['retries']:>8}"
+                         + "".join(f"{entry['sums'][phase] * 1000 / n:>10.2f}" for phase in self._phases)
+                         + f"{entry['bytes'] / 1024 / n:>10.1f}{entry['wire_bytes'] / 1024 / n:>10.1f}")
+
+        lines.append("")
+        lines.append(f"{'stage':<16}{'count':>7}{'errors':>7}{'duration':>10}{'parse':>10}")
+
+        for stage, entry in sorted(stages.items()):
+            n = entry["count"]
+            lines.append(f"{stage:<16}{n:>7}{entry['errors']:>7}"
+                         f"{entry['duration'] * 1000 / n:>10.2f}{entry['parse'] * 1000 / n:>10.2f}")
+
+        return "\n".join(lines)
+
+all = [ EObserver, EMetrics, ERequestRecord, EStageRecord, add_observer, remove_observer,
+        timed_stage, timed_parse, EMETRICS_BUCKETS ]
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 Giulio Piemontese <gpiemont [at] protonmail.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from . import logging
+
+import threading
+
+##
+## Record parsers: module-level functions of the raw response (str or bytes), returning
+## compact records, so that they can be shipped to worker processes
+##
+
+def decode_text(data):
+
+    """
+    Decode a raw response to str. E-utilities responses are UTF-8: no charset detection is
+    run, and undecodable bytes are replaced.
+    """
+
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return bytes(data).decode("utf-8", errors="replace")
+
+    return data or ""
+
+def parse_fasta(data):
+
+    """
+    Parse FASTA records into (header, sequence) tuples
+    """
+
+    if isinstance(data, bytes):
+        data = decode_text(data)
+
+    records = []
+
+    for chunk in data.split("\n>"):
+        chunk = chunk.strip().lstrip(">")
+
+        if not chunk:
+            continue
+
+        header, _, sequence = chunk.partition("\n")
+        records.append((header, sequence.replace("\n", "")))
+
+    return records
+
+def parse_tseq(data):
+
+    """
+    Parse TinySeq XML records (EFetch rettype='fasta', retmode='xml') into (accession.version, sequence) tuples
+    """
+
+    import xml.etree.ElementTree as ET
+
+    return [ (tseq.findtext("TSeq_accver"), tseq.findtext("TSeq_sequence"))
+             for tseq in ET.fromstring(data).iter("TSeq") ]
+
+def parse_docsums(data):
+
+    """
+    Parse ESummary results (version 2.0 DocumentSummary or 1.0 DocSum) into dicts of the
+    top-level summary fields, keyed by name, with the record UID as 'uid'
+    """
+
+    import xml.etree.ElementTree as ET
+
+    root    = ET.fromstring(data)
+    records = []
+
+    for docsum in root.iter("DocumentSummary"):
+        record = { "uid" : docsum.get("uid") }
+
+        for field in docsum:
+            if len(field) == 0:
+                record[field.tag] = field.text or ""
+
+        records.append(record)
+
+    for docsum in root.iter("DocSum"):
+        record = { "uid" : docsum.findtext("Id") }
+
+        for item in docsum.findall("Item"):
+            record[item.get("Name")] = item.text or ""
+
+        records.append(record)
+
+    return records
+
+def parse_links(data):
+
+    """
+    Parse ELink results into (dbfrom, linkname, source UID, target UID) edges. The source UID
+    is None when a LinkSet merges several input UIDs (e.g. ``id=1,2,3`` instead of ``id=1&id=2``).
+    """
+
+    import xml.etree.ElementTree as ET
+
+    edges = []
+
+    for linkset in ET.fromstring(data).iter("LinkSet"):
+        dbfrom  = linkset.findtext("DbFrom")
+        ids     = [ int(uid.text) for uid in linkset.findall("IdList/Id") ]
+        source  = ids[0] if len(ids) == 1 else None
+
+        for linksetdb in linkset.findall("LinkSetDb"):
+            linkname = linksetdb.findtext("LinkName")
+
+            for target in linksetdb.findall("Link/Id"):
+                edges.append((dbfrom, linkname, source, int(target.text)))
+
+    return edges
+
+class _EDoneFuture(object):
+
+    """
+    Already completed future, returned by an inline (0 processes) EParsePool
+    """
+
+    def __init__(self, function, *args):
+
+        self._result, self._error = None, None
+
+        try:
+            self._result = function(*args)
+        except Exception as e:
+            self._error = e
+
+    def result(self, timeout=None):
+
+        if self._error:
+            raise self._error
+
+        return self._result
+
+class EParsePool(object):
+
+    """
+    EParsePool Class object:
+
+    Pool of worker processes parsing raw responses out of the network threads, so that
+    parsing scales with cores instead of holding the GIL of the fetching process.
+
+        pool    = EParsePool(processes=8)
+        records = pool.submit(parse_docsums, response).result()
+
+    processes       : Number of worker processes (default: one per core; 0 parses inline,
+                      in the calling thread)
+
+    The worker processes are started on first use.
+
+    """
+
+    def __init__(self, processes=None):
+
+        import os
+
+        self._processes = os.cpu_count() if processes is None else processes
+        self._executor  = None
+        self._lock      = threading.Lock()
+
+    def processes(self):
+        return self._processes
+
+    def _pool(self):
+
+        with self._lock:
+            if self._executor is None:
+                from concurrent.futures import ProcessPoolExecutor
+
+                logging.debug("[PARSE] Starting %d parser processes", self._processes)
+
+                self._executor = ProcessPoolExecutor(max_workers=self._processes)
+
+            return self._executor
+
+    def submit(self, parser, data):
+
+        """
+        Parse ``data`` with ``parser`` (a picklable, module-level function); return a future
+        """
+
+        if not self._processes:
+            return _EDoneFuture(parser, data)
+
+        return self._pool().submit(parser, data)
+
+    def map(self, parser, responses):
+        return [ future.result() for future in [ self.submit(parser, data) for data in responses ] ]
+
+    def close(self):
+
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+#
+# Process-wide parser pool, created on first use
+#
+
+_pool       = None
+_pool_lock  = threading.Lock()
+
+def get_parse_pool():
+
+    """
+    Return the parser pool shared by windowed pipelines (created on first use)
+    """
+
+    global _pool
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = EParsePool()
+
+    return _pool
+
+def set_parse_pool(pool):
+
+    """
+    Replace the process-wide parser pool, returning the previous one
+    """
+
+    global _pool
+
+    previous, _pool = _pool, pool
+
+    return previous
+
+all = [ EParsePool, get_parse_pool, set_parse_pool, decode_text, parse_fasta, parse_tseq, parse_docsums, parse_links ]
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 Giulio Piemontese <gpiemont [at] protonmail.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from urllib.parse import quote_plus, unquote_plus, parse_qsl
+
+def unquote_term(term):
+
+    """
+    Return the text of a query ``term`` given URL-encoded, as in E-utilities URLs
+    ('asthma[mesh]+AND+2009[pdat]'), or plain ('asthma[mesh] AND 2009[pdat]'): parameters
+    are form-encoded by the transport, which would otherwise send '+' signs literally.
+    A literal '+' is written '%2B'.
+    """
+
+    return unquote_plus(str(term))
+
+class EPayload(object):
+
+    """
+    EPayload Class object:
+
+    Immutable, form-encoded request parameters. Every parameter is encoded once, when the
+    payload is built: variants of a payload (e.g. the next window of a paginated retrieval)
+    only encode the parameters they change, sharing the encoding of the others (ID lists,
+    terms, WebEnv) with the original.
+
+        payload = EPayload({ "db" : "protein", "id" : "1,2,3", "retmax" : 500 })
+        window  = payload.replace(retstart=500)
+
+        window.encoded()        << 'db=protein&id=1%2C2%2C3&retmax=500&retstart=500'
+
+    Parameters with a None value are left out.
+
+    """
+
+    __slots__ = ("_params", "_fields", "_encoded", "_key")
+
+    def __init__(self, params=None):
+
+        """
+        params          : Parameters, as a dict, a list of (name, value) pairs or an already
+                          encoded query string
+
+        """
+
+        if isinstance(params, str):
+            params = parse_qsl(params, keep_blank_values=True)
+        elif isinstance(params, dict):
+            params = params.items()
+
+        fields = {}
+
+        for name, value in params or ():
+            if value is not None:
+                fields[str(name)] = (str(value), self._field(name, value))
+
+        self._init(fields)
+
+    def _init(self, fields):
+
+        object.__setattr__(self, "_fields", fields)
+        object.__setattr__(self, "_params", None)
+        object.__setattr__(self, "_encoded", None)
+        object.__setattr__(self, "_key", None)
+
+    @staticmethod
+    def _field(name, value):
+        return f"{quote_plus(str(name))}={quote_plus(str(value))}"
+
+    @classmethod
+    def of(cls, params):
+
+        """
+        Return ``params`` as an EPayload (``params`` itself if it already is one)
+        """
+
+        return params if isinstance(params, cls) else cls(params)
+
+    def replace(self, **changes):
+
+        """
+        Return a copy of the payload with ``changes`` applied (None removes a parameter),
+        re-encoding only the changed parameters
+        """
+
+        fields = dict(self._fields)
+
+        for name, value in changes.items():
+            if value is None:
+                fields.pop(name, None)
+            else:
+                fields[name] = (str(value), self._field(name, value))
+
+        payload = object.__new__(type(self))
+        payload._init(fields)
+
+        return payload
+
+    def encoded(self):
+
+        """
+        Return the form (query string) encoding of the payload
+        """
+
+        if self._encoded is None:
+            object.__setattr__(self, "_encoded", "&".join(field for _, field in self._fields.values()))
+
+        return self._encoded
+
+    def items(self):
+
+        """
+        Return the parameters as a list of (name, value) strings
+        """
+
+        if self._params is None:
+            object.__setattr__(self, "_params", [ (name, value) for name, (value, _) in self._fields.items() ])
+
+        return self._params
+
+    def key(self):
+
+        """
+        Return the parameters regardless of their order, e.g. to compare requests
+        """
+
+        if self._key is None:
+            object.__setattr__(self, "_key", tuple(sorted(self.items())))
+
+        return self._key
+
+    def get(self, name, default=None):
+
+        field = self._fields.get(name)
+
+        return default if field is None else field[0]
+
+    def __getitem__(self, name):
+        return self._fields[name][0]
+
+    def __contains__(self, name):
+        return name in self._fields
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __eq__(self, other):
+        return isinstance(other, EPayload) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} objects are immutable, use replace()")
+
+    def __repr__(self):
+        return f"EPayload({dict(self.items())!r})"
+
+all = [ EPayload, unquote_term ]
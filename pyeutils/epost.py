@@ -22,7 +22,12 @@ from . esearch import ESearch
 from . elink import ELink
 from . epipe import state 
 from . import logging
-import requests
+from . elog import truncated
+from . etransport import get_transport
+from . epayload import EPayload
+from . etrace import traced
+from . emetrics import timed_stage
+from . eparse import decode_text
 
 class EPost(object):
     """
@@ -48,14 +53,6 @@ class EPost(object):
         self._db      = db
         self._ids     = ids
 
-        self._epost_payload = {
-            "db"   : db,
-            "id"   : ",".join([str(i) for i in ids]),
-        }
-
-        self._params    = "&".join([f"{k}={v}" for k, v in self._epost_payload.items()])
-        self._objs      = {}
-
         if source and isinstance(source, (ESearch, EPost, ELink)):
                 self._webenv    = source._webenv
                 self._querykey  = source._querykey
@@ -63,28 +60,42 @@ class EPost(object):
                 self._webenv    = webenv
                 self._querykey  = querykey
 
+        self._epost_payload = {
+            "db"   : db,
+            "id"   : ",".join([str(i) for i in ids]),
+        }
+
+        #
+        # Append the posted UIDs to an existing Web Environment
+        #
+
+        if self._webenv:
+            self._epost_payload["WebEnv"] = self._webenv
+
+        self._params    = EPayload(self._epost_payload)
+        self._objs      = {}
+
         self._results   = ""
 
         self._status    = state.EPOST
 
-        logging.info(f"[OBJECTS:{self._status.name}]   Requesting to db : '{db}' ")
-        logging.info(f"[OBJECTS:{self._status.name}]   Requesting IDs   : {self._epost_payload['id']}")
+        logging.info("[OBJECTS:%s]   Requesting to db : '%s' ", self._status.name, db)
+        logging.info("[OBJECTS:%s]   Requesting IDs   : %s", self._status.name, truncated(ids))
 
+    @traced("EPost",
+        before=lambda self: { "db" : self._db, "ids" : len(self._ids) },
+        after=lambda self: { "query_key" : self._querykey })
+    @timed_stage("EPOST")
     def _get_epost_results(self, *args, **kwargs):
 
         try:
-            response = requests.Response()
-
-            if len(self._ids) < 200:
-                response = requests.get(self._ep4, self._params)
-            else:
-                response = requests.post(self._ep4, self._params)
+            response = get_transport().get(self._ep4, self._params)
 
             if response.status_code != 200:
                 logging.error(f"EPost did not complete successfully (HTTP {response.status_code})")
                 return ""            
 
-            self._results   = response.text
+            self._content   = response.content
                             
             self._webenv    = self.parse("WebEnv")
             self._querykey  = self.parse("QueryKey", objtype=int)
@@ -93,20 +104,33 @@ class EPost(object):
 
         except Exception as e:
             logging.error(f"{str(e)}")
-            self._results = f"{str(e)}"
+            self._content = str(e).encode()
 
-        return self._webenv, self._querykey, self._results
+        return self._webenv, self._querykey, self._content
 
 
     def results(self):
 
         try:
-            self._webenv, self._querykey, self._results = self._get_epost_results()
-        except:
+            self._webenv, self._querykey, content = self._get_epost_results()
+
+            self._results = decode_text(content)
+        except Exception:
             pass
 
         return self._results
 
+    # EPost results are parsed as ESearch ones (WebEnv, QueryKey)
+
+    _term = ""
+
+    _content    = b""
+    _tree       = None
+
+    parse = ESearch.parse
+    _find = ESearch._find
+    _root = ESearch._root
+
     def webenv(self):
         return self._webenv
 
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 Giulio Piemontese <gpiemont [at] protonmail.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from . efetch import EFetch
+
+from . epipe import state
+from . import logging
+from . eparse import parse_fasta
+from . etrace import span
+from . edeadline import bound
+from . escheduler import scheduled
+
+#
+# IUPAC nucleotide complements, used to slice minus strand regions out of plus strand spans
+#
+
+_complement = str.maketrans("ACGTURYKMBVDHNSWacgturykmbvdhnsw", "TGCAAYRMKVBHDNSWtgcaayrmkvbhdnsw")
+
+def reverse_complement(sequence):
+    return sequence.translate(_complement)[::-1]
+
+class ERegionFetch(object):
+
+    """
+    ERegionFetch Class object:
+
+    Fetch many subsequences, given as (accession, seq_start, seq_stop, strand) regions
+    (1-based, inclusive coordinates and strand 1/2, as EFetch's seq_start/seq_stop/strand).
+
+    Regions of the same accession which overlap, are adjacent or lie within ``gap`` bases of
+    each other are merged into a single plus strand span: each span is fetched by one EFetch
+    request, concurrently under the transport rate limiter, and regions are sliced back out
+    of it locally (reverse complemented on strand 2).
+
+        regions = [ ("NM_000546.6", 100, 200, 1), ("NM_000546.6", 150, 300, 2), ... ]
+        fetch   = ERegionFetch(regions, db="nuccore", gap=1000)
+
+        fetch.plan()            << [ (accession, span start, span stop, [ region indexes ]), ... ]
+        fetch.results()         << Sequences, in ``regions`` order
+
+    """
+
+    def __init__(self, regions, db="nuccore", gap=0, max_workers=4):
+
+        """
+        regions         : List of (accession, seq_start, seq_stop) or (accession, seq_start, seq_stop, strand)
+        db              : Entrez sequence db
+        gap             : Merge regions of the same accession up to ``gap`` bases apart (fewer requests,
+                          at the cost of downloading the bases in between)
+        max_workers     : Spans fetched concurrently
+
+        """
+
+        self._regions   = []
+        self._db        = db
+        self._gap       = gap
+        self._workers   = max_workers
+
+        for region in regions:
+            accession, start, stop, strand = (tuple(region) + (1,))[:4]
+
+            start, stop, strand = int(start), int(stop), int(strand or 1)
+
+            if start < 1 or stop < start:
+                raise Exception(f"Invalid region {accession}:{start}-{stop}")
+
+            if strand not in (1, 2):
+                raise Exception(f"Invalid strand {strand} for region {accession}:{start}-{stop} (1: plus, 2: minus)")
+
+            self._regions.append((str(accession), start, stop, strand))
+
+    def plan(self):
+
+        """
+        Return the spans to be fetched, as (accession, start, stop, [ indexes of the regions within ])
+        """
+
+        spans       = []
+        accessions  = {}
+
+        for i, (accession, start, stop, _) in enumerate(self._regions):
+            accessions.setdefault(accession, []).append(i)
+
+        for accession, indexes in accessions.items():
+            indexes.sort(key=lambda i: self._regions[i][1])
+
+            current = None
+
+            for i in indexes:
+                _, start, stop, _ = self._regions[i]
+
+                if current and start <= current[2] + 1 + self._gap:
+                    current[2] = max(current[2], stop)
+                    current[3].append(i)
+                else:
+                    current = [ accession, start, stop, [ i ] ]
+                    spans.append(current)
+
+        return [ tuple(current) for current in spans ]
+
+    def _fetch(self, span):
+
+        """
+        Return the plus strand sequence of ``span``
+        """
+
+        accession, start, stop, _ = span
+
+        fetch = EFetch(self._db, ids=[ accession ], rettype="fasta", retmode="text",
+                       strand=1, seq_start=start, seq_stop=stop)
+
+        fetch.get()
+
+        data = fetch._content
+
+        if fetch._status != state.EFETCH or not data:
+            raise Exception(f"[OBJECTS:REGION] Unable to fetch {accession}:{start}-{stop}")
+
+        records = parse_fasta(data)
+
+        if len(records) != 1:
+            raise Exception(f"[OBJECTS:REGION] Expected one record for {accession}:{start}-{stop}, got {len(records)}")
+
+        return records[0][1]
+
+    def results(self):
+
+        """
+        Return the sequence of every region, in ``regions`` order
+        """
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        spans   = self.plan()
+        results = [ None ] * len(self._regions)
+
+        logging.info("[OBJECTS:REGION] Fetching %d regions as %d spans", len(self._regions), len(spans))
+
+        with span("efetch_regions", db=self._db, regions=len(self._regions), spans=len(spans)), scheduled("bulk"):
+
+            with ThreadPoolExecutor(max_workers=max(1, min(self._workers, len(spans)))) as pool:
+                sequences = pool.map(bound(self._fetch), spans)
+
+                for (accession, first, last, indexes), sequence in zip(spans, sequences):
+                    if len(sequence) < last - first + 1:
+                        logging.warning("[OBJECTS:REGION] %s:%d-%d is %d bases long only",
+                                        accession, first, last, len(sequence))
+
+                    for i in indexes:
+                        _, start, stop, strand = self._regions[i]
+
+                        region = sequence[start - first:stop - first + 1]
+
+                        results[i] = reverse_complement(region) if strand == 2 else region
+
+        return results
+
+def efetch_regions(regions, db="nuccore", gap=0, max_workers=4):
+
+    """
+    Return the sequences of (accession, seq_start, seq_stop[, strand]) ``regions``, in order
+    """
+
+    return ERegionFetch(regions, db=db, gap=gap, max_workers=max_workers).results()
+
+all = [ ERegionFetch, efetch_regions, reverse_complement ]
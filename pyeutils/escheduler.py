@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 Giulio Piemontese <gpiemont [at] protonmail.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from . import logging
+from . edeadline import current_token
+from . emetrics import EMETRICS_BUCKETS
+
+import contextlib
+import contextvars
+import itertools
+import threading
+import time
+
+#
+# Priority classes, from the most to the least latency-sensitive
+#
+
+ESCHEDULER_CLASSES = ("interactive", "pipeline", "bulk")
+
+class EScheduler(object):
+
+    """
+    EScheduler Class object:
+
+    Priority-aware admission of requests to the rate limiter, shared by every thread of
+    the transport. Requests queue by priority class and by job, and are let through the
+    rate limiter one at a time:
+
+    · the most latency-sensitive class goes first: ``interactive`` lookups, then
+      ``pipeline`` stages, then ``bulk`` windows (harvests, syncs, region fetches)
+    · within a class, jobs take turns (round robin), so that a job running many threads
+      does not take a larger share of the rate than the others
+    · a request waiting for more than ``aging`` seconds is promoted one class up for every
+      ``aging`` seconds waited, so that bulk jobs are slowed down, never starved
+
+    The class and job of requests are set by scheduled(); requests outside of it are
+    ``pipeline`` ones for EFetch and ``interactive`` ones for any other endpoint, each
+    thread being a job of its own.
+
+        transport = ETransport(limiter=ERateLimiter(10), scheduler=EScheduler())
+
+        with scheduled("interactive", job="user-42"):
+            ESearch("asthma").results()
+
+    """
+
+    def __init__(self, aging=10.0, classes=ESCHEDULER_CLASSES):
+
+        """
+        aging           : Seconds after which a waiting request is promoted one class up
+                          (0: strict priorities)
+        classes         : Priority classes, from the highest to the lowest
+
+        """
+
+        self._aging     = aging
+        self._classes   = tuple(classes)
+        self._queues    = { name : {} for name in self._classes }
+        self._busy      = False
+        self._cond      = threading.Condition()
+        self._sequence  = itertools.count()
+
+        self.reset()
+
+    def reset(self):
+
+        """
+        Reset the wait-time statistics
+        """
+
+        with self._cond:
+            self._stats = { name : { "granted" : 0, "cancelled" : 0, "wait" : 0.0, "max" : 0.0,
+                                     "histogram" : [ 0 ] * (len(EMETRICS_BUCKETS) + 1) }
+                            for name in self._classes }
+
+    def classify(self, endpoint):
+
+        """
+        Return the class and job of a request to ``endpoint``, from the current scheduled()
+        block if any
+        """
+
+        current = _scheduling.get()
+
+        if current is not None:
+            return current
+
+        return ("pipeline" if endpoint == "efetch" else "interactive"), threading.get_ident()
+
+    def _next(self):
+
+        """
+        Return the (class, job) whose request is let through next, or None if none is waiting
+        """
+
+        now  = time.monotonic()
+        best = None
+
+        for rank, name in enumerate(self._classes):
+            jobs = self._queues[name]
+
+            if not jobs:
+                continue
+
+            #
+            # Jobs are kept in round robin order: the first one is the next to go
+            #
+
+            job    = next(iter(jobs))
+            ticket = jobs[job][0]
+            level  = rank - int((now - ticket[1]) / self._aging) if self._aging else rank
+
+            if best is None or (level, ticket[0]) < best[0]:
+                best = ((level, ticket[0]), name, job)
+
+        return None if best is None else best[1:]
+
+    def acquire(self, limiter, endpoint=None):
+
+        """
+        Wait for the turn of a request to ``endpoint``, then for ``limiter``. Return the time
+        spent waiting, in seconds. The wait is interrupted by the cancellation of the running
+        pipeline (see ECancelToken).
+        """
+
+        name, job = self.classify(endpoint)
+
+        if name not in self._queues:
+            raise Exception(f"Unknown priority class '{name}' (any in {', '.join(self._classes)})")
+
+        token  = current_token()
+        start  = time.monotonic()
+        ticket = (next(self._sequence), start)
+
+        with self._cond:
+            queue = self._queues[name].setdefault(job, [])
+            queue.append(ticket)
+
+            try:
+                while self._busy or self._next() != (name, job) or queue[0] is not ticket:
+                    #
+                    # Wake up periodically to honour aging and cancellation
+                    #
+
+                    self._cond.wait(0.1 if token is not None else (self._aging or None))
+
+                    if token is not None:
+                        token.check()
+
+            except BaseException:
+                queue.remove(ticket)
+
+                if not queue:
+                    del self._queues[name][job]
+
+                self._stats[name]["cancelled"] += 1
+                self._cond.notify_all()
+
+                raise
+
+            queue.pop(0)
+
+            #
+            # Round robin: the job goes after the other jobs of its class
+            #
+
+            del self._queues[name][job]
+
+            if queue:
+                self._queues[name][job] = queue
+
+            self._busy = True
+
+        try:
+            limiter.acquire()
+        finally:
+            waited = time.monotonic() - start
+
+            with self._cond:
+                self._busy = False
+                self._record(name, waited)
+                self._cond.notify_all()
+
+        if waited > 1.0:
+            logging.debug("[SCHEDULER] %s request to %s waited %.2fs", name, endpoint, waited)
+
+        return waited
+
+    def _record(self, name, waited):
+
+        stats = self._stats[name]
+
+        stats["granted"] += 1
+        stats["wait"]    += waited
+        stats["max"]      = max(stats["max"], waited)
+
+        for i, bound in enumerate(EMETRICS_BUCKETS):
+            if waited <= bound:
+                stats["histogram"][i] += 1
+                break
+        else:
+            stats["histogram"][-1] += 1
+
+    def depth(self):
+
+        """
+        Return the number of requests waiting, per class, as { class : depth }
+        """
+
+        with self._cond:
+            return { name : sum(len(queue) for queue in jobs.values()) for name, jobs in self._queues.items() }
+
+    def stats(self):
+
+        """
+        Return, per class, the current queue depth and jobs waiting, and the number of
+        requests let through (granted) or cancelled while waiting, with their mean and
+        maximum wait (queue and rate limiter), in seconds
+        """
+
+        with self._cond:
+            return { name : { "depth"     : sum(len(queue) for queue in self._queues[name].values()),
+                              "jobs"      : len(self._queues[name]),
+                              "granted"   : stats["granted"],
+                              "cancelled" : stats["cancelled"],
+                              "wait_mean" : stats["wait"] / stats["granted"] if stats["granted"] else 0.0,
+                              "wait_max"  : stats["max"] }
+                     for name, stats in self._stats.items() }
+
+    def prometheus(self, prefix="pyeutils"):
+
+        """
+        Return queue depths and wait times in Prometheus text exposition format
+        """
+
+        p = prefix
+
+        with self._cond:
+            depth = { name : sum(len(queue) for queue in jobs.values()) for name, jobs in self._queues.items() }
+            stats = { name : dict(entry, histogram=list(entry["histogram"])) for name, entry in self._stats.items() }
+
+        lines = []
+
+        lines.append(f"# HELP {p}_scheduler_queue_depth Requests waiting for the rate limiter.")
+        lines.append(f"# TYPE {p}_scheduler_queue_depth gauge")
+
+        for name in self._classes:
+            lines.append(f'{p}_scheduler_queue_depth{{class="{name}"}} {depth[name]}')
+
+        lines.append(f"# HELP {p}_scheduler_cancelled_total Requests cancelled while waiting.")
+        lines.append(f"# TYPE {p}_scheduler_cancelled_total counter")
+
+        for name in self._classes:
+            lines.append(f'{p}_scheduler_cancelled_total{{class="{name}"}} {stats[name]["cancelled"]}')
+
+        lines.append(f"# HELP {p}_scheduler_wait_seconds Time requests waited for their turn and the rate limiter.")
+        lines.append(f"# TYPE {p}_scheduler_wait_seconds histogram")
+
+        for name in self._classes:
+            cumulative = 0
+
+            for bound, n in zip(EMETRICS_BUCKETS, stats[name]["histogram"]):
+                cumulative += n
+                lines.append(f'{p}_scheduler_wait_seconds_bucket{{class="{name}",le="{bound}"}} {cumulative}')
+
+            lines.append(f'{p}_scheduler_wait_seconds_bucket{{class="{name}",le="+Inf"}} {stats[name]["granted"]}')
+            lines.append(f'{p}_scheduler_wait_seconds_sum{{class="{name}"}} {stats[name]["wait"]}')
+            lines.append(f'{p}_scheduler_wait_seconds_count{{class="{name}"}} {stats[name]["granted"]}')
+
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+
+        """
+        Return queue depths and wait times as a table (milliseconds)
+        """
+
+        lines = [ f"{'class':<16}{'depth':>7}{'jobs':>7}{'granted':>9}{'cancelled':>11}{'wait':>10}{'max':>10}" ]
+
+        for name, entry in self.stats().items():
+            lines.append(f"{name:<16}{entry['depth']:>7}{entry['jobs']:>7}{entry['granted']:>9}{entry['cancelled']:>11}"
+                         f"{entry['wait_mean'] * 1000:>10.2f}{entry['wait_max'] * 1000:>10.2f}")
+
+        return "\n".join(lines)
+
+#
+# Class and job of the running pipeline, inherited by its worker threads (see edeadline.bound())
+#
+
+_scheduling = contextvars.ContextVar("pyeutils_scheduling", default=None)
+
+@contextlib.contextmanager
+def scheduled(name, job=None):
+
+    """
+    Run the requests of the block in priority class ``name``, as part of ``job`` (default:
+    the job of the enclosing block, or a job of its own). Blocks nest, the innermost one
+    applying.
+    """
+
+    if job is None:
+        current = _scheduling.get()
+        job     = current[1] if current is not None else object()
+
+    reset = _scheduling.set((name, job))
+
+    try:
+        yield
+    finally:
+        _scheduling.reset(reset)
+
+def current_scheduling():
+
+    """
+    Return the (class, job) set by the innermost scheduled() block, or None
+    """
+
+    return _scheduling.get()
+
+all = [ EScheduler, ESCHEDULER_CLASSES, scheduled, current_scheduling ]
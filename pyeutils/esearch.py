@@ -21,7 +21,46 @@
 from . evars import EUTILS_APPNAME
 from . epipe import state
 from . import logging
-import requests
+from . elog import truncated
+from . etransport import get_transport
+from . epayload import EPayload, unquote_term
+from . etrace import traced
+from . emetrics import timed_stage, timed_parse
+from . einfo import get_einfo_cache
+from . eparse import decode_text
+
+def date_range(mindate='', maxdate='', deprecated=None, name="mindatemax"):
+
+    """
+    Return the ``mindate``/``maxdate`` parameters of a date range, as a dict (empty if no
+    range is given). The E-utilities require both bounds: raise an Exception if only one is.
+
+    ``deprecated`` is the value of the former single-parameter form (``name``), a
+    (mindate, maxdate) pair or a 'mindate:maxdate' string.
+    """
+
+    if deprecated:
+        import warnings
+
+        warnings.warn(f"'{name}' is deprecated, use 'mindate' and 'maxdate'", DeprecationWarning, stacklevel=3)
+
+        if mindate or maxdate:
+            raise Exception(f"'{name}' cannot be combined with 'mindate' and 'maxdate'")
+
+        bounds = deprecated.split(":") if isinstance(deprecated, str) else list(deprecated)
+
+        if len(bounds) != 2:
+            raise Exception(f"'{name}' must be a (mindate, maxdate) pair or a 'mindate:maxdate' string")
+
+        mindate, maxdate = bounds
+
+    if not mindate and not maxdate:
+        return {}
+
+    if not mindate or not maxdate:
+        raise Exception(f"Date ranges require both mindate and maxdate (got mindate='{mindate}', maxdate='{maxdate}')")
+
+    return { "mindate" : mindate, "maxdate" : maxdate }
 
 class ESearch(object):
 
@@ -46,6 +85,11 @@ class ESearch(object):
 
     _ep0  = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi';
 
+    # Raw (bytes) content of the last response, and its parsed XML tree
+
+    _content    = b""
+    _tree       = None
+
     # Search Query
 
     _term = ""
@@ -57,14 +101,14 @@ class ESearch(object):
     def __init__(self, term, db="pubmed", usehistory=True, 
             webenv=None, querykey=None,
             retstart=0, retmax=20, rettype='uilist', retmode='xml', sort='',
-            field='', idtype='', datetype='', reldate='', mindatemax=''):
+            field='', idtype='', datetype='', reldate='', mindate='', maxdate='', mindatemax='', validate=False):
 
         """
         Initialize a ESearch object to a given search ``term``
 
         Required parameters:
 
-        term            : URL-encoded text query
+        term            : Text query, plain or URL-encoded (see epayload.unquote_term())
         db              : Perform the search in this Entrez db (default: 'pubmed')
 
 
@@ -79,10 +123,37 @@ class ESearch(object):
         querykey        : Intersects query string in ``term`` with a query from a previous ESearch,
                           EPost, ELink call, stored in a History Server as query_key.
 
+
+        Optional Parameters - Retrieval and Dates
+
+        retstart        : Index of the first UID returned (default: 0)
+        retmax          : Number of UIDs returned (default: 20, at most 10,000)
+
+        datetype        : Date used to limit the search ('mdat', 'pdat', 'edat')
+        reldate         : Return only records whose ``datetype`` is within the last ``reldate`` days
+        mindate         : Date range (YYYY/MM/DD, YYYY/MM or YYYY) on ``datetype``; both bounds
+        maxdate           are required
+        mindatemax      : Deprecated: the date range as a (mindate, maxdate) pair or a 'mindate:maxdate' string
+
         See https://www.ncbi.nlm.nih.gov/books/NBK25499/#_chapter4_ESearch_ for a complete documetation.
 
+
+        Implementation Parameters:
+
+        validate        : Check ``db`` and ``field`` against the process-wide EInfo cache
+                          before any request is made, raising an Exception if invalid.
+
         """
 
+        if validate:
+            cache = get_einfo_cache()
+
+            if not cache.has_database(db):
+                raise Exception(f"'{db}' is not a valid Entrez database")
+
+            if field and not cache.has_field(db, field):
+                raise Exception(f"'{field}' is not a valid search field for Entrez database '{db}'")
+
         self._term    = term
 
         self._db      = db
@@ -96,11 +167,13 @@ class ESearch(object):
 
         self._esearch_payload = {
             "tool" : EUTILS_APPNAME,
-            "term" : term,
+            "term" : unquote_term(term),
             "db"   : db,
             "usehistory" : "y" if usehistory else "n",
             "retmode"   : retmode,
             "rettype"   : rettype,
+            "retstart"  : retstart,
+            "retmax"    : retmax,
         }
 
         if webenv:
@@ -124,10 +197,9 @@ class ESearch(object):
         if reldate:
             self._esearch_payload["reldate"] = reldate
 
-        if mindatemax:
-            self._esearch_payload["mindatemax"] = mindatemax
+        self._esearch_payload.update(date_range(mindate, maxdate, mindatemax, "mindatemax"))
 
-        self._params    = "&".join([f"{k}={v}" for k, v in self._esearch_payload.items()])
+        self._params    = EPayload(self._esearch_payload)
         self._objs      = {}
 
         self._webenv    = ""
@@ -136,8 +208,13 @@ class ESearch(object):
 
         self._status    = state.ESEARCH
 
-        logging.info(f"[OBJECTS:{self._status.name}]   ESearch query : '{term}'")
+        logging.info("[OBJECTS:%s]   ESearch query : '%s'", self._status.name, truncated(term))
 
+    @traced("ESearch",
+        before=lambda self: { "db" : self._esearch_payload.get("db"), "retstart" : self._retstart, "retmax" : self._retmax },
+        after=lambda self: { "query_key" : self._querykey, "count" : self._objs.get("Count"),
+                             "records" : len(self._objs.get("Id") or []) })
+    @timed_stage("ESEARCH")
     def _get_results(self, *args, **kwargs):
 
         """
@@ -147,7 +224,7 @@ class ESearch(object):
         """
 
         try:
-            response = requests.get(self._ep0, self._params)
+            response = get_transport().get(self._ep0, self._params)
 
             if response.status_code != 200:
                 logging.error(f"ESearch did not complete successfully (HTTP {response.status_code})")
@@ -155,7 +232,7 @@ class ESearch(object):
 
             self._status    = state.ESEARCH
 
-            self._results   = response.text
+            self._content   = response.content
 
             self._webenv    = self.parse("WebEnv")
             self._querykey  = self.parse("QueryKey", objtype=int)
@@ -168,10 +245,70 @@ class ESearch(object):
             import traceback as tb
             logging.error(f"{tb.format_exc()}")
             logging.error(f"{str(e)}")
-            self._results = f"{str(e)}"
+            self._content = str(e).encode()
+
+        return self._webenv, self._querykey, self._content
+
+    def _root(self):
+
+        """
+        Return the root element of the last response, parsed (once) straight from its bytes
+        by expat, or None if it is not XML
+        """
+
+        import xml.etree.ElementTree as ET
+
+        content = self._content
+
+        if self._tree is None or self._tree[0] is not content:
+            try:
+                root = ET.fromstring(content)
+            except ET.ParseError:
+                root = None
+
+            self._tree = (content, root)
+
+        return self._tree[1]
+
+    def _find(self, name, first=True):
+
+        """
+        Return the text of the elements named ``name`` (case-insensitive) in the last response,
+        in document order (only the first one if ``first``)
+        """
+
+        root = self._root()
+        name = name.lower()
+
+        if root is None:
+            #
+            # Not XML (e.g. an HTML error page): fall back to a soup parser
+            #
+
+            from bs4 import BeautifulSoup as BS4
+            from bs4 import FeatureNotFound
+
+            try:
+                soup = BS4(self._content, "lxml")
+            except FeatureNotFound as e:
+                soup = BS4(self._content, "html.parser")
 
-        return self._webenv, self._querykey, self._results
+            objs = [ soup.find(name) ] if first else soup.find_all(name)
 
+            return [ obj.text for obj in objs if obj is not None ]
+
+        texts = []
+
+        for element in root.iter():
+            if isinstance(element.tag, str) and element.tag.lower() == name:
+                texts.append("".join(element.itertext()))
+
+                if first:
+                    break
+
+        return texts
+
+    @timed_parse
     def parse(self, name, objtype=str, first=True):
 
         """
@@ -189,61 +326,68 @@ class ESearch(object):
         """
 
         try:
-            from bs4 import BeautifulSoup as BS4
-            from bs4 import FeatureNotFound
-
-            soup = None
+            texts = self._find(name, first)
 
-            try:
-                soup = BS4(self._results, "lxml")
-            except FeatureNotFound as e:
-                soup = BS4(self._results, "html.parser")
-
-            if not soup:
-                raise Exception("No suitable parser found on system (xml nor html.parser)")
-
-            objs = soup.findAll(name.lower()) if not first else soup.find(name.lower())
-
-            if not objs:
+            if not texts:
                 #if self._status == state.ESEARCH:
                 #    logging.info(f"No {name} found for search object {self} (search term : '{self._term}')")
-                logging.info(f"No {name} found for search object {self!r}")
+                logging.info("No %s found for search object %r", name, self)
 
                 return ""
 
             if objtype == list:
-                self._objs[name] = [ obj.text for obj in objs ]
-            elif objtype == int:
-                try:
-                    self._objs[name] = int(objs.text)
-                except:
-                    # Store it anyway as default type
-                    self._objs[name] = objs
-            elif objtype == float:
+                self._objs[name] = texts
+            elif objtype in (int, float):
                 try:
-                    self._objs[name] = float(objs.text)
+                    self._objs[name] = objtype(texts[0])
                 except:
                     # Store it anyway as default type
-                    self._objs[name] = objs                
+                    self._objs[name] = texts[0]
             else:
-                self._objs[name] = str(objs.text)
+                self._objs[name] = texts[0]
 
-            logging.info(f"[OBJECTS:{self._status.name}] " + f"{name:>15}" +  f" : {self._objs[name]}")
+            logging.info("[OBJECTS:%s] %15s : %s", self._status.name, name, truncated(self._objs[name]))
 
         except Exception as e:
-            logging.debug(f"Error in looking up {name} for search object {self} (search term : '{self._term}') : {str(e)}")
+            logging.debug("Error in looking up %s for search object %s (search term : '%s') : %s", name, self, truncated(self._term), e)
 
         return self._objs.get(name)
 
     def results(self):
 
+        """
+        Return the results of the ESearch query, decoded to str
+        """
+
         try:
-            _, _, self._results = self._get_results()
-        except:
+            _, _, content = self._get_results()
+
+            self._results = decode_text(content)
+        except Exception:
             pass
 
         return self._results
 
+    def window(self, retstart, retmax):
+
+        """
+        Return a new, not yet performed ESearch for another window of results of the same
+        query, sharing the encoded payload of this one (only retstart/retmax are re-encoded)
+        """
+
+        import copy
+
+        search = copy.copy(self)
+
+        search._esearch_payload = dict(self._esearch_payload, retstart=retstart, retmax=retmax)
+        search._params          = self._params.replace(retstart=retstart, retmax=retmax)
+
+        search._retstart, search._retmax = retstart, retmax
+        search._objs, search._results    = {}, ""
+        search._content, search._tree    = b"", None
+
+        return search
+
     def webenv(self):
         return self._webenv
 
@@ -272,5 +416,5 @@ def esearch_pubmed(query):
     return esearch(query)
 
 
-all = [ ESearch, esearch, esearch_pubmed ]
+all = [ ESearch, esearch, esearch_pubmed, date_range ]
 
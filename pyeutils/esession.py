@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 Giulio Piemontese <gpiemont [at] protonmail.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from . esearch import ESearch
+from . elink import ELink
+from . epost import EPost
+from . efetch import EFetch
+from . esummary import ESummary
+
+from . epipe import state
+from . import logging
+from . elog import truncated
+
+import threading
+import time
+
+#
+# Seconds of inactivity after which a Web Environment is considered expired and is
+# refreshed before use. The History server drops environments after some hours of
+# inactivity: stay well below that.
+#
+
+ESESSION_TTL = 3600
+
+class EHistoryEntry(object):
+
+    """
+    EHistoryEntry Class object:
+
+    A set of UIDs stored on the History server under ``querykey``, with its provenance.
+
+        stage           : Stage which created the set ('ESEARCH', 'EPOST', 'ELINK')
+        params          : Parameters of that stage (e.g. term and db)
+        source          : Entry the set derives from (ELink input), if any
+        db              : Entrez db of the UIDs in the set
+        querykey        : Current query_key of the set (changes when the session is refreshed)
+        used            : Last use time (time.monotonic())
+
+    """
+
+    def __init__(self, stage, params, db, source=None):
+
+        self.stage      = stage
+        self.params     = params
+        self.source     = source
+        self.db         = db
+
+        self.querykey   = ""
+        self.used       = 0.0
+
+    def __repr__(self):
+        return f"<EHistoryEntry {self.stage} query_key={self.querykey} db={self.db} params={truncated(self.params)}>"
+
+class ESession(object):
+
+    """
+    ESession Class object:
+
+    Share a single Web Environment among every stage of a pipeline. Searches, posts and
+    links all append their results to the session WebEnv, identical stages are run only
+    once, and an environment idle for longer than ``ttl`` seconds (or found expired by
+    EFetch/ESummary) is rebuilt by replaying the stages which created it.
+
+        session = ESession()
+
+        search  = session.search("asthma[mesh]")
+        linked  = session.link(search, "protein")
+
+        fasta   = session.fetch(linked, rettype="fasta")
+
+    """
+
+    def __init__(self, ttl=ESESSION_TTL):
+
+        self._ttl       = ttl
+
+        self._webenv    = ""
+        self._used      = 0.0
+
+        self._entries   = {}
+        self._lock      = threading.RLock()
+
+    def webenv(self):
+        return self._webenv
+
+    def entries(self):
+
+        """
+        Return the History server sets created in this session, in creation order
+        """
+
+        with self._lock:
+            return list(self._entries.values())
+
+    def expired(self):
+        return not self._webenv or time.monotonic() - self._used > self._ttl
+
+    def _touch(self, entry):
+
+        entry.used = self._used = time.monotonic()
+
+    def _run(self, entry):
+
+        """
+        Run the stage which creates ``entry`` within the session WebEnv
+        """
+
+        params  = entry.params
+        webenv  = self._webenv or None
+
+        if entry.stage == "ESEARCH":
+            stage = ESearch(params["term"], db=entry.db, usehistory=True, webenv=webenv, **params["search"])
+            result = stage._get_results()
+
+        elif entry.stage == "EPOST":
+            stage = EPost(entry.db, ids=list(params["ids"]), webenv=webenv)
+            result = stage._get_epost_results()
+
+        else:
+            stage = ELink(entry.db, dbfrom=entry.source.db, cmd="neighbor_history", linkname=params["linkname"],
+                        webenv=webenv, querykey=entry.source.querykey)
+            result = stage._get_elinks()
+
+        #
+        # Failed requests return an empty string instead of the History server coordinates
+        #
+
+        result_webenv, querykey = result[:2] if result else ("", "")
+
+        if not result_webenv or not querykey:
+            raise Exception(f"[OBJECTS:SESSION] {entry.stage} did not return a History server set ({entry!r})")
+
+        if self._webenv and result_webenv != self._webenv:
+            logging.warning("[OBJECTS:SESSION] %s started a new WebEnv (%s → %s)", entry.stage, self._webenv, result_webenv)
+
+        self._webenv    = result_webenv
+        entry.querykey  = querykey
+
+        self._touch(entry)
+
+        logging.info("[OBJECTS:SESSION] %s stored as query_key %s", entry.stage, querykey)
+
+    def _entry(self, stage, params, db, source=None):
+
+        """
+        Return the entry created by ``stage``, running it only if not already in the session
+        """
+
+        key = (stage, db, repr(params), id(source))
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None:
+                logging.debug("[OBJECTS:SESSION] Reusing query_key %s for %s", entry.querykey, stage)
+                self._fresh()
+                return entry
+
+            if source is not None:
+                self._fresh()
+
+            entry = EHistoryEntry(stage, params, db, source=source)
+
+            self._run(entry)
+
+            self._entries[key] = entry
+
+        return entry
+
+    def _fresh(self):
+
+        if self._webenv and self.expired():
+            logging.info("[OBJECTS:SESSION] WebEnv %s idle for more than %ds, refreshing", self._webenv, self._ttl)
+            self.refresh()
+
+    def refresh(self):
+
+        """
+        Rebuild the session on a new WebEnv, replaying every stage in creation order
+        """
+
+        with self._lock:
+            self._webenv = ""
+
+            for entry in self._entries.values():
+                self._run(entry)
+
+    def search(self, term, db="pubmed", **search):
+
+        """
+        Store the results of an ESearch in the session (ESearch parameters as in ESearch)
+        """
+
+        return self._entry("ESEARCH", { "term" : term, "search" : search }, db)
+
+    def post(self, ids, db="pubmed"):
+
+        """
+        Store a list of UIDs in the session; posting the same UIDs twice only posts them once
+        """
+
+        return self._entry("EPOST", { "ids" : tuple(sorted(str(i) for i in ids)) }, db)
+
+    def link(self, source, db, linkname=None):
+
+        """
+        Store the UIDs of ``db`` linked to the ``source`` entry in the session
+        """
+
+        return self._entry("ELINK", { "linkname" : linkname or f"{source.db}_{db}" }, db, source=source)
+
+    def _retrieve(self, entry, request):
+
+        """
+        Run ``request()`` on ``entry``, refreshing the session once if the WebEnv has expired
+        """
+
+        with self._lock:
+            self._fresh()
+
+        for attempt in (1, 2):
+            stage, ok = request()
+
+            data = stage.results()
+
+            if ok(stage) and data and "<ERROR>" not in data[:1024]:
+                self._touch(entry)
+                return data
+
+            if attempt == 1:
+                logging.info("[OBJECTS:SESSION] %r could not be retrieved, refreshing WebEnv %s", entry, self._webenv)
+
+                with self._lock:
+                    self.refresh()
+
+        raise Exception(f"[OBJECTS:SESSION] Unable to retrieve {entry!r}")
+
+    def fetch(self, entry, **kwargs):
+
+        """
+        EFetch the records of ``entry`` (EFetch parameters as in EFetch)
+        """
+
+        return self._retrieve(entry, lambda: (EFetch(entry.db, querykey=entry.querykey, webenv=self._webenv, **kwargs),
+                                              lambda stage: stage._status == state.EFETCH))
+
+    def summary(self, entry, **kwargs):
+
+        """
+        ESummary the records of ``entry`` (ESummary parameters as in ESummary)
+        """
+
+        return self._retrieve(entry, lambda: (ESummary(entry.db, querykey=entry.querykey, webenv=self._webenv, **kwargs),
+                                              lambda stage: stage._status == state.ESUMMARY))
+
+all = [ ESession, EHistoryEntry, ESESSION_TTL ]
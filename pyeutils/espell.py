@@ -19,13 +19,21 @@
 #
 
 from . import logging
+from . elog import truncated
+from . etransport import get_transport
+from . epayload import EPayload, unquote_term
+from . eparse import decode_text
+from . edeadline import bound
 
-import requests
+import threading
 
 class ESpell(object):
 
     """
     · Provides spelling suggestions for terms within a single text query in a given database.
+
+    Many terms can be checked at once via espell_batch(), served from the process-wide
+    ESpellCache where possible.
     """
 
     # Search Endpoint
@@ -37,33 +45,28 @@ class ESpell(object):
         self._term      = term
         
         self._espell_payload = {
-            "term"        : term,
+            "term"        : unquote_term(term),
             "db"          : db
         }
 
         self._db        = db
 
-        self._params    = "&".join([f"{k}={v}" for k, v in self._espell_payload.items()])
+        self._params    = EPayload(self._espell_payload)
 
         self._results   = ""
 
-        logging.info(f"[OBJECTS:ESPELL]   Checking for spelling suggestion of '{term}' in '{db}' ..")
+        logging.info("[OBJECTS:ESPELL]   Checking for spelling suggestion of '%s' in '%s' ..", truncated(term), db)
 
     def _get_results(self, *args, **kwargs):
 
-        response = requests.Response()
-
         try:
-            if len(self._term) > 100:
-                response = requests.post(self._ep7, self._params)
-            else: 
-                response = requests.get(self._ep7, self._params)
+            response = get_transport().get(self._ep7, self._params)
 
             if response.status_code != 200:
-                logging.error(f"EGQuery did not complete successfully (HTTP {response.status_code})")
+                logging.error(f"ESpell did not complete successfully (HTTP {response.status_code})")
                 return ""
 
-            self._results   = response.text                            
+            self._results   = decode_text(response.content)                            
 
         except Exception as e:
             logging.error(f"{str(e)}")
@@ -73,9 +76,176 @@ class ESpell(object):
 
 
     def results(self):
-                   
-        return self._get_results()
+
+        if not self._results:
+            self._results = self._get_results()
+
+        return self._results
+
+    def suggestion(self):
+
+        """
+        Return the spelling suggestion for the query (the query itself if there is none),
+        or None if the request failed.
+
+        """
+
+        import xml.etree.ElementTree as ET
+
+        try:
+            root = ET.fromstring(self.results())
+        except ET.ParseError as e:
+            return None
+
+        if root.find("CorrectedQuery") is None:
+            return None
+
+        return (root.findtext("CorrectedQuery") or "").strip() or self._term
+
+
+class ESpellCache(object):
+
+    """
+    ESpellCache Class object:
+
+    Process-wide LRU cache of spelling suggestions, keyed by (db, term), optionally backed by
+    an on-disk ``dbm`` database shared among runs.
+
+    """
+
+    def __init__(self, maxsize=10000, path=None):
+
+        """
+        maxsize         : Number of suggestions kept in memory (default: 10000)
+
+        path            : File name of the on-disk dbm database (default: memory only)
+
+        """
+
+        from collections import OrderedDict
+
+        self._maxsize   = maxsize
+        self._entries   = OrderedDict()
+        self._lock      = threading.Lock()
+        self._dbm       = None
+
+        if path:
+            import dbm
+            self._dbm = dbm.open(path, "c")
+
+    def get(self, db, term):
+
+        key = (db, term)
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+            if self._dbm is None:
+                return None
+
+            value = self._dbm.get(f"{db}\t{term}".encode())
+
+            if value is None:
+                return None
+
+            suggestion = value.decode()
+            self._put(key, suggestion)
+
+        return suggestion
+
+    def _put(self, key, suggestion):
+
+        self._entries[key] = suggestion
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+    def put(self, db, term, suggestion):
+
+        with self._lock:
+            self._put((db, term), suggestion)
+
+            if self._dbm is not None:
+                self._dbm[f"{db}\t{term}".encode()] = suggestion.encode()
+
+    def close(self):
+
+        with self._lock:
+            if self._dbm is not None:
+                self._dbm.close()
+                self._dbm = None
+
+##
+## Process-wide spelling suggestions cache
+##
+
+_espell_cache = ESpellCache()
+
+def get_espell_cache():
+
+    """
+    Return the spelling suggestions cache shared by the process
+    """
+
+    return _espell_cache
+
+def set_espell_cache(cache):
+
+    """
+    Replace the process-wide spelling suggestions cache, returning the previous one
+    """
+
+    global _espell_cache
+
+    previous, _espell_cache = _espell_cache, cache
+
+    return previous
+
+def espell_batch(terms, db="pubmed", max_workers=4):
+
+    """
+    Return spelling suggestions for many ``terms`` as { term : suggestion }.
+
+    Terms are deduplicated, repeats are served from the process-wide ESpellCache and
+    the rest are checked concurrently within the rate budget of the shared transport.
+    Terms whose check failed are mapped to None.
+
+    """
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    cache       = get_espell_cache()
+    suggestions = {}
+    missing     = []
+
+    for term in dict.fromkeys(terms):
+        suggestion = cache.get(db, term)
+
+        if suggestion is None:
+            missing.append(term)
+        else:
+            suggestions[term] = suggestion
+
+    def check(term):
+
+        suggestion = ESpell(term, db=db).suggestion()
+
+        if suggestion is not None:
+            cache.put(db, term, suggestion)
+
+        return suggestion
+
+    if missing:
+        logging.info("[OBJECTS:ESPELL]   Checking %d terms (%d cached) in '%s' ..", len(missing), len(suggestions), db)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(missing)))) as pool:
+            suggestions.update(zip(missing, pool.map(bound(check), missing)))
+
+    return suggestions
 
 
-all = [ ESpell ]
+all = [ ESpell, ESpellCache, get_espell_cache, set_espell_cache, espell_batch ]
 
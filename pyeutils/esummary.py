@@ -21,8 +21,16 @@
 from . elink import ELink
 from . esearch import ESearch
 
-from . import state, logging
-import requests
+from . epipe import state
+from . import logging
+from . elog import truncated
+from . etransport import get_transport
+from . epayload import EPayload
+from . etrace import traced, span
+from . emetrics import timed_stage
+from . eparse import decode_text
+from . edeadline import ECancelToken
+from . escheduler import scheduled
 
 class ESummary(ELink, ESearch):
 
@@ -45,11 +53,13 @@ class ESummary(ELink, ESearch):
         retstart=1, retmax=10000, retmode="xml", version="2.0"):
 
         self._webenv    = webenv
-        self._querykey = webenv
+        self._querykey  = querykey
 
         self._ids       = ids
         self._db        = db
 
+        self._status    = state.NONE
+
         if source:
 
             #
@@ -61,7 +71,8 @@ class ESummary(ELink, ESearch):
                 super(self.__class__, self).__init__(source._db, source._dbfrom,
                     source._cmd, source._linkname, source._ids, source._idtype, 
                     source._retmode, source._webenv, source._querykey,
-                    source._datetype, source._reldate, source._minmaxdate)
+                    datetype=source._datetype, reldate=source._reldate,
+                    mindate=source._mindate, maxdate=source._maxdate)
                 
                 ##
                 ## Initialize ESearch part of <self>, from source type (ESearch)
@@ -117,37 +128,44 @@ class ESummary(ELink, ESearch):
         self._version   = self._esummary_payload["version"]  = version        
 
         
-        logging.debug(self._esummary_payload)
+        logging.debug("ESUMMARY payload : %s", truncated(self._esummary_payload))
 
-        self._summary_params    = "&".join([f"{k}={v}" for k, v in self._esummary_payload.items()])
+        self._summary_params    = EPayload(self._esummary_payload)
         self._summary           = "" 
 
+    @traced("ESummary",
+        before=lambda self: { "db" : self._db, "query_key" : self._esummary_payload.get("query_key"),
+                              "retstart" : self._retstart, "retmax" : self._retmax },
+        after=lambda self: { "records" : self._content.count(b"<DocumentSummary ") + self._content.count(b"<DocSum>"),
+                             "bytes" : len(self._content) })
+    @timed_stage("ESUMMARY")
     def _get_summary(self, *args, **kwargs):
         
         """
-        Request a Summary from the Initialization Object
+        Request a Summary from the Initialization Object, returning the raw (bytes) response:
+        results() decodes it
 
         """
 
         response = None
 
         try:
-            logging.debug(f"Requesting Summary URL {self._ep2}?{self._summary_params}")
+            logging.debug("Requesting Summary URL %s?%s", self._ep2, truncated(self._summary_params.encoded()))
 
-            response = requests.get(self._ep2, self._summary_params)
+            response = get_transport().get(self._ep2, self._summary_params)
 
             if response.status_code != 200:
                 logging.error(f"ESummary request did not complete successfully (HTTP {response.status_code})")
                 return ""
    
-            self._summary   = response.text
+            self._content   = response.content
             self._status    = state.ESUMMARY
 
         except Exception as e:
             logging.error(f"{str(e)}")
-            self._summary = ""
+            self._content   = b""
 
-        return self._webenv, self._querykey, response.text
+        return self._webenv, self._querykey, self._content
 
     def results(self):
 
@@ -157,7 +175,9 @@ class ESummary(ELink, ESearch):
         """
 
         try:
-            self._webenv, self._querykey, self._summary = self._get_summary()
+            self._webenv, self._querykey, content = self._get_summary()
+
+            self._summary = decode_text(content)
 
         except Exception as e:
             logging.error(f"{str(e)}")
@@ -165,6 +185,40 @@ class ESummary(ELink, ESearch):
 
         return self._summary
 
+    def stream(self, chunk=1 << 16):
+
+        """
+        Request the Summary, yielding the response body in chunks of (decompressed) bytes as
+        they arrive. Raise an Exception if the request fails.
+
+        """
+
+        logging.debug("Streaming Summary URL %s?%s", self._ep2, truncated(self._summary_params.encoded()))
+
+        yield from get_transport().stream(self._ep2, self._summary_params, chunk=chunk)
+
+        self._status = state.ESUMMARY
+
+    def window(self, retstart, retmax):
+
+        """
+        Return a new, not yet performed ESummary for another window of the same DocSums
+        (``retstart`` is 1-based), sharing the encoded payload of this one
+        """
+
+        import copy
+
+        summary = copy.copy(self)
+
+        summary._esummary_payload = dict(self._esummary_payload, retstart=retstart, retmax=retmax)
+        summary._summary_params   = self._summary_params.replace(retstart=retstart, retmax=retmax)
+
+        summary._retstart, summary._retmax = retstart, retmax
+        summary._summary = ""
+        summary._content, summary._tree = b"", None
+
+        return summary
+
     def webenv(self):
         return self._webenv
 
@@ -175,7 +229,7 @@ class ESummary(ELink, ESearch):
 ## Convenience/Pipelined Functions
 ##
 
-def esearch_elink_esummary(query, dbfrom="pubmed", dbto="protein", cmd="neighbor_history"):
+def esearch_elink_esummary(query, dbfrom="pubmed", dbto="protein", cmd="neighbor_history", timeout=None):
 
     """
     Return a Summary of cross-db linked results, from a given query
@@ -190,31 +244,37 @@ def esearch_elink_esummary(query, dbfrom="pubmed", dbto="protein", cmd="neighbor
 
         cmd     : str     Perform this Link operation between DBs (default : neighbor_history)
 
+        timeout : float   Seconds the whole pipeline may last (default : no limit), raising
+                          EDeadlineExceeded once expired
+
     """
     
-    search = ESearch(query, db=dbfrom)
+    with span("esearch_elink_esummary", dbfrom=dbfrom, dbto=dbto, cmd=cmd), ECancelToken(timeout=timeout), \
+            scheduled("pipeline"):
+
+        search = ESearch(query, db=dbfrom)
 
-    if not search:
-        return { "error" : "ESEARCH" }
+        if not search:
+            return { "error" : "ESEARCH" }
  
-    linker = ELink(dbto, dbfrom=dbfrom, cmd=cmd, source=search)
+        linker = ELink(dbto, dbfrom=dbfrom, cmd=cmd, source=search)
 
-    if not linker:
-        return { "error" : "ELINK" }
+        if not linker:
+            return { "error" : "ELINK" }
 
-    results = linker.results()
+        results = linker.results()
 
-    logging.debug(f"ELINK results : {results}")
+        logging.debug("ELINK results : %s", truncated(results))
 
-    if not linker:
-        return { "error" : "ELINK" }
+        if not linker:
+            return { "error" : "ELINK" }
 
-    s = ESummary(db=dbfrom, source=linker)
+        s = ESummary(db=dbfrom, source=linker)
 
-    if not s:
-        return { "error" : "ESUMMARY" }
+        if not s:
+            return { "error" : "ESUMMARY" }
 
-    return s.results()
+        return s.results()
 
 all = [ ESummary, esearch_elink_esummary ]
 
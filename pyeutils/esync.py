@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 Giulio Piemontese <gpiemont [at] protonmail.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from . eharvest import EHarvest
+
+from . import logging
+from . elog import truncated
+from . etrace import span
+from . escheduler import scheduled
+
+import os
+import threading
+
+class ESync(object):
+
+    """
+    ESync Class object:
+
+    Incrementally mirror the records matching ``term`` into the ``store`` directory.
+
+    Every run searches only the records whose ``datetype`` date (default: 'mdat', last
+    modification) falls between the watermark left by the previous run and today, downloads
+    them into a new delta file, and records in the store index which delta file holds the
+    latest version of every UID. The first run downloads every matching record.
+
+        sync = ESync("asthma[mesh]", "mirror/", db="pubmed", rettype="xml", retmode="xml")
+        uids = sync.run()                   << UIDs added or updated since the previous run
+        path = sync.location(uids[0])       << Delta file holding the latest version of a UID
+
+    Store layout:
+
+        watermarks.json         : Per-query watermark (date of the last completed run), and
+                                  the delta file being downloaded by an interrupted run
+        index.db                : dbm index of '<db>\\t<uid>' → delta file name
+        <db>-<YYYYMMDDhhmmss>.<ext>
+                                : Delta files (an interrupted run is resumed by the next one,
+                                  see EHarvest)
+
+    """
+
+    _extensions = { "fasta" : "fasta", "gb" : "gb", "gp" : "gp", "xml" : "xml", "asn.1" : "asn1",
+                    "medline" : "txt", "abstract" : "txt", "uilist" : "txt" }
+
+    def __init__(self, term, store, db="pubmed", datetype="mdat", rettype="xml", retmode="xml",
+                window=None, **search):
+
+        """
+        term            : ESearch query
+        store           : Mirror directory (created if missing)
+        db              : Entrez db searched and harvested
+        datetype        : Date the watermark applies to ('mdat', 'pdat', 'edat')
+        rettype         : EFetch retrieval type
+        retmode         : EFetch retrieval mode
+        window          : Records requested per EFetch call (default: None, adaptive)
+        search          : Further ESearch parameters (field, sort, ...)
+
+        """
+
+        import json
+
+        self._term      = term
+        self._store     = store
+        self._db        = db
+        self._datetype  = datetype
+        self._rettype   = rettype
+        self._retmode   = retmode
+        self._window    = window
+        self._search    = search
+
+        self._key       = json.dumps([ db, datetype, term, rettype, retmode, search ], sort_keys=True)
+        self._lock      = threading.Lock()
+
+        os.makedirs(store, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self._store, name)
+
+    def _watermarks(self):
+
+        import json
+
+        try:
+            with open(self._path("watermarks.json")) as fh:
+                return json.load(fh)
+        except FileNotFoundError:
+            return {}
+
+    def watermark(self):
+
+        """
+        Return the date (YYYY/MM/DD) of the last completed run, or None before the first one
+        """
+
+        return self._watermarks().get(self._key, {}).get("watermark")
+
+    def _update(self, **entry):
+
+        import json
+
+        with self._lock:
+            watermarks = self._watermarks()
+            watermarks.setdefault(self._key, {}).update(entry)
+
+            filename = self._path("watermarks.json")
+
+            with open(f"{filename}.tmp", "w") as fh:
+                json.dump(watermarks, fh, indent=4)
+
+            os.replace(f"{filename}.tmp", filename)
+
+    def run(self, until=None):
+
+        """
+        Synchronize the store, and return the list of UIDs added or updated by this run.
+
+        until           : Upper bound of the run (YYYY/MM/DD, default: today, UTC)
+
+        The new watermark is ``until`` itself: dates have a one-day granularity, so the next
+        run searches again from that day, overlapping by one day rather than missing records
+        modified later the same day.
+
+        """
+
+        import dbm, time
+
+        pending = self._watermarks().get(self._key, {}).get("pending")
+
+        if pending:
+            #
+            # Resume the interrupted run, with its own bounds
+            #
+
+            logging.info("[OBJECTS:SYNC] Resuming interrupted run (%s)", pending["name"])
+
+            name, watermark, until = pending["name"], pending["mindate"], pending["maxdate"]
+        else:
+            now       = time.gmtime()
+            until     = until or time.strftime("%Y/%m/%d", now)
+            watermark = self.watermark()
+
+            extension = self._extensions.get(self._rettype, self._retmode)
+            name      = f"{self._db}-{time.strftime('%Y%m%d%H%M%S', now)}.{extension}"
+
+            self._update(pending={ "name" : name, "mindate" : watermark, "maxdate" : until })
+
+        dates = { "datetype" : self._datetype }
+
+        if watermark:
+            dates["mindate"] = watermark
+            dates["maxdate"] = until
+
+        with span("sync", db=self._db, datetype=self._datetype, mindate=watermark, maxdate=until), scheduled("bulk"):
+
+            harvest = EHarvest(self._term, self._path(name), db=self._db, utility="efetch", window=self._window,
+                        rettype=self._rettype, retmode=self._retmode, **dates, **self._search)
+
+            harvest.run()
+
+            #
+            # Index the History server set the harvest actually fetched
+            #
+
+            uids = harvest.uids()
+
+            logging.info("[OBJECTS:SYNC] %d records changed since %s : %s", len(uids), watermark or "ever", truncated(uids))
+
+            if uids:
+                with self._lock, dbm.open(self._path("index.db"), "c") as index:
+                    for uid in uids:
+                        index[f"{self._db}\t{uid}".encode()] = name.encode()
+            elif os.path.exists(self._path(name)):
+                os.remove(self._path(name))
+
+            harvest.checkpoint().remove()
+
+            self._update(watermark=until, pending=None)
+
+        return uids
+
+    def location(self, uid):
+
+        """
+        Return the path of the delta file holding the latest version of ``uid``, or None
+        """
+
+        import dbm
+
+        try:
+            with self._lock, dbm.open(self._path("index.db"), "r") as index:
+                name = index.get(f"{self._db}\t{uid}".encode())
+
+        except dbm.error:
+            return None
+
+        return self._path(name.decode()) if name else None
+
+all = [ ESync ]
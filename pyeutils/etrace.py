@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 Giulio Piemontese <gpiemont [at] protonmail.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from . import logging
+
+import functools
+
+#
+# Tracer in use: None while tracing is disabled, otherwise any object exposing the
+# OpenTelemetry ``start_as_current_span(name, attributes=...)`` API
+#
+
+_tracer = None
+
+class _ENoopSpan(object):
+
+    """
+    Span returned while tracing is disabled: every operation is a no-op
+    """
+
+    def set_attribute(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NOOP_SPAN = _ENoopSpan()
+
+def enable_tracing(tracer=None):
+
+    """
+    Enable span-based tracing of pipelines, stages and HTTP requests.
+
+    tracer          : An OpenTelemetry-compatible tracer (default: the 'pyeutils' tracer of the
+                      globally configured OpenTelemetry provider, if opentelemetry is installed)
+
+    Return True if tracing has been enabled.
+
+    """
+
+    global _tracer
+
+    if tracer is None:
+        try:
+            from opentelemetry import trace
+        except ImportError as e:
+            logging.warning("[TRACE] opentelemetry is not installed, tracing stays disabled")
+            return False
+
+        tracer = trace.get_tracer("pyeutils")
+
+    _tracer = tracer
+
+    return True
+
+def disable_tracing():
+
+    global _tracer
+
+    _tracer = None
+
+def tracing():
+    return _tracer is not None
+
+def _attributes(attributes):
+
+    """
+    Keep only the attributes with a value, as supported by OpenTelemetry (str, bool, int, float)
+    """
+
+    return { k : v if isinstance(v, (str, bool, int, float)) else str(v)
+             for k, v in attributes.items() if v is not None and v != "" }
+
+def span(name, **attributes):
+
+    """
+    Return a context manager tracing ``name`` as a span nested in the current one
+    """
+
+    if _tracer is None:
+        return _NOOP_SPAN
+
+    return _tracer.start_as_current_span(name, attributes=_attributes(attributes))
+
+def traced(name, before=None, after=None):
+
+    """
+    Decorate a stage method to run it within a span.
+
+    before          : Function of the stage object returning the span attributes
+    after           : Function of the stage object returning attributes set once the stage completed
+                      (e.g. record counts)
+
+    """
+
+    def decorator(method):
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+
+            if _tracer is None:
+                return method(self, *args, **kwargs)
+
+            with span(name, **(before(self) if before else {})) as current:
+                result = method(self, *args, **kwargs)
+
+                if after:
+                    for key, value in _attributes(after(self)).items():
+                        current.set_attribute(key, value)
+
+                return result
+
+        return wrapper
+
+    return decorator
+
+all = [ enable_tracing, disable_tracing, tracing, span, traced ]
@@ -0,0 +1,761 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 Giulio Piemontese <gpiemont [at] protonmail.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from . import logging
+from . evars import EUTILS_BASE
+from . elimit import ERateLimiter
+from . import emetrics
+from . import etrace
+from . ebatch import get_batch_sizer, truncated_response
+from . epayload import EPayload
+from . edeadline import ECancelToken, ECancelled, EDeadlineExceeded, current_token, check_cancelled, bound
+from . import edeadline
+
+import threading
+import time
+
+#
+# Requests whose encoded parameters exceed this many bytes are sent as POST forms: NCBI
+# (and proxies in between) reject URLs much longer than that with an HTTP 414
+#
+
+EUTILS_POST_SIZE = 2000
+
+#
+# Default (connect, read) timeouts of every request, in seconds: the read timeout bounds
+# the silence between two bytes of a response, not its whole download
+#
+
+EUTILS_TIMEOUT = (10.0, 120.0)
+
+##
+## Connection classes measuring DNS, TCP connect and TLS handshake durations into the
+## request record of the current thread, when metrics observers are registered.
+## Built on first use, so that importing pyeutils does not import requests/urllib3.
+##
+
+_adapter_class = None
+
+def _timed_adapter():
+
+    global _adapter_class
+
+    if _adapter_class is not None:
+        return _adapter_class()
+
+    from requests.adapters import HTTPAdapter
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+
+    class _ETimedConnection(object):
+
+        def _new_conn(self):
+
+            record = getattr(emetrics._context, "request", None)
+            host   = getattr(self, "_dns_host", None)
+
+            if record is None or host is None:
+                return super()._new_conn()
+
+            import socket
+
+            start = time.perf_counter()
+
+            try:
+                #
+                # Resolve here to time name resolution apart from the TCP connect
+                #
+                self._dns_host = socket.getaddrinfo(host, self.port, 0, socket.SOCK_STREAM)[0][4][0]
+            except OSError as e:
+                pass
+
+            resolved = time.perf_counter()
+
+            try:
+                return super()._new_conn()
+            finally:
+                self._dns_host  = host
+                record.dns     += resolved - start
+                record.connect += time.perf_counter() - resolved
+
+        def connect(self):
+
+            record = getattr(emetrics._context, "request", None)
+
+            if record is None:
+                return super().connect()
+
+            start  = time.perf_counter()
+            phases = record.dns + record.connect
+
+            try:
+                return super().connect()
+            finally:
+                record.tls += max(0.0, time.perf_counter() - start - (record.dns + record.connect - phases))
+
+    class _ETimedHTTPConnection(_ETimedConnection, HTTPConnection):
+        pass
+
+    class _ETimedHTTPSConnection(_ETimedConnection, HTTPSConnection):
+        pass
+
+    class _ETimedHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = _ETimedHTTPConnection
+
+    class _ETimedHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = _ETimedHTTPSConnection
+
+    class _ETimedAdapter(HTTPAdapter):
+
+        def init_poolmanager(self, *args, **kwargs):
+
+            super().init_poolmanager(*args, **kwargs)
+
+            self.poolmanager.pool_classes_by_scheme = {
+                "http"  : _ETimedHTTPConnectionPool,
+                "https" : _ETimedHTTPSConnectionPool,
+            }
+
+    _adapter_class = _ETimedAdapter
+
+    return _adapter_class()
+
+class _ECall(object):
+
+    """
+    A single upstream call, shared by every caller that issued an identical request
+    while it was in flight.
+
+    """
+
+    def __init__(self):
+
+        self._done      = threading.Event()
+        self._response  = None
+        self._error     = None
+        self._waiters   = 0
+
+    def wait(self, token=None):
+
+        #
+        # Callers joining an in-flight request stop waiting on their own cancellation
+        #
+
+        while not self._done.wait(None if token is None else 0.1):
+            token.check()
+
+        if self._error:
+            raise self._error
+
+        return self._response
+
+
+class ETransport(object):
+
+    """
+    ETransport Class object:
+
+    Shared HTTP transport used by every E-utility object to reach NCBI's Entrez endpoints.
+
+    Concurrent requests carrying the same endpoint and the same (normalized) payload are
+    coalesced in a single-flight fashion: only the first caller reaches NCBI, every other
+    caller waits for it and receives the very same response. This saves rate budget when
+    several threads of a service issue identical ESearch, EInfo or ESummary requests.
+
+    """
+
+    def __init__(self, session=None, coalesce=True, limiter=None, base=None,
+            retries=0, backoff=0.5, sizer=None, post_size=EUTILS_POST_SIZE, compress=True,
+            timeout=EUTILS_TIMEOUT, scheduler=None):
+
+        """
+        Initialize a transport.
+
+        session         : `requests.Session` used for the upstream calls (default: a new Session)
+
+        coalesce        : Share a single upstream call among identical in-flight requests
+                          (default: True)
+
+        limiter         : Rate limiter acquired before every upstream call
+                          (default: an ERateLimiter at the unauthenticated Entrez rate)
+
+        base            : Base URL replacing the NCBI E-utilities one (EUTILS_BASE), e.g. to
+                          reach a mirror or a local stand-in server (default: None)
+
+        retries         : Retry a request this many times on connection errors, HTTP 429 and 5xx
+                          (default: 0)
+
+        backoff         : Seconds waited before the first retry, doubled at each further retry
+
+        sizer           : EBatchSizer told about the latency and outcome of every windowed
+                          (``retmax``) request (default: the process-wide one)
+
+        post_size       : Send GET requests as POST forms when their encoded parameters exceed
+                          this many bytes (default: EUTILS_POST_SIZE)
+
+        compress        : Ask for gzip-compressed responses (default: True), decompressed as
+                          they are read
+
+        timeout         : Timeout of every request, in seconds or as a (connect, read) tuple
+                          (default: EUTILS_TIMEOUT), further bounded by the deadline of the
+                          running pipeline (see ECancelToken)
+
+        scheduler       : EScheduler ordering requests by priority class and job in front of
+                          the rate limiter (default: None, first come first served)
+
+        """
+
+        if session is None:
+            import requests
+
+            session = requests.Session()
+            session.mount("http://", _timed_adapter())
+            session.mount("https://", _timed_adapter())
+
+        self._session   = session
+        self._retries   = retries
+        self._backoff   = backoff
+        self._coalesce  = coalesce
+        self._limiter   = limiter or ERateLimiter()
+        self._base      = base
+        self._sizer     = sizer
+        self._post_size = post_size
+        self._headers   = { "Accept-Encoding" : "gzip" if compress else "identity" }
+        self._timeout   = timeout
+        self._scheduler = scheduler
+
+        self._inflight  = {}
+        self._lock      = threading.Lock()
+
+    @staticmethod
+    def key(url, params, method="GET"):
+
+        """
+        Return a normalized key for a request: parameters are compared regardless of their
+        order, so that 'db=pubmed&term=x' and 'term=x&db=pubmed' share the same upstream call.
+
+        """
+
+        return (method.upper(), url, EPayload.of(params).key())
+
+    def method(self, params, method="GET"):
+
+        """
+        Return the HTTP method ``params`` are sent with: POST if requested, or if their
+        form encoding exceeds ``post_size`` bytes
+        """
+
+        if method.upper() == "POST" or len(EPayload.of(params).encoded()) > self._post_size:
+            return "POST"
+
+        return "GET"
+
+    _form = { "Content-Type" : "application/x-www-form-urlencoded" }
+
+    def _send(self, url, params, method, stream=False):
+
+        """
+        Send a request; streamed responses are reported to the batch sizer once read (see stream())
+        """
+
+        import requests
+
+        if self._base and url.startswith(EUTILS_BASE):
+            url = self._base.rstrip("/") + "/" + url[len(EUTILS_BASE):]
+
+        token   = current_token()
+        timeout = self._timeout if token is None else token.timeout(self._timeout)
+
+        start = time.perf_counter()
+
+        try:
+            if method.upper() == "POST":
+                response = self._session.post(url, data=params.encoded(), headers=dict(self._headers, **self._form),
+                                              stream=stream, timeout=timeout)
+            else:
+                response = self._session.get(url, params=params.encoded(), headers=self._headers, stream=stream,
+                                             timeout=timeout)
+
+        except requests.Timeout as e:
+            if token is not None and token.expired():
+                #
+                # Cut short by the deadline: says nothing about the window size
+                #
+
+                raise EDeadlineExceeded(f"deadline exceeded during request to {url}") from e
+
+            self._adapt(url, params, time.perf_counter() - start, None, None)
+            raise
+
+        if not stream:
+            self._adapt(url, params, time.perf_counter() - start, response.status_code, response.content)
+
+        return response
+
+    def _adapt(self, url, params, elapsed, status, content):
+
+        """
+        Report a windowed (``retmax``) request to the batch sizer
+        """
+
+        if not params.get("retmax") or params.get("rettype") in ("count", "uilist"):
+            return
+
+        endpoint = url.rsplit("/", 1)[-1].replace(".fcgi", "")
+
+        truncated = status == 200 and truncated_response(content, params.get("retmode") or
+                                                         ("text" if endpoint == "efetch" else "xml"))
+
+        (self._sizer or get_batch_sizer()).observe(endpoint, params.get("db", ""), int(params["retmax"]),
+                                                   elapsed, status, truncated)
+
+    def _retry(self, attempt, response=None, error=None):
+
+        """
+        Return True if a failed attempt has to be retried (after a backoff)
+        """
+
+        if attempt >= self._retries:
+            return False
+
+        if response is not None and response.status_code != 429 and response.status_code < 500:
+            return False
+
+        logging.warning(f"[TRANSPORT] Retrying request ({attempt + 1}/{self._retries}) : "
+                        f"{str(error) if error else f'HTTP {response.status_code}'}")
+
+        edeadline.sleep(self._backoff * (2 ** attempt))
+
+        return True
+
+    def _perform(self, url, params, method="GET"):
+
+        if not etrace.tracing():
+            return self._notify(*self._attempts(url, params, method))
+
+        endpoint = url.rsplit("/", 1)[-1].replace(".fcgi", "")
+
+        with etrace.span(f"HTTP {method.upper()} {endpoint}", **{ "http.method" : method.upper(), "http.url" : url }) as span:
+            response = self._notify(*self._attempts(url, params, method))
+
+            span.set_attribute("http.status_code", response.status_code)
+
+            return response
+
+    def _notify(self, response, record):
+
+        if record is not None:
+            emetrics.notify_request(record)
+
+        return response
+
+    def _attempts(self, url, params, method="GET", stream=False):
+
+        """
+        Send a request, retrying it as configured; return the response and its (not yet
+        notified) metrics record, if observing
+        """
+
+        import requests
+
+        record   = None
+        endpoint = url.rsplit("/", 1)[-1].replace(".fcgi", "")
+
+        if emetrics.observing():
+            record = emetrics.ERequestRecord(endpoint, method.upper(), emetrics.current_stage())
+
+        attempt = 0
+
+        while True:
+            check_cancelled()
+
+            if self._scheduler is None:
+                wait = self._limiter.acquire()
+            else:
+                wait = self._scheduler.acquire(self._limiter, endpoint)
+
+            if record is None:
+                try:
+                    response = self._send(url, params, method, stream)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    if self._retry(attempt, error=e):
+                        attempt += 1
+                        continue
+                    raise
+            else:
+                response = self._measure(record, wait, url, params, method, stream)
+                record.retries = attempt
+
+                if record.error and self._retry(attempt, error=record.error):
+                    attempt += 1
+                    continue
+
+                if record.error:
+                    emetrics.notify_request(record)
+                    raise record.error
+
+            if response.status_code == 200 or not self._retry(attempt, response=response):
+                break
+
+            response.close()
+
+            attempt += 1
+
+        return response, record
+
+    def _measure(self, record, wait, url, params, method, stream=False):
+
+        """
+        Send a request, filling ``record`` with the measurements of this attempt
+        """
+
+        import requests
+
+        record.wait    += wait
+        record.dns      = record.connect = record.tls = 0.0
+        record.error    = None
+
+        emetrics._context.request = record
+
+        start = time.perf_counter()
+
+        try:
+            response = self._send(url, params, method, stream)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            record.error = e
+            return None
+        finally:
+            emetrics._context.request = None
+
+        total   = time.perf_counter() - start
+        headers = response.elapsed.total_seconds()
+
+        record.status   = response.status_code
+        record.ttfb     = max(0.0, headers - record.dns - record.connect - record.tls)
+
+        if not stream:
+            record.bytes      = len(response.content)
+            record.wire_bytes = self._wire(response)
+            record.download   = max(0.0, total - headers)
+
+        return response
+
+    @staticmethod
+    def _wire(response):
+
+        """
+        Return the size of the response body as transferred (compressed, if it was)
+        """
+
+        try:
+            return response.raw.tell()
+        except Exception:
+            return len(response.content)
+
+    def request(self, url, params, method="GET"):
+
+        """
+        Perform a request to ``url`` with ``params`` (an EPayload, a dict, a list of pairs or an
+        already encoded query string), coalescing it with an identical in-flight request if any.
+
+        Parameters are form-encoded, in the URL of GET requests or in the body of POST ones;
+        GET requests too large for a URL (see ``post_size``) are sent as POST.
+
+        """
+
+        params    = EPayload.of(params)
+        requested = method.upper()
+        method    = self.method(params, method)
+
+        if method != requested:
+            logging.debug("[TRANSPORT] Parameters too large for a URL, sending a POST request to %s", url)
+
+        if not self._coalesce:
+            return self._perform(url, params, method)
+
+        key = self.key(url, params, method)
+
+        with self._lock:
+            call = self._inflight.get(key)
+
+            if call:
+                call._waiters += 1
+                leader = False
+            else:
+                call = self._inflight[key] = _ECall()
+                leader = True
+
+        if not leader:
+            logging.debug("[TRANSPORT] Joining in-flight request to %s", url)
+
+            try:
+                return call.wait(current_token())
+            except ECancelled:
+                #
+                # The leader has been cancelled, not this caller: send the request on its own
+                #
+
+                check_cancelled()
+
+                return self._perform(url, params, method)
+
+        try:
+            call._response = self._perform(url, params, method)
+        except (Exception, ECancelled) as e:
+            call._error = e
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+            call._done.set()
+
+        if call._waiters:
+            logging.debug("[TRANSPORT] Request to %s shared among %d callers", url, call._waiters + 1)
+
+        return call.wait()
+
+    def stream(self, url, params, method="GET", chunk=1 << 16):
+
+        """
+        Perform a request to ``url`` and yield its body in chunks of decompressed bytes as they
+        arrive, so that large responses are written to their sink without ever being held in
+        memory. Streamed requests are not coalesced.
+
+        Raise an Exception if the final attempt is not answered with an HTTP 200. The running
+        pipeline is checked for cancellation between chunks.
+
+        """
+
+        params = EPayload.of(params)
+        method = self.method(params, method)
+        token  = current_token()
+
+        response, record = self._attempts(url, params, method, stream=True)
+
+        start      = time.perf_counter()
+        head, tail = b"", b""
+        size       = 0
+        status     = response.status_code
+
+        try:
+            if status != 200:
+                raise Exception(f"[TRANSPORT] Request to {url} did not complete successfully "
+                                f"(HTTP {status} : {response.reason})")
+
+            for data in response.iter_content(chunk):
+                if len(head) < 4096:
+                    head += data[:4096 - len(head)]
+
+                tail  = data[-4096:] if len(data) >= 4096 else (tail + data)[-4096:]
+                size += len(data)
+
+                yield data
+
+                if token is not None:
+                    token.check()
+
+        except (GeneratorExit, ECancelled):
+            #
+            # Closed by the consumer or cancelled before the end: says nothing about the window size
+            #
+
+            status = 0
+            raise
+
+        except Exception as e:
+            if token is not None and token.expired():
+                status = 0
+                raise EDeadlineExceeded(f"deadline exceeded during request to {url}") from e
+
+            if status == 200:
+                status = None
+
+            raise
+
+        finally:
+            download = time.perf_counter() - start
+
+            response.close()
+
+            if status != 0:
+                self._adapt(url, params, response.elapsed.total_seconds() + download, status, head + tail)
+
+            if record is not None:
+                record.bytes      = size
+                record.wire_bytes = self._wire(response)
+                record.download   = download
+
+                emetrics.notify_request(record)
+
+    def get(self, url, params):
+        return self.request(url, params, method="GET")
+
+    def post(self, url, params):
+        return self.request(url, params, method="POST")
+
+    def limiter(self):
+        return self._limiter
+
+    def sizer(self):
+        return self._sizer or get_batch_sizer()
+
+    def scheduler(self):
+        return self._scheduler
+
+
+class AsyncETransport(object):
+
+    """
+    AsyncETransport Class object:
+
+    asyncio counterpart of ETransport. Identical requests awaited concurrently by different
+    tasks share one future; upstream calls run in the event loop's default executor through
+    a (sync) ETransport, so that asyncio tasks and plain threads coalesce with each other too.
+
+    Cancelling the awaiting task (e.g. on asyncio.timeout()) cancels the work handed to the
+    executor, which stops at its next request: a coalesced request is cancelled once every
+    task awaiting it has been. The ECancelToken current in the task, if any, is inherited.
+
+    """
+
+    def __init__(self, transport=None):
+
+        self._transport = transport
+        self._inflight  = {}
+
+    def _sync(self):
+        return self._transport or get_transport()
+
+    async def request(self, url, params, method="GET"):
+
+        """
+        Coroutine version of ETransport.request()
+
+        """
+
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        key  = ETransport.key(url, params, method)
+
+        call = self._inflight.get(key)
+
+        if call is None:
+            token  = ECancelToken()
+            future = loop.run_in_executor(None, bound(self._sync().request, token), url, params, method)
+
+            #
+            # [ shared future, its cancel token, tasks awaiting it ]
+            #
+
+            call = self._inflight[key] = [ future, token, 0 ]
+            future.add_done_callback(lambda _, key=key: self._inflight.pop(key, None))
+
+        call[2] += 1
+
+        try:
+            return await asyncio.shield(call[0])
+
+        except asyncio.CancelledError:
+            call[2] -= 1
+
+            if not call[2]:
+                call[1].cancel("asyncio task cancelled")
+
+            raise
+
+        except ECancelled:
+            #
+            # Another task cancelled the shared request: send it on our own
+            #
+
+            check_cancelled()
+
+            return await self._executor(self._sync().request, url, params, method)
+
+    async def get(self, url, params):
+        return await self.request(url, params, method="GET")
+
+    async def post(self, url, params):
+        return await self.request(url, params, method="POST")
+
+    async def results(self, eobj):
+
+        """
+        Await ``eobj.results()`` for any E-utility object (ESearch, EInfo, ESummary, ...)
+        without blocking the event loop.
+
+        """
+
+        return await self._executor(eobj.results)
+
+    async def _executor(self, function, *args):
+
+        """
+        Await ``function(*args)`` in the default executor, cancelling it (at its next request)
+        if the awaiting task is cancelled
+        """
+
+        import asyncio
+
+        loop  = asyncio.get_running_loop()
+        token = ECancelToken()
+
+        try:
+            return await loop.run_in_executor(None, bound(function, token), *args)
+        except asyncio.CancelledError:
+            token.cancel("asyncio task cancelled")
+            raise
+
+##
+## Process-wide default transport
+##
+
+_transport      = None
+_transport_lock = threading.Lock()
+
+def get_transport():
+
+    """
+    Return the transport shared by all E-utility objects (created on first use)
+    """
+
+    global _transport
+
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = ETransport()
+
+    return _transport
+
+def set_transport(transport):
+
+    """
+    Replace the transport shared by all E-utility objects, returning the previous one
+    """
+
+    global _transport
+
+    previous, _transport = _transport, transport
+
+    return previous
+
+all = [ ETransport, AsyncETransport, get_transport, set_transport, EUTILS_POST_SIZE, EUTILS_TIMEOUT ]
@@ -20,4 +20,6 @@
 
 EUTILS_APPNAME = "pyeutils"
 
-all = [ EUTILS_APPNAME ]
+EUTILS_BASE    = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/"
+
+all = [ EUTILS_APPNAME, EUTILS_BASE ]
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 Giulio Piemontese <gpiemont [at] protonmail.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+##
+## Offline benchmarks of pyeutils against the local stand-in server in mockserver.py
+##
+## For every E-utility class, and for the ESearch → ELink → EFetch pipeline, measure:
+##
+##      · throughput (operations per second)
+##      · latency percentiles (p50, p90, p99)
+##      · client CPU time per operation, and the part of it spent parsing results
+##      · peak memory allocated while running the scenario
+##
+## Usage:
+##
+##      $ python3 pyeutils_tests/benchmarks.py [-n 50] [--latency 0.01] [--json results.json]
+##      $ python3 pyeutils_tests/benchmarks.py --baseline results.json     << fail on regressions
+##
+
+import sys, os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import json
+import time
+import tracemalloc
+
+from pyeutils import logging
+from pyeutils.esearch import ESearch
+from pyeutils.elink import ELink
+from pyeutils.epost import EPost
+from pyeutils.efetch import EFetch, esearch_elink_efetch
+from pyeutils.esummary import ESummary
+from pyeutils.etransport import ETransport, set_transport
+from pyeutils.elimit import ERateLimiter
+from pyeutils.emetrics import EObserver, add_observer, remove_observer
+
+from mockserver import MockConfig, MockEUtilsProcess
+
+class ParseTimer(EObserver):
+
+    """
+    Accumulate the CPU time spent parsing results, as reported by every pipeline stage
+    """
+
+    def __init__(self):
+        self.cpu = 0.0
+
+    def stage(self, record):
+        self.cpu += record.parse
+
+    def __enter__(self):
+        return add_observer(self)
+
+    def __exit__(self, *exc):
+        remove_observer(self)
+
+def percentile(values, p):
+
+    values = sorted(values)
+
+    if not values:
+        return 0.0
+
+    k = (len(values) - 1) * p / 100.0
+    f = int(k)
+    c = min(f + 1, len(values) - 1)
+
+    return values[f] + (values[c] - values[f]) * (k - f)
+
+def run(name, operation, iterations):
+
+    """
+    Run ``operation(i)`` ``iterations`` times and return its measurements
+    """
+
+    latencies = []
+    errors    = 0
+
+    tracemalloc.start()
+
+    with ParseTimer() as parse:
+        cpu0  = time.thread_time()
+        wall0 = time.perf_counter()
+
+        for i in range(iterations):
+            start = time.perf_counter()
+
+            try:
+                if not operation(i):
+                    errors += 1
+            except Exception as e:
+                errors += 1
+
+            latencies.append(time.perf_counter() - start)
+
+        wall = time.perf_counter() - wall0
+        cpu  = time.thread_time() - cpu0
+
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "name"          : name,
+        "iterations"    : iterations,
+        "errors"        : errors,
+        "throughput"    : iterations / wall if wall else 0.0,
+        "p50_ms"        : percentile(latencies, 50) * 1000,
+        "p90_ms"        : percentile(latencies, 90) * 1000,
+        "p99_ms"        : percentile(latencies, 99) * 1000,
+        "cpu_ms"        : cpu * 1000 / iterations,
+        "parse_ms"      : parse.cpu * 1000 / iterations,
+        "peak_kib"      : peak / 1024,
+    }
+
+def scenarios(ids):
+
+    """
+    Return the benchmarked operations, as (name, operation) pairs
+    """
+
+    return [
+        ("ESearch",     lambda i: ESearch(f"asthma[mesh]+AND+{2000 + i}[pdat]", retmax=len(ids)).results()),
+        ("ELink",       lambda i: ELink("protein", dbfrom="pubmed", ids=ids).results()),
+        ("EPost",       lambda i: EPost("protein", ids=ids).results()),
+        ("EFetch",      lambda i: EFetch("protein", ids=ids).results()),
+        ("ESummary",    lambda i: ESummary("protein", ids=ids).results()),
+        ("ESearch→ELink→EFetch",
+                        lambda i: esearch_elink_efetch(f"leukotrienes[mesh]+AND+{2000 + i}[pdat]")),
+    ]
+
+def report(results, out=sys.stdout):
+
+    columns = [ ("iterations", "{:>10}"), ("errors", "{:>6}"), ("throughput", "{:>10.2f}"),
+                ("p50_ms", "{:>9.2f}"), ("p90_ms", "{:>9.2f}"), ("p99_ms", "{:>9.2f}"),
+                ("cpu_ms", "{:>9.2f}"), ("parse_ms", "{:>9.2f}"), ("peak_kib", "{:>10.1f}") ]
+
+    print(f"{'name':<22} " + " ".join(f"{name:>{len(fmt.format(0))}}" for name, fmt in columns), file=out)
+
+    for result in results:
+        print(f"{result['name']:<22} " + " ".join(fmt.format(result[name]) for name, fmt in columns), file=out)
+
+def compare(results, baseline, tolerance):
+
+    """
+    Return the list of metrics regressed by more than ``tolerance`` (a fraction) w.r.t. ``baseline``
+    """
+
+    regressions = []
+    previous    = { result["name"] : result for result in baseline }
+
+    for result in results:
+        base = previous.get(result["name"])
+
+        if not base:
+            continue
+
+        for metric in ("p50_ms", "p99_ms", "cpu_ms", "parse_ms", "peak_kib"):
+            if base[metric] and result[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f"{result['name']}: {metric} {base[metric]:.2f} → {result[metric]:.2f}")
+
+        if base["throughput"] and result["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{result['name']}: throughput {base['throughput']:.2f} → {result['throughput']:.2f}")
+
+    return regressions
+
+def main(args=[]):
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Offline pyeutils benchmarks against a local mock E-utilities server")
+
+    parser.add_argument("-n", "--iterations", type=int, default=20)
+    parser.add_argument("--ids", type=int, default=200, help="UIDs per request")
+    parser.add_argument("--latency", type=float, default=0.0, help="Emulated server latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Emulated random extra latency (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of emulated failures")
+    parser.add_argument("--record-scale", type=int, default=1, help="Scale FASTA records payload size")
+    parser.add_argument("--rate", type=float, default=1000.0, help="Client rate limit (req/s)")
+    parser.add_argument("--only", action="append", help="Run only the given scenario(s)")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--baseline", help="Compare against results previously written with --json")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed regression w.r.t. the baseline")
+
+    args = parser.parse_args(args)
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    #
+    # The server runs in a process of its own: its allocations would otherwise count in the
+    # peak memory of the scenarios
+    #
+
+    server = MockEUtilsProcess(MockConfig(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                                count=args.ids, record_scale=args.record_scale)).start()
+
+    set_transport(ETransport(base=server.base(), limiter=ERateLimiter(rate=args.rate)))
+
+    ids = [ str(30000000 + i) for i in range(args.ids) ]
+
+    results = []
+
+    try:
+        for name, operation in scenarios(ids):
+            if args.only and name not in args.only:
+                continue
+
+            results.append(run(name, operation, args.iterations))
+    finally:
+        server.stop()
+
+    report(results)
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(results, fh, indent=4)
+
+    if args.baseline:
+        with open(args.baseline) as fh:
+            regressions = compare(results, json.load(fh), args.tolerance)
+
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+
+        return 1 if regressions else 0
+
+    return 0
+
+if __name__ == "__main__":
+
+    ret = main(args=sys.argv[1:])
+
+    sys.exit(ret)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3.8
+#
+# Copyright (C) 2018-2020 Giulio Piemontese <gpiemont [at] protonmail.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# -*- coding: utf-8 -*-
+#
+
+import sys, os
+import csv
+import tempfile
+
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+
+from pyeutils.eexport import export_rows, have_pyarrow, INT64, STRING
+
+from pyeutils import logging, log_setup
+
+log_setup(loglevel=logging.DEBUG)
+
+##
+## Export a table in every supported format, in several row groups, and read it back.
+## Parquet and Arrow round-trips are skipped when pyarrow is not installed.
+##
+
+columns = [ ("uid", INT64), ("title", STRING) ]
+rows    = [ (30000000 + n, f"Title {n}" if n % 3 else None) for n in range(25) ]
+
+def read_csv(path):
+
+    with open(path, newline="") as fh:
+        lines = list(csv.reader(fh))[1:]
+
+    return [ (int(uid), title or None) for uid, title in lines ]
+
+def read_arrow(path):
+
+    import pyarrow.parquet as pq
+    import pyarrow.feather as feather
+
+    table = pq.read_table(path) if path.endswith(".parquet") else feather.read_table(path)
+
+    return list(zip(*(table.column(name).to_pylist() for name, _ in columns)))
+
+if __name__ == "__main__":
+
+    failed = []
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for extension in (".csv", ".parquet", ".arrow", ".feather"):
+            if extension != ".csv" and not have_pyarrow():
+                logging.info(f"EXPORT {extension} : skipped, pyarrow is not installed")
+                continue
+
+            writer = export_rows(iter(rows), os.path.join(tmpdir, f"table{extension}"), columns, batch=10)
+            result = read_csv(writer.path) if extension == ".csv" else read_arrow(writer.path)
+
+            if result != rows or writer.rows != len(rows):
+                logging.error(f"EXPORT {extension} : rows differ after round-trip")
+                failed.append(extension)
+
+    if failed:
+        sys.exit(1)
+
+    print("OK")
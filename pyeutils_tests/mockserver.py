@@ -0,0 +1,588 @@
+#!/usr/bin/env python3.8
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018-2020 Giulio Piemontese <gpiemont [at] protonmail.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+##
+## Local stand-in for the NCBI E-utilities, used to benchmark (and exercise) pyeutils
+## without network access.
+##
+## Emulates esearch, elink, efetch, esummary, epost, einfo and espell, with History server
+## semantics (WebEnv/query_key sets), configurable latency, error rate, payload sizes and
+## per-API key rate limit. Records are rendered from the templates in fixtures/ .
+##
+## Also serves /ratelimit, a stand-in for the coordination service of ERemoteBucket.
+##
+
+import os, sys
+import multiprocessing
+import random
+import threading
+import time
+import uuid
+import zlib
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+class MockConfig(object):
+
+    """
+    Mock server behaviour:
+
+    latency         : Seconds added to every response
+    jitter          : Random extra latency, in seconds (uniform in [0, jitter])
+    error_rate      : Fraction of requests answered with an HTTP 500 (or ``error_status``)
+    error_status    : HTTP status of emulated failures
+    count           : Number of UIDs matched by every ESearch term
+    links           : Number of target UIDs linked to every input UID by ELink
+    record_scale    : Repeat the fixture sequence this many times in every FASTA record
+    webenv_ttl      : Seconds of inactivity after which a WebEnv expires (0: never)
+    rate_limit      : Requests per second accepted per API key (``api_key`` parameter),
+                      exceeding ones are answered with an HTTP 429 (0: unlimited)
+    record_latency  : Seconds added to every response per record requested (``retmax``)
+    window_limit    : Largest ``retmax`` served, larger windows are answered with an HTTP 502
+                      (0: unlimited)
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=500,
+            count=1000, links=2, record_scale=1, webenv_ttl=0, rate_limit=0, record_latency=0.0,
+            window_limit=0, seed=0):
+
+        self.latency        = latency
+        self.jitter         = jitter
+        self.error_rate     = error_rate
+        self.error_status   = error_status
+        self.count          = count
+        self.links          = links
+        self.record_scale   = record_scale
+        self.webenv_ttl     = webenv_ttl
+        self.rate_limit     = rate_limit
+        self.record_latency = record_latency
+        self.window_limit   = window_limit
+
+        self.random         = random.Random(seed)
+
+class MockHistory(object):
+
+    """
+    Emulated Entrez History server: { WebEnv : { query_key : [ uids ] } }
+    """
+
+    def __init__(self, ttl=0):
+
+        self._ttl       = ttl
+        self._envs      = {}
+        self._used      = {}
+        self._lock      = threading.Lock()
+
+    def post(self, ids, webenv=None):
+
+        with self._lock:
+            if not webenv or webenv not in self._envs:
+                webenv = f"MCID_{uuid.uuid4().hex}"
+                self._envs[webenv] = {}
+
+            querykey = len(self._envs[webenv]) + 1
+
+            self._envs[webenv][querykey] = list(ids)
+            self._used[webenv] = time.time()
+
+        return webenv, querykey
+
+    def get(self, webenv, querykey):
+
+        with self._lock:
+            if webenv not in self._envs:
+                return None
+
+            if self._ttl and time.time() - self._used[webenv] > self._ttl:
+                del self._envs[webenv]
+                return None
+
+            self._used[webenv] = time.time()
+
+            return self._envs[webenv].get(int(querykey or 1))
+
+class MockRateLimit(object):
+
+    """
+    Emulated NCBI rate limiting: at most ``rate`` requests within any 1 second window, per API key
+    """
+
+    def __init__(self, rate):
+
+        self._rate      = rate
+        self._recent    = {}
+        self._lock      = threading.Lock()
+
+        self.rejected   = 0
+
+    def allow(self, key):
+
+        with self._lock:
+            now    = time.monotonic()
+            recent = [ t for t in self._recent.get(key, []) if now - t < 1.0 ]
+
+            if len(recent) >= self._rate:
+                self._recent[key] = recent
+                self.rejected += 1
+                return False
+
+            recent.append(now)
+            self._recent[key] = recent
+
+            return True
+
+class MockBuckets(object):
+
+    """
+    Stand-in for a rate limit coordination service: one token bucket per key, reserved
+    by POSTing key, rate and burst; the reply is the number of seconds to wait
+    """
+
+    def __init__(self):
+
+        self._buckets   = {}
+        self._lock      = threading.Lock()
+
+    def reserve(self, key, rate, burst):
+
+        with self._lock:
+            now = time.monotonic()
+
+            tokens, last = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - last) * rate) - 1
+
+            self._buckets[key] = (tokens, now)
+
+            return 0.0 if tokens >= 0 else -tokens / rate
+
+class MockEUtilsHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    #
+    # Headers and body are written separately: without TCP_NODELAY, Nagle's algorithm holds
+    # the body back until the client's delayed ACK of the headers (~40ms per request)
+    #
+
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle(dict(parse_qsl(urlparse(self.path).query, keep_blank_values=True)))
+
+    def do_POST(self):
+
+        length = int(self.headers.get("Content-Length") or 0)
+        body   = self.rfile.read(length).decode()
+
+        params = dict(parse_qsl(urlparse(self.path).query, keep_blank_values=True))
+        params.update(parse_qsl(body, keep_blank_values=True))
+
+        self._handle(params)
+
+    def _handle(self, params):
+
+        server = self.server
+        config = server.config
+
+        if urlparse(self.path).path.rstrip("/").endswith("/ratelimit"):
+            wait = server.buckets.reserve(params.get("key", ""), float(params["rate"]), float(params["burst"]))
+            return self._reply(200, f"{wait}", "text/plain")
+
+        server.count_request()
+
+        if server.limit and not server.limit.allow(params.get("api_key", "")):
+            return self._reply(429, '{"error":"API rate limit exceeded","count":"%d"}' % config.rate_limit,
+                                "application/json")
+
+        if config.latency or config.jitter:
+            time.sleep(config.latency + config.random.uniform(0, config.jitter))
+
+        if config.error_rate and config.random.random() < config.error_rate:
+            return self._reply(config.error_status, "<ERROR>Emulated failure</ERROR>")
+
+        retmax = int(params.get("retmax") or 0)
+
+        if config.record_latency and retmax:
+            time.sleep(config.record_latency * retmax)
+
+        if config.window_limit and retmax > config.window_limit:
+            return self._reply(502, "<ERROR>Proxy Error</ERROR>")
+
+        endpoint = os.path.basename(urlparse(self.path).path).replace(".fcgi", "")
+        handler  = getattr(server, f"_{endpoint}", None)
+
+        if not handler:
+            return self._reply(404, f"<ERROR>Unknown endpoint '{endpoint}'</ERROR>")
+
+        status, body, ctype = handler(params)
+
+        self._reply(status, body, ctype)
+
+    def _reply(self, status, body, ctype="text/xml"):
+
+        data = body.encode()
+
+        if "gzip" in (self.headers.get("Accept-Encoding") or "") and len(data) > 1024:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+            data = compressor.compress(data) + compressor.flush()
+            encoding = "gzip"
+        else:
+            encoding = None
+
+        self.send_response(status)
+        self.send_header("Content-Type", f"{ctype}; charset=UTF-8")
+        self.send_header("Content-Length", str(len(data)))
+
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+
+        self.end_headers()
+        self.wfile.write(data)
+
+class MockEUtilsServer(ThreadingHTTPServer):
+
+    """
+    Threaded HTTP server emulating https://eutils.ncbi.nlm.nih.gov/entrez/eutils/
+
+        server = MockEUtilsServer(MockConfig(latency=0.05))
+        server.start()
+
+        pyeutils.set_transport(pyeutils.ETransport(base=server.base()))
+        [...]
+        server.stop()
+    """
+
+    daemon_threads = True
+
+    def __init__(self, config=None, address=("127.0.0.1", 0), fixtures=FIXTURES):
+
+        super().__init__(address, MockEUtilsHandler)
+
+        self.config     = config or MockConfig()
+        self.history    = MockHistory(ttl=self.config.webenv_ttl)
+        self.limit      = MockRateLimit(self.config.rate_limit) if self.config.rate_limit else None
+        self.buckets    = MockBuckets()
+        self.requests   = 0
+
+        self._lock      = threading.Lock()
+        self._thread    = None
+
+        with open(os.path.join(fixtures, "protein.fasta")) as fh:
+            self._fasta = fh.read()
+
+        with open(os.path.join(fixtures, "esummary.xml")) as fh:
+            self._docsum = fh.read()
+
+        if self.config.record_scale > 1:
+            header, sequence = self._fasta.split("\n", 1)
+            sequence    = sequence.replace("\n", "") * self.config.record_scale
+            self._fasta = header + "\n" + "".join(sequence[i:i + 70] + "\n" for i in range(0, len(sequence), 70)) + "\n"
+
+    def base(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/entrez/eutils/"
+
+    def ratelimit_url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/ratelimit"
+
+    def start(self):
+
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+        return self
+
+    def stop(self):
+
+        self.shutdown()
+        self.server_close()
+
+    def count_request(self):
+
+        with self._lock:
+            self.requests += 1
+
+    ##
+    ## Emulated endpoints: return (HTTP status, body, content type)
+    ##
+
+    def _uids(self, params):
+
+        """
+        Return the input UIDs of a request, from its id list or its WebEnv/query_key window
+        """
+
+        if params.get("id"):
+            return [ i for i in params["id"].split(",") if i ]
+
+        webenv = params.get("WebEnv") or params.get("webenv")
+
+        if webenv:
+            return self.history.get(webenv, params.get("query_key"))
+
+        return []
+
+    def _window(self, uids, params, default=20):
+
+        retstart = int(params.get("retstart") or 0)
+        retmax   = int(params.get("retmax") or default)
+
+        return uids[retstart:retstart + retmax]
+
+    def _esearch(self, params):
+
+        term  = params.get("term", "")
+        seed  = zlib.crc32(term.encode()) % 1000000
+        uids  = [ str(30000000 + seed + i) for i in range(self.config.count) ]
+
+        if params.get("rettype") == "count":
+            return 200, f"<eSearchResult><Count>{len(uids)}</Count></eSearchResult>", "text/xml"
+
+        history = ""
+
+        if params.get("usehistory") == "y":
+            webenv, querykey = self.history.post(uids, params.get("webenv"))
+            history = f"<QueryKey>{querykey}</QueryKey><WebEnv>{webenv}</WebEnv>"
+
+        window   = self._window(uids, params)
+        retstart = int(params.get("retstart") or 0)
+        ids      = "".join(f"<Id>{uid}</Id>" for uid in window)
+
+        return 200, ('<?xml version="1.0" encoding="UTF-8" ?>\n<eSearchResult>'
+                    f"<Count>{len(uids)}</Count><RetMax>{len(window)}</RetMax><RetStart>{retstart}</RetStart>"
+                    f"{history}<IdList>{ids}</IdList></eSearchResult>"), "text/xml"
+
+    def _elink(self, params):
+
+        uids = self._uids(params)
+
+        if uids is None:
+            return 200, "<eLinkResult><ERROR>Invalid WebEnv</ERROR></eLinkResult>", "text/xml"
+
+        dbfrom, db = params.get("dbfrom", "pubmed"), params.get("db", "pubmed")
+        targets    = [ str(int(uid) * 10 + n) for uid in uids for n in range(self.config.links) ]
+
+        if "history" in params.get("cmd", ""):
+            webenv, querykey = self.history.post(targets, params.get("WebEnv"))
+
+            return 200, ('<?xml version="1.0" encoding="UTF-8" ?>\n<eLinkResult><LinkSet>'
+                        f"<DbFrom>{dbfrom}</DbFrom><LinkSetDbHistory><DbTo>{db}</DbTo>"
+                        f"<LinkName>{params.get('linkname', '')}</LinkName><QueryKey>{querykey}</QueryKey>"
+                        f"</LinkSetDbHistory><WebEnv>{webenv}</WebEnv></LinkSet></eLinkResult>"), "text/xml"
+
+        links = "".join(f"<Link><Id>{uid}</Id></Link>" for uid in targets)
+
+        return 200, ('<?xml version="1.0" encoding="UTF-8" ?>\n<eLinkResult><LinkSet>'
+                    f"<DbFrom>{dbfrom}</DbFrom><IdList>{''.join(f'<Id>{u}</Id>' for u in uids)}</IdList>"
+                    f"<LinkSetDb><DbTo>{db}</DbTo><LinkName>{params.get('linkname', '')}</LinkName>"
+                    f"{links}</LinkSetDb></LinkSet></eLinkResult>"), "text/xml"
+
+    def _epost(self, params):
+
+        webenv, querykey = self.history.post(self._uids(params), params.get("WebEnv"))
+
+        return 200, ('<?xml version="1.0" encoding="UTF-8" ?>\n<ePostResult>'
+                    f"<QueryKey>{querykey}</QueryKey><WebEnv>{webenv}</WebEnv></ePostResult>"), "text/xml"
+
+    def _efetch(self, params):
+
+        uids = self._uids(params)
+
+        if uids is None:
+            return 400, "<ERROR>Unable to obtain query #1</ERROR>", "text/xml"
+
+        window = self._window(uids, params, default=10000)
+
+        if params.get("rettype") == "uilist":
+            return 200, "".join(f"{uid}\n" for uid in window), "text/plain"
+
+        if params.get("rettype", "fasta") == "fasta" and params.get("retmode", "text") == "text":
+            if params.get("seq_start") or params.get("seq_stop"):
+                return 200, "".join(self._region(uid, params) for uid in window), "text/plain"
+
+            return 200, "".join(self._fasta.format(accession=f"NP_{uid}.1") for uid in window), "text/plain"
+
+        sequence = self._fasta.split("\n", 1)[1].replace("\n", "")
+        records  = "".join(f"<TSeq><TSeq_accver>NP_{uid}.1</TSeq_accver><TSeq_sequence>{sequence}</TSeq_sequence></TSeq>"
+                            for uid in window)
+
+        return 200, f'<?xml version="1.0" encoding="UTF-8" ?>\n<TSeqSet>{records}</TSeqSet>', "text/xml"
+
+    _complement = str.maketrans("ACGTacgt", "TGCAtgca")
+
+    def _region(self, uid, params):
+
+        """
+        Render the seq_start..seq_stop region (1-based, inclusive) of a FASTA record, reverse
+        complemented on strand 2
+        """
+
+        header, sequence = self._fasta.split("\n", 1)
+        sequence = sequence.replace("\n", "")
+
+        start    = max(int(params.get("seq_start") or 1), 1)
+        stop     = min(int(params.get("seq_stop") or len(sequence)), len(sequence))
+        region   = sequence[start - 1:stop]
+
+        if params.get("strand") == "2":
+            region = region.translate(self._complement)[::-1]
+
+        accession = uid if not uid.isdigit() else f"NP_{uid}.1"
+        location  = f"c{stop}-{start}" if params.get("strand") == "2" else f"{start}-{stop}"
+
+        return (f"{header.format(accession=f'{accession}:{location}')}\n"
+                + "".join(region[i:i + 70] + "\n" for i in range(0, len(region), 70)) + "\n")
+
+    def _esummary(self, params):
+
+        uids = self._uids(params)
+
+        if uids is None:
+            return 200, "<eSummaryResult><ERROR>Invalid WebEnv</ERROR></eSummaryResult>", "text/xml"
+
+        #
+        # ESummary's retstart is 1-based
+        #
+
+        retstart = max(int(params.get("retstart") or 1) - 1, 0)
+        retmax   = int(params.get("retmax") or 10000)
+        docsums  = "".join(self._docsum.format(uid=uid, accession=f"NP_{uid}.1")
+                            for uid in uids[retstart:retstart + retmax])
+
+        return 200, ('<?xml version="1.0" encoding="UTF-8" ?>\n<eSummaryResult><DocumentSummarySet status="OK">'
+                    f"{docsums}</DocumentSummarySet></eSummaryResult>"), "text/xml"
+
+    def _ecitmatch(self, params):
+
+        #
+        # Citations are matched to a PMID derived from their journal, year and first page
+        #
+
+        lines = [ line for line in params.get("bdata", "").split("\r") if line ]
+        pmids = [ str(10000000 + zlib.crc32("|".join(line.split("|")[:4]).encode()) % 1000000) for line in lines ]
+
+        return 200, "".join(f"{line}{pmid}\n" for line, pmid in zip(lines, pmids)), "text/plain"
+
+    def _einfo(self, params):
+
+        if not params.get("db"):
+            return 200, ("<eInfoResult><DbList><DbName>pubmed</DbName><DbName>protein</DbName>"
+                        "<DbName>nuccore</DbName><DbName>gene</DbName></DbList></eInfoResult>"), "text/xml"
+
+        db = params["db"]
+
+        return 200, (f"<eInfoResult><DbInfo><DbName>{db}</DbName><FieldList>"
+                    "<Field><Name>ALL</Name><FullName>All Fields</FullName></Field>"
+                    "<Field><Name>TITL</Name><FullName>Title</FullName></Field></FieldList><LinkList>"
+                    + "".join(f"<Link><Name>{db}_{to}</Name><DbTo>{to}</DbTo></Link>" for to in ("pubmed", "protein", "gene"))
+                    + "</LinkList></DbInfo></eInfoResult>"), "text/xml"
+
+    def _espell(self, params):
+
+        term = params.get("term", "")
+
+        return 200, (f"<eSpellResult><Database>{params.get('db', 'pubmed')}</Database><Query>{term}</Query>"
+                    f"<CorrectedQuery>{term.rstrip('x')}</CorrectedQuery></eSpellResult>"), "text/xml"
+
+class MockEUtilsProcess(object):
+
+    """
+    MockEUtilsProcess Class object:
+
+    A MockEUtilsServer running in a child process, so that its CPU time and allocations are
+    not accounted to the client (e.g. by benchmarks).
+
+        server = MockEUtilsProcess(MockConfig(latency=0.05)).start()
+        [...]
+        server.stop()
+    """
+
+    def __init__(self, config=None, fixtures=FIXTURES):
+
+        self.config     = config or MockConfig()
+
+        self._fixtures  = fixtures
+        self._process   = None
+        self._address   = None
+
+    @staticmethod
+    def _serve(config, fixtures, conn):
+
+        server = MockEUtilsServer(config, fixtures=fixtures)
+
+        conn.send(server.server_address)
+        conn.close()
+
+        server.serve_forever()
+
+    def base(self):
+        return f"http://{self._address[0]}:{self._address[1]}/entrez/eutils/"
+
+    def ratelimit_url(self):
+        return f"http://{self._address[0]}:{self._address[1]}/ratelimit"
+
+    def start(self):
+
+        parent, child = multiprocessing.Pipe()
+
+        self._process = multiprocessing.Process(target=self._serve, args=(self.config, self._fixtures, child), daemon=True)
+        self._process.start()
+
+        self._address = parent.recv()
+        parent.close()
+
+        return self
+
+    def stop(self):
+
+        self._process.terminate()
+        self._process.join()
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local stand-in for the NCBI E-utilities")
+
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--rate-limit", type=int, default=0)
+
+    args = parser.parse_args()
+
+    server = MockEUtilsServer(MockConfig(latency=args.latency, jitter=args.jitter,
+                                error_rate=args.error_rate, count=args.count, rate_limit=args.rate_limit),
+                              address=("127.0.0.1", args.port))
+
+    print(f"Serving mock E-utilities on {server.base()}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
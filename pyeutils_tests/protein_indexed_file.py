@@ -0,0 +1,75 @@
+#!/usr/bin/env python3.8
+#
+# Copyright (C) 2018-2020 Giulio Piemontese <gpiemont [at] protonmail.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# -*- coding: utf-8 -*-
+#
+
+import sys, os
+import tempfile
+
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+
+from pyeutils.eindex import EIndexedFile, build_index
+
+from pyeutils import logging, log_setup
+
+log_setup(loglevel=logging.DEBUG)
+
+##
+## Index a FASTA file built from the fixtures, and keep records returned by
+## EIndexedFile alive across close(): closing must not fail, and the records
+## must stay readable
+##
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+if __name__ == "__main__":
+
+    with open(os.path.join(FIXTURES, "protein.fasta")) as fh:
+        template = fh.read()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "proteins.fasta")
+
+        with open(path, "w") as fh:
+            fh.write("".join(template.format(accession=f"NP_{n}.1") for n in range(3)))
+
+        build_index(path, "fasta")
+
+        with EIndexedFile(path) as fasta:
+            record   = fasta.record("NP_1.1")
+            sequence = fasta.sequence("NP_2.1", 1, 10)
+
+        if bytes(sequence) != b"MPEIVDTCSL" or not bytes(record).startswith(b"MPEIVDTCSL"):
+            logging.error("INDEX : records not readable after close()")
+            sys.exit(1)
+
+        try:
+            fasta.record("NP_0.1")
+        except ValueError:
+            pass
+        else:
+            logging.error("INDEX : closed file still readable")
+            sys.exit(2)
+
+        record.release()
+        sequence.release()
+
+    print("OK")
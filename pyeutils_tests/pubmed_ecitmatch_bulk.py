@@ -0,0 +1,66 @@
+#!/usr/bin/env python3.8
+#
+# Copyright (C) 2018-2020 Giulio Piemontese <gpiemont [at] protonmail.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# -*- coding: utf-8 -*-
+#
+
+import sys, os
+
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+
+from pyeutils.ecit import ECit
+from pyeutils.ecitmatch import ecitmatch_bulk
+from pyeutils.elimit import ERateLimiter
+from pyeutils.etransport import ETransport, set_transport
+
+from pyeutils_tests.mockserver import MockConfig, MockEUtilsServer
+
+from pyeutils import logging, log_setup
+
+log_setup(loglevel=logging.DEBUG)
+
+##
+## Match citations in batches against the mock E-utilities server, half of the
+## requests failing: the citations of failed batches are kept, unmatched
+##
+
+citations = [ ECit("proc natl acad sci u s a", 1991, 88, 3248 + n, "mann bj", f"citation_{n}") for n in range(8) ]
+
+if __name__ == "__main__":
+
+    server = MockEUtilsServer(MockConfig(error_rate=0.5, error_status=400, seed=3)).start()
+
+    try:
+        set_transport(ETransport(base=server.base(), limiter=ERateLimiter(1000)))
+
+        matches = ecitmatch_bulk(citations, batch_size=2, max_workers=1)
+
+    finally:
+        server.stop()
+
+    print(matches)
+
+    if sorted(matches) != sorted(f"citation_{n}" for n in range(8)):
+        logging.error("ECITMATCH : missing keys")
+        sys.exit(1)
+
+    if all(pmid is None for pmid in matches.values()) or all(pmid is not None for pmid in matches.values()):
+        logging.error("ECITMATCH : expected both matched and failed batches")
+        sys.exit(2)
@@ -28,9 +28,9 @@ from pyeutils.esearch import ESearch
 from pyeutils.elink import ELink
 from pyeutils.efetch import EFetch
 
-from pyeutils import logging
+from pyeutils import logging, log_setup
 
-logging.getLogger().setLevel(logging.DEBUG)
+log_setup(loglevel=logging.DEBUG)
 
 ##
 ## Test ESearch-ELink-EFetch Pipeline with a test query from
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3.8
+#
+# Copyright (C) 2018-2020 Giulio Piemontese <gpiemont [at] protonmail.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# -*- coding: utf-8 -*-
+#
+
+import sys, os
+
+sys.path.insert(0, "../")
+sys.path.insert(0, "./")
+
+from pyeutils.esession import ESession
+from pyeutils.elimit import ERateLimiter
+from pyeutils.etransport import ETransport, set_transport
+
+from pyeutils_tests.mockserver import MockConfig, MockEUtilsServer
+
+from pyeutils import logging, log_setup
+
+log_setup(loglevel=logging.DEBUG)
+
+##
+## Request DocSummaries through a session against the mock E-utilities server, then
+## again once every request fails: the session tries to refresh its WebEnv and reports
+## the failure
+##
+
+query = 'asthma[mesh]+AND+leukotrienes[mesh]+AND+2009[pdat]'
+
+if __name__ == "__main__":
+
+    server = MockEUtilsServer(MockConfig(count=20, error_status=400)).start()
+
+    try:
+        set_transport(ETransport(base=server.base(), limiter=ERateLimiter(1000)))
+
+        session = ESession()
+        search  = session.search(query, db="pubmed")
+
+        if "<DocumentSummary" not in session.summary(search):
+            logging.error("ESUMMARY")
+            sys.exit(1)
+
+        server.config.error_rate = 1.0
+
+        try:
+            session.summary(search)
+        except Exception as e:
+            if type(e) is not Exception or "[OBJECTS:SESSION]" not in str(e):
+                raise
+
+            logging.info(f"ESUMMARY failure reported : {e}")
+        else:
+            logging.error("ESUMMARY : failure not reported")
+            sys.exit(2)
+
+    finally:
+        server.stop()